@@ -1,5 +1,7 @@
 from .worker import Worker
+from .async_worker import AsyncWorker
 from .job import NutsJob
 from .cron import Cron
 from .queue import WorkQueue
+from .async_queue import AsyncWorkQueue
 from .workflow import NutsWorkflow
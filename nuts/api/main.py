@@ -8,6 +8,9 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from redis import Redis
 
+from ..connection import connect
+from ..queue import WorkQueue
+
 from .routes import jobs, workflows
 
 
@@ -16,13 +19,21 @@ async def lifespan(app: FastAPI):
     """Manage application lifespan - setup and teardown Redis connection."""
     # Startup: create Redis connection
     redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379")
-    app.state.redis = Redis.from_url(redis_url, decode_responses=False)
+    # NUTS_SENTINELS is a comma separated list of host:port, the master is looked up through them instead
+    sentinels = [
+        (host, int(port))
+        for host, _, port in (s.strip().rpartition(":") for s in os.environ.get("NUTS_SENTINELS", "").split(","))
+        if host
+    ]
+    service_name = os.environ.get("NUTS_SENTINEL_SERVICE", "mymaster")
+    app.state.redis = connect(redis_url, sentinels, service_name, decode_responses=False)
 
     # Test connection
     try:
         app.state.redis.ping()
     except Exception as e:
-        raise RuntimeError(f"Failed to connect to Redis at {redis_url}: {e}")
+        raise RuntimeError(f"Failed to connect to Redis at {sentinels or redis_url}: {e}")
+    app.state.queue = WorkQueue(app.state.redis, fifo=app.state.fifo, shards=app.state.shards)
 
     yield
 
@@ -33,6 +44,8 @@ async def lifespan(app: FastAPI):
 def create_app(
     redis: Optional[Redis] = None,
     cors_origins: Optional[list[str]] = None,
+    fifo: Optional[bool] = None,
+    shards: Optional[int] = None,
 ) -> FastAPI:
     """Create and configure the FastAPI application.
 
@@ -40,6 +53,10 @@ def create_app(
         redis: Optional Redis client to use. If not provided, will connect
                using REDIS_URL environment variable.
         cors_origins: List of allowed CORS origins. Defaults to allowing all.
+        fifo: Enqueue jobs on the FIFO queue. Defaults to the NUTS_FIFO
+              environment variable.
+        shards: Number of shards the pending queues are split over. Defaults
+                to the NUTS_SHARDS environment variable, or 1.
 
     Returns:
         Configured FastAPI application.
@@ -56,6 +73,16 @@ def create_app(
     if redis:
         app.state.redis = redis
 
+    if fifo is None:
+        fifo = os.environ.get("NUTS_FIFO", "false").lower() in ("1", "true")
+    app.state.fifo = fifo
+    if shards is None:
+        shards = int(os.environ.get("NUTS_SHARDS", "1"))
+    app.state.shards = shards
+    # Jobs are enqueued through one queue, so its scripts are registered once and the shards are dealt out in turn
+    if redis:
+        app.state.queue = WorkQueue(redis, fifo=fifo, shards=shards)
+
     # Configure CORS
     if cors_origins is None:
         cors_origins = ["*"]
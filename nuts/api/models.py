@@ -1,14 +1,24 @@
 """Pydantic models for API request/response schemas."""
 
 from datetime import datetime
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 from pydantic import BaseModel, Field
 
 
+Priority = Literal["high", "default", "low"]
+
+
 class PendingJob(BaseModel):
     """A job waiting in the pending queue."""
     name: str
     params: list[Any] = Field(default_factory=list)
+    priority: Priority = "default"
+
+
+class QueueDepth(BaseModel):
+    """Number of jobs waiting in one priority lane of the pending queue."""
+    priority: Priority
+    pending: int
 
 
 class RunningJob(BaseModel):
@@ -33,6 +43,14 @@ class ScheduledJob(BaseModel):
     next_run: datetime
 
 
+class DelayedJob(BaseModel):
+    """A job published to run at a later time, with its arguments."""
+    name: str
+    params: list[Any] = Field(default_factory=list)
+    priority: Priority = "default"
+    run_at: datetime
+
+
 class WorkflowJobStatus(BaseModel):
     """Status of a job within a workflow."""
     name: str
@@ -61,6 +79,10 @@ class JobEnqueueRequest(BaseModel):
     """Request to enqueue a new job."""
     name: str
     params: list[Any] = Field(default_factory=list)
+    priority: Priority = "default"
+    dedupe_key: Optional[str] = None
+    dedupe_ttl: int = Field(default=0, ge=0)
+    keep_result: bool = False
 
 
 class JobScheduleRequest(BaseModel):
@@ -68,6 +90,12 @@ class JobScheduleRequest(BaseModel):
     name: str
     run_at: datetime
     params: list[Any] = Field(default_factory=list)
+    priority: Priority = "default"
+
+
+class JobRescheduleRequest(BaseModel):
+    """Request to move the next run of a cron job."""
+    run_at: datetime
 
 
 class WorkflowTriggerRequest(BaseModel):
@@ -86,6 +114,29 @@ class SuccessResponse(BaseModel):
     message: str
 
 
+class JobEnqueueResponse(SuccessResponse):
+    """Response to enqueuing a job, with its id when its result is kept."""
+    id: Optional[str] = None
+
+
+class JobBulkEnqueueResponse(SuccessResponse):
+    """Response to a bulk enqueue. Jobs are identified by their line number in the request, from 1."""
+    enqueued: int = 0
+    ids: dict[int, str] = Field(default_factory=dict)
+    skipped: list[int] = Field(default_factory=list)
+    errors: dict[int, str] = Field(default_factory=dict)
+
+
+class JobResult(BaseModel):
+    """The stored outcome of a job enqueued with keep_result."""
+    id: str
+    name: str
+    success: bool
+    result: Any = None
+    error: Optional[str] = None
+    finished_at: datetime
+
+
 class ErrorResponse(BaseModel):
     """Error response."""
     success: bool = False
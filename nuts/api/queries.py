@@ -2,11 +2,20 @@
 
 import json
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Iterable, Optional, Union
 from redis import Redis
 
+from ..priority import DEFAULT, PRIORITIES, job_payload, lane_key, payload_priority
+from ..results import get_result
+from ..codecs import decode_payload
+from ..queue import WorkQueue
+from ..shards import shard_keys
 from .models import (
+    DelayedJob,
+    JobEnqueueRequest,
+    JobResult,
     PendingJob,
+    QueueDepth,
     RunningJob,
     CompletedJob,
     ScheduledJob,
@@ -19,30 +28,61 @@ from .models import (
 SCHEDULED_QUEUE = "nuts|jobs|scheduled"
 RUNNING_QUEUE = "nuts|jobs|running"
 PENDING_QUEUE = "nuts|jobs|pending"
+FIFO_QUEUE = "nuts|jobs|queue"
+DELAYED_QUEUE = "nuts|jobs|delayed"
 COMPLETED_QUEUE = "nuts|jobs|completed"
 SCHEDULED_WORKFLOW_QUEUE = "nuts|workflows|scheduled"
 RUNNING_WORKFLOW_QUEUE = "nuts|workflows|running"
 CANCEL_QUEUE = "nuts|jobs|cancel"
 
 
-def get_pending_jobs(redis: Redis) -> list[PendingJob]:
-    """Get all jobs in the pending queue."""
+def _lanes(queue: str, priority: str, shards: int) -> list[str]:
+    """A priority lane of a queue in every shard."""
+    return [lane_key(shard, priority) for shard in shard_keys(queue, shards)]
+
+
+def get_pending_jobs(redis: Redis, shards: int = 1) -> list[PendingJob]:
+    """Get all jobs in the pending queue, across all its shards.
+
+    Jobs are listed by priority, most urgent first. Within a priority FIFO
+    queued jobs are listed first, in the order they will run in each shard.
+    """
     jobs = []
-    members = redis.smembers(PENDING_QUEUE)
+    members = []
+    for priority in PRIORITIES:
+        for lane in _lanes(FIFO_QUEUE, priority, shards):
+            members += redis.lrange(lane, 0, -1)
+        for lane in _lanes(PENDING_QUEUE, priority, shards):
+            members += list(redis.smembers(lane))
     for member in members:
-        if isinstance(member, bytes):
-            member = member.decode()
-        data = json.loads(member)
+        data = decode_payload(member)
         name = data[0]
         params = data[1] if len(data) > 1 else []
         # Handle workflow job names
         if "|" in name and "workflow" in name:
             # Format: workflow-{name}|{job_name}
             name = name.split("|")[1]
-        jobs.append(PendingJob(name=name, params=params))
+        jobs.append(PendingJob(name=name, params=params, priority=payload_priority(data)))
     return jobs
 
 
+def get_queue_depth(redis: Redis, shards: int = 1) -> list[QueueDepth]:
+    """Get the number of pending jobs in each priority lane across all shards, most urgent first."""
+    depths = []
+    pipe = redis.pipeline(transaction=False)
+    for priority in PRIORITIES:
+        for lane in _lanes(FIFO_QUEUE, priority, shards):
+            pipe.llen(lane)
+        for lane in _lanes(PENDING_QUEUE, priority, shards):
+            pipe.scard(lane)
+    counts = pipe.execute()
+    per_priority = 2 * max(1, shards)
+    for i, priority in enumerate(PRIORITIES):
+        pending = sum(counts[i * per_priority:(i + 1) * per_priority])
+        depths.append(QueueDepth(priority=priority, pending=pending))
+    return depths
+
+
 def get_running_jobs(redis: Redis) -> list[RunningJob]:
     """Get all currently running jobs."""
     jobs = []
@@ -53,14 +93,20 @@ def get_running_jobs(redis: Redis) -> list[RunningJob]:
         if isinstance(value, bytes):
             value = value.decode()
 
-        # Key format: {worker_id}|{job_name}
+        # Key format: {worker_id}|{job_name}|{execution_id}
         parts = key.split("|")
         worker_id = parts[0]
         job_name = parts[1] if len(parts) > 1 else key
 
         data = json.loads(value)
         started_at = datetime.fromisoformat(data.get("timestamp", datetime.now(timezone.utc).isoformat()))
-        params = data.get("args", [])
+        if "payload" in data:
+            params = json.loads(data["payload"])[1]
+        elif "name" in data:
+            # Jobs with encoded payloads are only recorded by name and options while they run
+            params = []
+        else:
+            params = data.get("args", [])
 
         jobs.append(RunningJob(
             name=job_name,
@@ -112,6 +158,17 @@ def get_scheduled_jobs(redis: Redis) -> list[ScheduledJob]:
     return jobs
 
 
+def get_delayed_jobs(redis: Redis, limit: int = 1000) -> list[DelayedJob]:
+    """Get the jobs published to run later, soonest first, at most limit of them."""
+    jobs = []
+    for member, timestamp in redis.zrange(DELAYED_QUEUE, 0, limit - 1, withscores=True):
+        data = decode_payload(member)
+        params = data[1] if isinstance(data[1], list) else []
+        run_at = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+        jobs.append(DelayedJob(name=data[0], params=params, priority=payload_priority(data), run_at=run_at))
+    return jobs
+
+
 def get_scheduled_workflows(redis: Redis) -> list[ScheduledWorkflow]:
     """Get all scheduled workflows with their next run times."""
     workflows = []
@@ -193,24 +250,95 @@ def get_workflow(redis: Redis, name: str) -> Optional[WorkflowStatus]:
     return None
 
 
-def enqueue_job(redis: Redis, name: str, params: list) -> bool:
-    """Add a job to the pending queue."""
-    redis.sadd(PENDING_QUEUE, json.dumps([name, params]))
-    return True
+def enqueue_job(
+    redis: Redis,
+    name: str,
+    params: list,
+    fifo: bool = False,
+    priority: str = DEFAULT,
+    dedupe_key: Optional[str] = None,
+    dedupe_ttl: int = 0,
+    keep_result: bool = False,
+    shards: int = 1,
+    queue: Optional[WorkQueue] = None,
+) -> Union[str, bool]:
+    """Add a job to the pending queue lane for its priority, or the FIFO queue lane when workers run in FIFO mode.
+
+    Returns the job id when keep_result is set, otherwise True. Returns False if a job
+    with the same dedupe key is still pending or running, or finished successfully
+    within its dedupe_ttl. The app passes the queue it built at startup, fifo and
+    shards only apply without one.
+    """
+    queue = queue or WorkQueue(redis, fifo=fifo, shards=shards)
+    return queue.publish(name, params, priority, dedupe_key=dedupe_key, dedupe_ttl=dedupe_ttl, keep_result=keep_result)
 
 
-def schedule_job(redis: Redis, name: str, run_at: datetime) -> bool:
-    """Schedule a job for a specific time."""
-    timestamp = run_at.timestamp()
-    redis.zadd(SCHEDULED_QUEUE, {name: timestamp})
-    return True
+def enqueue_jobs(
+    redis: Redis,
+    jobs: Iterable[JobEnqueueRequest],
+    fifo: bool = False,
+    chunk_size: int = 1000,
+    shards: int = 1,
+    queue: Optional[WorkQueue] = None,
+) -> list[Union[str, bool]]:
+    """Add many jobs with one pipelined round trip per chunk of them.
+
+    Returns the outcome of each job in order, as enqueue_job would return it.
+    """
+    queue = queue or WorkQueue(redis, fifo=fifo, shards=shards)
+    return queue.publish_many(
+        (
+            {
+                "job_name": job.name,
+                "job_parameters": job.params,
+                "priority": job.priority,
+                "dedupe_key": job.dedupe_key,
+                "dedupe_ttl": job.dedupe_ttl,
+                "keep_result": job.keep_result,
+            }
+            for job in jobs
+        ),
+        chunk_size,
+    )
+
+
+def get_job_result(redis: Redis, job_id: str) -> Optional[JobResult]:
+    """Get the stored result of a job enqueued with keep_result."""
+    record = get_result(redis, job_id)
+    if record is None:
+        return None
+    return JobResult(**record)
+
+
+def schedule_job(
+    redis: Redis,
+    name: str,
+    run_at: datetime,
+    params: list = None,
+    fifo: bool = False,
+    priority: str = DEFAULT,
+    queue: Optional[WorkQueue] = None,
+) -> bool:
+    """Schedule a job with its arguments for a specific time.
+
+    The job waits in the delayed queue, so it doesn't touch the job's cron schedule
+    and any number of runs of it can be scheduled.
+    """
+    queue = queue or WorkQueue(redis, fifo=fifo)
+    return bool(queue.publish_at(run_at, name, params or [], priority=priority))
 
 
-def cancel_pending_job(redis: Redis, name: str, params: list = None) -> bool:
-    """Remove a job from the pending queue."""
+def cancel_pending_job(redis: Redis, name: str, params: list = None, shards: int = 1) -> bool:
+    """Remove a job from the pending queue, whichever priority and shard it was enqueued on."""
     if params is None:
         params = []
-    removed = redis.srem(PENDING_QUEUE, json.dumps([name, params]))
+    removed = 0
+    for priority in PRIORITIES:
+        payload = job_payload(name, params, priority)
+        for lane in _lanes(PENDING_QUEUE, priority, shards):
+            removed += redis.srem(lane, payload)
+        for lane in _lanes(FIFO_QUEUE, priority, shards):
+            removed += redis.lrem(lane, 0, payload)
     return removed > 0
 
 
@@ -220,6 +348,20 @@ def cancel_scheduled_job(redis: Redis, name: str) -> bool:
     return removed > 0
 
 
+def reschedule_scheduled_job(redis: Redis, name: str, run_at: datetime) -> bool:
+    """Move the next run of a cron job to a specific time, naive datetimes are taken to be UTC.
+
+    Unlike schedule_job this doesn't add a run, the job runs at run_at instead of its next
+    scheduled time and follows its schedule after that. Returns False if the job isn't scheduled.
+    """
+    if run_at.tzinfo is None:
+        run_at = run_at.replace(tzinfo=timezone.utc)
+    if redis.zscore(SCHEDULED_QUEUE, name) is None:
+        return False
+    redis.zadd(SCHEDULED_QUEUE, {name: run_at.timestamp()}, xx=True)
+    return True
+
+
 def request_job_cancellation(redis: Redis, job_identifier: str) -> bool:
     """Request cancellation of a running job.
 
@@ -1,13 +1,20 @@
 """Job API endpoints."""
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import ValidationError
 
 from ..models import (
+    DelayedJob,
     PendingJob,
+    QueueDepth,
     RunningJob,
     CompletedJob,
     ScheduledJob,
+    JobBulkEnqueueResponse,
     JobEnqueueRequest,
+    JobEnqueueResponse,
+    JobResult,
+    JobRescheduleRequest,
     JobScheduleRequest,
     SuccessResponse,
 )
@@ -19,7 +26,13 @@ router = APIRouter(prefix="/api/jobs", tags=["jobs"])
 @router.get("/pending", response_model=list[PendingJob])
 async def list_pending_jobs(request: Request) -> list[PendingJob]:
     """List all jobs in the pending queue."""
-    return queries.get_pending_jobs(request.app.state.redis)
+    return queries.get_pending_jobs(request.app.state.redis, request.app.state.shards)
+
+
+@router.get("/pending/depth", response_model=list[QueueDepth])
+async def pending_queue_depth(request: Request) -> list[QueueDepth]:
+    """Number of pending jobs per priority."""
+    return queries.get_queue_depth(request.app.state.redis, request.app.state.shards)
 
 
 @router.get("/running", response_model=list[RunningJob])
@@ -40,24 +53,116 @@ async def list_scheduled_jobs(request: Request) -> list[ScheduledJob]:
     return queries.get_scheduled_jobs(request.app.state.redis)
 
 
-@router.post("", response_model=SuccessResponse)
-async def enqueue_job(request: Request, job: JobEnqueueRequest) -> SuccessResponse:
-    """Enqueue a job for immediate execution."""
-    queries.enqueue_job(request.app.state.redis, job.name, job.params)
-    return SuccessResponse(message=f"Job '{job.name}' enqueued successfully")
+@router.get("/results/{job_id}", response_model=JobResult)
+async def get_job_result(request: Request, job_id: str) -> JobResult:
+    """Get the result of a job enqueued with keep_result."""
+    result = queries.get_job_result(request.app.state.redis, job_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No result for job '{job_id}', it hasn't finished or the result has expired")
+    return result
+
+
+@router.post("", response_model=JobEnqueueResponse)
+async def enqueue_job(request: Request, job: JobEnqueueRequest) -> JobEnqueueResponse:
+    """Enqueue a job for immediate execution, high priority jobs are taken before the rest.
+
+    A job whose dedupe_key is still held by an earlier one is not enqueued again. With
+    keep_result the response carries the id to fetch the job's result with.
+    """
+    enqueued = queries.enqueue_job(
+        request.app.state.redis,
+        job.name,
+        job.params,
+        request.app.state.fifo,
+        job.priority,
+        job.dedupe_key,
+        job.dedupe_ttl,
+        job.keep_result,
+        request.app.state.shards,
+        request.app.state.queue,
+    )
+    if not enqueued:
+        return JobEnqueueResponse(message=f"Job '{job.name}' is a duplicate of dedupe key '{job.dedupe_key}', not enqueued")
+    return JobEnqueueResponse(
+        message=f"Job '{job.name}' enqueued successfully with {job.priority} priority",
+        id=enqueued if job.keep_result else None,
+    )
+
+
+@router.post("/bulk", response_model=JobBulkEnqueueResponse)
+async def enqueue_jobs(request: Request, chunk_size: int = Query(default=1000, ge=1)) -> JobBulkEnqueueResponse:
+    """Enqueue jobs streamed as NDJSON, one enqueue request per line.
+
+    The body is read as it arrives and jobs are enqueued chunk_size at a time, so
+    a batch never has to be held in memory whole. Blank lines are ignored, lines
+    that aren't valid requests are reported in errors and the rest still enqueued.
+    """
+    response = JobBulkEnqueueResponse(message="")
+    chunk: list[tuple[int, JobEnqueueRequest]] = []
+
+    def enqueue_chunk():
+        outcomes = queries.enqueue_jobs(
+            request.app.state.redis,
+            (job for _, job in chunk),
+            request.app.state.fifo,
+            chunk_size,
+            request.app.state.shards,
+            request.app.state.queue,
+        )
+        for (line_number, job), outcome in zip(chunk, outcomes):
+            if not outcome:
+                response.skipped.append(line_number)
+                continue
+            response.enqueued += 1
+            if job.keep_result:
+                response.ids[line_number] = outcome
+        chunk.clear()
+
+    def read_line(line_number: int, line: bytes):
+        if not line.strip():
+            return
+        try:
+            chunk.append((line_number, JobEnqueueRequest.model_validate_json(line)))
+        except ValidationError as ex:
+            response.errors[line_number] = str(ex)
+        if len(chunk) >= chunk_size:
+            enqueue_chunk()
+
+    line_number = 0
+    rest = b""
+    async for data in request.stream():
+        *lines, rest = (rest + data).split(b"\n")
+        for line in lines:
+            line_number += 1
+            read_line(line_number, line)
+    read_line(line_number + 1, rest)
+    enqueue_chunk()
+
+    response.message = f"Enqueued {response.enqueued} jobs, skipped {len(response.skipped)}, {len(response.errors)} invalid"
+    return response
+
+
+@router.get("/delayed", response_model=list[DelayedJob])
+async def list_delayed_jobs(request: Request, limit: int = Query(default=1000, ge=1)) -> list[DelayedJob]:
+    """List the jobs scheduled to run later with their arguments, soonest first."""
+    return queries.get_delayed_jobs(request.app.state.redis, limit)
 
 
 @router.post("/schedule", response_model=SuccessResponse)
 async def schedule_job(request: Request, job: JobScheduleRequest) -> SuccessResponse:
-    """Schedule a job for a specific time."""
-    queries.schedule_job(request.app.state.redis, job.name, job.run_at)
+    """Schedule a job with its arguments for a specific time."""
+    scheduled = queries.schedule_job(
+        request.app.state.redis, job.name, job.run_at, job.params, request.app.state.fifo, job.priority, request.app.state.queue
+    )
+    if not scheduled:
+        raise HTTPException(status_code=500, detail=f"Job '{job.name}' could not be scheduled")
     return SuccessResponse(message=f"Job '{job.name}' scheduled for {job.run_at.isoformat()}")
 
 
 @router.delete("/pending/{job_name}", response_model=SuccessResponse)
 async def cancel_pending_job(request: Request, job_name: str) -> SuccessResponse:
     """Remove a job from the pending queue."""
-    removed = queries.cancel_pending_job(request.app.state.redis, job_name)
+    removed = queries.cancel_pending_job(request.app.state.redis, job_name, shards=request.app.state.shards)
     if not removed:
         raise HTTPException(status_code=404, detail=f"Job '{job_name}' not found in pending queue")
     return SuccessResponse(message=f"Job '{job_name}' removed from pending queue")
@@ -72,6 +177,15 @@ async def cancel_scheduled_job(request: Request, job_name: str) -> SuccessRespon
     return SuccessResponse(message=f"Job '{job_name}' removed from scheduled queue")
 
 
+@router.post("/scheduled/{job_name}/reschedule", response_model=SuccessResponse)
+async def reschedule_scheduled_job(request: Request, job_name: str, schedule: JobRescheduleRequest) -> SuccessResponse:
+    """Move the next run of a cron job, POST /schedule adds a run instead."""
+    moved = queries.reschedule_scheduled_job(request.app.state.redis, job_name, schedule.run_at)
+    if not moved:
+        raise HTTPException(status_code=404, detail=f"Job '{job_name}' not found in scheduled queue")
+    return SuccessResponse(message=f"Job '{job_name}' rescheduled for {schedule.run_at.isoformat()}")
+
+
 @router.post("/running/{job_name}/cancel", response_model=SuccessResponse)
 async def request_cancel_running_job(request: Request, job_name: str) -> SuccessResponse:
     """Request cancellation of a running job.
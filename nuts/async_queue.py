@@ -0,0 +1,178 @@
+from typing import Any, Iterable, Union
+import asyncio
+import datetime
+import itertools
+import time
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.client import Pipeline
+from redis.asyncio.retry import Retry
+from redis.backoff import EqualJitterBackoff
+from .dedupe import dedupe_key as _dedupe_key
+from .priority import DEFAULT
+from .queue import BaseWorkQueue, _Prepared
+from .connection import CONNECTION_ERRORS, RETRIES, BACKOFF_BASE, BACKOFF_CAP, connect_async
+from .results import decode_record, result_key
+
+
+class AsyncWorkQueue(BaseWorkQueue):
+    '''
+        A NUTS producer for asyncio applications, using redis.asyncio.
+
+        Writes the same keys and payloads as WorkQueue, so jobs published by either are run by the same
+        workers. A single queue can be shared by every request handler, each command borrows a connection
+        from the client's pool.
+    '''
+    redis: Redis
+
+    @classmethod
+    def from_url(
+        cls,
+        url: str,
+        max_connections: int = 50,
+        pool_timeout: float = 20,
+        sentinels: list[tuple[str, int]] = None,
+        service_name: str = 'mymaster',
+        **kwargs
+    ) -> 'AsyncWorkQueue':
+        """
+        A queue with its own client and connection pool. kwargs are WorkQueue's.
+
+        Once max_connections are in use, publishers wait up to pool_timeout seconds for one to be free
+        rather than failing, so any number of handlers can share the queue. Commands are retried through
+        connection blips. With sentinels the queue follows the master of service_name instead of using url,
+        see nuts.connection.
+        """
+        if sentinels:
+            return cls(connect_async(sentinels=sentinels, service_name=service_name, max_connections=max_connections), **kwargs)
+        pool = BlockingConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            timeout=pool_timeout,
+            retry=Retry(EqualJitterBackoff(cap=BACKOFF_CAP, base=BACKOFF_BASE), RETRIES),
+            retry_on_error=list(CONNECTION_ERRORS),
+        )
+        return cls(Redis(connection_pool=pool), **kwargs)
+
+    async def close(self):
+        await self.redis.aclose()
+
+    async def publish(
+        self,
+        job_name: str,
+        job_parameters: Union[object, list],
+        priority: str = DEFAULT,
+        dedupe_key: str = None,
+        dedupe_ttl: int = 0,
+        keep_result: bool = False,
+        run_at: Union[datetime.datetime, float] = None,
+    ) -> Union[str, bool]:
+        """
+        Add a job to the pending lane for its priority, or to the delayed queue until run_at, see WorkQueue.publish.
+
+        Returns:
+            The job id if keep_result is set, otherwise True. False if the job was a duplicate or couldn't be added.
+        """
+        job = None
+        try:
+            job = self.prepare(job_name, job_parameters, priority, dedupe_key, dedupe_ttl, keep_result, run_at)
+            outcome = self.outcome(job, await self.push(self.redis, job))
+            if not outcome:
+                self.logger.info(f'Skipped {job_name}, dedupe key {dedupe_key} is held')
+                return False
+
+            self.logger.info(f'Added {job_name} {job.payload if isinstance(job.payload, str) else job_parameters}')
+            return outcome
+
+        except Exception as ex:
+            self.logger.error(f'Error adding {job_name} {job.payload if job else None}: {ex}')
+            self.discard_blob(job.blob if job else None)
+            return False
+
+    async def publish_at(self, when: Union[datetime.datetime, float], job_name: str, job_parameters: Union[object, list] = [], **kwargs) -> Union[str, bool]:
+        """Add a job to run at a given time, with its params, see WorkQueue.publish_at."""
+        return await self.publish(job_name, job_parameters, run_at=when, **kwargs)
+
+    async def publish_in(self, delay: Union[datetime.timedelta, float], job_name: str, job_parameters: Union[object, list] = [], **kwargs) -> Union[str, bool]:
+        """Add a job to run after delay, a timedelta or seconds, see WorkQueue.publish_at."""
+        return await self.publish_at(time.time() + self.seconds(delay), job_name, job_parameters, **kwargs)
+
+    async def publish_many(self, jobs: Iterable[Union[tuple, dict]], chunk_size: int = 1000) -> list[Union[str, bool]]:
+        """
+        Add many jobs, with one pipelined round trip per chunk of them, see WorkQueue.publish_many.
+
+        Returns:
+            The outcome of each job in order, as publish would return it
+        """
+        outcomes = []
+        jobs = iter(jobs)
+        while chunk := list(itertools.islice(jobs, chunk_size)):
+            outcomes += await self.publish_chunk(chunk)
+        return outcomes
+
+    async def publish_chunk(self, chunk: list[Union[tuple, dict]]) -> list[Union[str, bool]]:
+        pipe = self.redis.pipeline(transaction=False)
+        prepared = []
+        for args in chunk:
+            job = None
+            try:
+                job = self.prepare(**self.job_args(args))
+                await self.push(pipe, job)
+                prepared.append(job)
+            except Exception as ex:
+                self.logger.error(f'Error adding {self.job_args(args).get("job_name")}: {ex}')
+                self.discard_blob(job.blob if job else None)
+                prepared.append(None)
+
+        try:
+            replies = await pipe.execute(raise_on_error=False)
+        except Exception as ex:
+            self.logger.error(f'Error adding {len(chunk)} jobs: {ex}')
+            replies = itertools.repeat(ex)
+
+        return self.chunk_outcomes(prepared, replies)
+
+    async def push(self, client: Union[Redis, Pipeline], job: _Prepared) -> Any:
+        """Send the command that enqueues a prepared job, on the client or queued on a pipeline."""
+        if job.dedupe_key is not None:
+            return await self.enqueue_script(keys=[job.lane, _dedupe_key(job.dedupe_key)], args=self.enqueue_args(job), client=client)
+        if job.run_at is not None:
+            return await client.zadd(job.lane, {job.payload: job.run_at})
+        if self.fifo:
+            return await client.rpush(job.lane, job.payload)
+        return await client.sadd(job.lane, job.payload)
+
+    async def get_result(self, job_id: str) -> Union[dict[str, Any], None]:
+        """
+        The outcome of a job published with keep_result.
+
+        Returns:
+            The job's id, name, success, result, error and finished_at, None if it hasn't finished or its result has expired
+        """
+        value = await self.redis.get(result_key(job_id))
+        if value is None:
+            return None
+        return decode_record(value)
+
+    async def wait_for_result(self, job_id: str, timeout: float = None, poll_interval: float = 0.05) -> Union[dict[str, Any], None]:
+        """
+        Wait for a job published with keep_result to finish.
+
+        The result is polled for, starting every poll_interval seconds and backing off to once a second.
+
+        Returns:
+            The job's result as get_result returns it, None if it didn't finish within timeout seconds
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        while True:
+            result = await self.get_result(job_id)
+            if result is not None:
+                return result
+
+            delay = poll_interval
+            if deadline is not None:
+                delay = min(delay, deadline - loop.time())
+                if delay <= 0:
+                    return None
+            await asyncio.sleep(delay)
+            poll_interval = min(poll_interval * 2, 1)
@@ -0,0 +1,508 @@
+from typing import Any, Union
+import asyncio
+import inspect
+import signal
+from redis.asyncio import Redis
+from .job import NutsJob
+from .priority import DEFAULT, PRIORITIES
+from .limits import concurrency_key, running_job_name
+from .results import RESULT_MAX_BYTES, RESULT_TTL
+from .codecs import COMPRESS_MIN_BYTES
+from .blobs import BlobStore
+from .connection import CONNECTION_ERRORS, CircuitBreaker
+from .misfire import MISFIRE_BATCH
+from .leader import LEASE_TTL, AsyncLeaderLease, SchedulerWrites
+from .base_worker import DRAIN_TIMEOUT, HEARTBEAT_INTERVAL, IDLE_MAX, IDLE_MIN, BaseWorker, JobModule, _run_in_process
+import datetime
+
+
+class AsyncWorker(BaseWorker):
+    '''
+        A NUTS worker running on asyncio.
+
+        Shares its queues, leadership and workflow handling with Worker so both can be run side by side
+        against the same Redis. Jobs with an `async def run` are awaited on the event loop, regular jobs
+        are run in a thread so they don't block it.
+    '''
+    redis: Redis
+    in_flight: set[asyncio.Task]
+    lease: AsyncLeaderLease
+
+    lease_class = AsyncLeaderLease
+
+    def __init__(
+        self,
+        redis: Redis,
+        jobs: list[JobModule],
+        workflow_directory: str = None,
+        concurrency: int = 100,
+        process_workers: int = None,
+        process_kwargs: dict[str, Any] = None,
+        fifo: bool = False,
+        block_timeout: float = 1,
+        prefetch: int = 1,
+        lease_ttl: float = LEASE_TTL,
+        priorities: list[str] = PRIORITIES,
+        priority_weights: dict[str, float] = None,
+        result_cache_size: int = 0,
+        result_ttl: int = RESULT_TTL,
+        result_max_bytes: int = RESULT_MAX_BYTES,
+        codec: str = 'json',
+        compression: str = None,
+        compress_min_bytes: int = COMPRESS_MIN_BYTES,
+        blob_store: BlobStore = None,
+        shards: int = 1,
+        circuit_breaker: CircuitBreaker = None,
+        misfire_batch: int = MISFIRE_BATCH,
+        **kwargs
+    ):
+        super().__init__(
+            redis,
+            jobs,
+            workflow_directory=workflow_directory,
+            concurrency=concurrency,
+            process_workers=process_workers,
+            process_kwargs=process_kwargs,
+            fifo=fifo,
+            block_timeout=block_timeout,
+            prefetch=prefetch,
+            lease_ttl=lease_ttl,
+            priorities=priorities,
+            priority_weights=priority_weights,
+            result_cache_size=result_cache_size,
+            result_ttl=result_ttl,
+            result_max_bytes=result_max_bytes,
+            codec=codec,
+            compression=compression,
+            compress_min_bytes=compress_min_bytes,
+            blob_store=blob_store,
+            shards=shards,
+            circuit_breaker=circuit_breaker,
+            misfire_batch=misfire_batch,
+            **kwargs
+        )
+        self.is_setup = False
+        self.heartbeat_task = None
+        self.lease_task = None
+        # Set by stop to cut run_forever's idle pause short
+        self.wakeup = None
+
+    async def setup(self):
+        '''
+            Claim leadership if it is free and register workflow and cron schedules. Called on the first run.
+        '''
+        self.is_setup = True
+
+        if self.tracks_claims:
+            await self.heartbeat()
+            self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
+
+        await self.check_leader()
+        self.lease_task = asyncio.create_task(self.lease_loop())
+
+    async def check_leader(self) -> bool:
+        """Take the leader lease if it is free, or renew it if this worker holds it, in one round trip."""
+        was_leader = self.is_leader
+        self.is_leader = await self.lease.acquire()
+        self.leadership_changed(was_leader)
+
+        if self.is_leader and not was_leader:
+            await self.register_schedules()
+
+        return self.is_leader
+
+    async def register_schedules(self):
+        """Schedule the workflows and cron jobs this worker knows about, see Worker.register_schedules."""
+        names = [w.name for w in self.workflows]
+        states = await self.redis.hmget(self.running_workflow_queue, names) if names else []
+        scheduled = await self.redis.zmscore(self.scheduled_workflow_queue, names) if names else []
+        writes = self.workflow_writes([state is not None for state in states], scheduled)
+        self.restore_writes(writes, states)
+
+        names = [j.name for j in self.scheduled_jobs()]
+        scheduled = await self.redis.zmscore(self.scheduled_queue, names) if names else []
+        self.cron_writes(writes, scheduled)
+        await self.commit(writes)
+
+    async def lease_loop(self):
+        while self.should_run:
+            await asyncio.sleep(self.lease.renew_interval)
+            try:
+                await self.check_leader()
+                await self.refresh_slots()
+            except Exception as ex:
+                # An outage is reported by the main loop, not again on every renewal
+                if not self.breaker.is_open:
+                    self.logger.error(f'Unhandled Exception renewing leader lease: {ex}')
+
+    async def refresh_slots(self):
+        """Mark the concurrency slots of this worker's running jobs as still in use, see Worker.refresh_slots."""
+        slots = tuple(self.slots)
+        if slots:
+            now = round(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
+            pipe = self.redis.pipeline(transaction=False)
+            for field in slots:
+                pipe.zadd(concurrency_key(running_job_name(field)), {field: now}, xx=True)
+            await pipe.execute()
+
+    async def commit(self, writes: SchedulerWrites) -> bool:
+        """Apply the leader's scheduler writes, fenced by its lease."""
+        if await self.lease.commit(writes):
+            return True
+
+        self.writes_rejected(writes)
+        return False
+
+    async def promote(self, writes: SchedulerWrites) -> tuple[int, list[bytes]]:
+        """Move a batch of due entries out of a scheduled queue in one fenced script, see Worker.promote."""
+        if not writes:
+            return 0, []
+
+        remaining, moved = await self.lease.promote(writes, datetime.datetime.now(datetime.timezone.utc).timestamp())
+        if not self.lease.held:
+            self.writes_rejected(writes)
+        return remaining, moved
+
+    async def shutdown(self, signum=None, drain_timeout: float = None):
+        """
+        Stop the worker, hand back what it claimed but hasn't started and step down as leader.
+
+        Args:
+            drain_timeout: Seconds to wait for running jobs to finish, forever by default. Jobs still running after it are cancelled.
+        """
+        self.logger.info(f'Received shutdown command {signum}.')
+        self.should_run = False
+
+        drained = True
+        if self.in_flight:
+            # Let in flight jobs finish so their completions are recorded before we step down
+            _, unfinished = await asyncio.wait(self.in_flight, timeout=drain_timeout)
+            if unfinished:
+                self.logger.warning(f'{len(unfinished)} jobs still running after {drain_timeout}s, cancelling them')
+                for task in unfinished:
+                    task.cancel()
+                await asyncio.wait(unfinished)
+                # Jobs run in a thread or process carry on after their task is cancelled
+                drained = False
+            self.reap()
+
+        if self.process_pool:
+            await asyncio.to_thread(self.process_pool.shutdown, True)
+
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+
+        if self.lease_task:
+            self.lease_task.cancel()
+
+        if self.tracks_claims and drained:
+            self.buffer.clear()
+            await self.release_claims(self.id, self.processing_queue)
+            await self.redis.delete(self.heartbeat_key)
+        elif self.tracks_claims:
+            # Jobs that were running keep their claims, see Worker.shutdown
+            pipe = self.redis.pipeline()
+            self.hand_back_writes(pipe)
+            await pipe.execute()
+
+        if self.is_leader:
+            await self.commit(self.persist_writes())
+            await self.release_leader()
+
+    async def release_leader(self):
+        if self.is_leader:
+            self.logger.info('Shutdown: Releasing leadership')
+            await self.lease.release()
+            self.is_leader = False
+
+    async def schedule_pending_job(self, job_name, job_params=[], priority: str = DEFAULT):
+        """Enqueue a job. Any worker may do this, so unlike the leader's scheduler writes it isn't fenced."""
+        command, queue, payload = self.enqueue_call(job_name, job_params, priority)
+        await getattr(self.redis, command)(queue, payload)
+
+    async def heartbeat(self):
+        """Mark this worker as alive so the leader leaves its processing list alone."""
+        await self.redis.set(self.heartbeat_key, self.id, ex=HEARTBEAT_INTERVAL * 3)
+
+    async def heartbeat_loop(self):
+        while self.should_run:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self.heartbeat()
+                if self.is_leader:
+                    await self.recover_orphaned_jobs()
+            except Exception as ex:
+                if not self.breaker.is_open:
+                    self.logger.error(f'Unhandled Exception in heartbeat: {ex}')
+
+    async def release_claims(self, worker_id: str, processing_queue: str) -> int:
+        """Return everything left in a worker's processing list to the queue it was claimed from, see Worker.release_claims."""
+        claims = await self.redis.lrange(processing_queue, 0, -1)
+        script, call = self.requeue_call(processing_queue)
+        requeued = await script(**call)
+
+        running = {field: entry async for field, entry in self.redis.hscan_iter(self.running_queue, match=f'{worker_id}|*')}
+        if running:
+            await self.redis.hdel(self.running_queue, *running)
+            for field in running:
+                await self.redis.zrem(concurrency_key(running_job_name(field)), field)
+
+        pipe = self.redis.pipeline(transaction=False)
+        self.recovered_dedupe_writes(pipe, claims, list(running.values()))
+        await pipe.execute()
+
+        return requeued
+
+    async def recover_orphaned_jobs(self):
+        """Requeue jobs claimed by workers that have stopped sending heartbeats."""
+        for pattern in ['nuts|jobs|processing|*', 'nuts|jobs|claimed|*']:
+            async for processing_queue in self.redis.scan_iter(match=pattern):
+                processing_queue = processing_queue.decode()
+                worker_id = processing_queue.split('|')[-1]
+                if await self.redis.exists(f'nuts|workers|{worker_id}'):
+                    continue
+
+                requeued = await self.release_claims(worker_id, processing_queue)
+                if requeued:
+                    self.logger.info(f'Requeued {requeued} jobs claimed by dead worker {worker_id}')
+
+    async def fetch(self) -> list[tuple[bytes, Union[str, None]]]:
+        """Claim up to prefetch pending jobs in a single round trip, see BaseWorker.claim_args."""
+        shards = self.shard_order()
+        for shard in shards:
+            lanes = self.lane_order(shard)
+            keys = self.claim_keys(lanes)
+            [started, claimed] = await self.claim_script(keys=keys, args=self.claim_args())
+            if started:
+                return self.claimed_jobs(started, claimed)
+
+        if self.fifo:
+            # Straight into the processing list, see Worker.fetch
+            lanes = self.lane_order(shards[0])
+            data = await self.redis.blmove(self.wait_lane(shards[0]), self.processing_queue, self.block_timeout, 'LEFT', 'RIGHT')
+            if data:
+                started = [data, await self.start_script(keys=self.claim_keys(lanes), args=self.start_args(data))]
+
+        return self.claimed_jobs(started, claimed)
+
+    async def claim(self) -> Union[tuple[bytes, str], None]:
+        """Take the next job, from the local prefetch buffer if there is one waiting, see Worker.claim."""
+        if not self.buffer:
+            self.buffer.extend(await self.fetch())
+
+        claimed = None
+        while self.buffer and not claimed:
+            data, running_field = self.buffer.popleft()
+            if running_field is None:
+                running_field = await self.start_script(keys=self.claim_keys(), args=self.start_args(data))
+                if not self.started(data, running_field):
+                    continue
+                running_field = running_field.decode()
+            claimed = data, running_field
+
+        if self.claimed_dedupe or self.released_dedupe:
+            pipe = self.redis.pipeline(transaction=False)
+            self.claimed_dedupe_writes(pipe)
+            await pipe.execute()
+        return claimed
+
+    async def ready(self, queue: str) -> list[tuple[bytes, float]]:
+        """The entries of a scheduled queue that are due, oldest first and at most misfire_batch of them."""
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+
+        return await self.redis.zrange(queue, '-inf', now, byscore=True, offset=0, num=self.misfire_batch, withscores=True)
+
+    async def move_scheduled_to_pending(self) -> int:
+        """Move due scheduled, deferred and delayed jobs on, see Worker.move_scheduled_to_pending."""
+        remaining, _ = await self.promote(self.pending_writes(await self.ready(self.scheduled_queue)))
+        await self.promote_script(**self.promote_call())
+        await self.promote_script(**self.promote_call(self.delayed_queue))
+        return remaining
+
+    async def move_scheduled_workflows_to_running(self):
+        ready_workflows = await self.ready(self.scheduled_workflow_queue)
+
+        writes, due = self.ready_workflow_writes(ready_workflows)
+        _, moved = await self.promote(writes)
+        self.activate_workflows([w for w in due if w[0] in moved])
+
+    async def finish(self, data: bytes, running_field: str, job: NutsJob = None, workflow_name: str = None, record: bool = False):
+        """Clear a job's running entry and claim, record its completion and enqueue its next job, see BaseWorker.finish_call."""
+        await self.finish_script(**self.finish_call(data, running_field, job, workflow_name, record))
+        self.release_blob(data)
+
+    async def queue_completed_jobs(self):
+        completed_jobs = await self.drain_script(keys=[self.completed_queue])
+
+        if not await self.commit(self.completed_writes(completed_jobs)) and completed_jobs:
+            await self.redis.hset(self.completed_queue, mapping=dict(zip(completed_jobs[::2], completed_jobs[1::2])))
+
+    async def run_workflows(self):
+        """Activate workflows that are due and schedule their next jobs, see BaseWorker.workflow_step_writes."""
+        await self.move_scheduled_workflows_to_running()
+        await self.commit(self.workflow_step_writes())
+
+    def reap(self):
+        """Forget finished executions, logging any that escaped with an exception."""
+        for task in [t for t in self.in_flight if t.done()]:
+            self.in_flight.discard(task)
+            if not task.cancelled() and task.exception():
+                self.logger.error(f'Unhandled Exception in worker run process: {task.exception()}')
+
+    async def has_capacity(self) -> bool:
+        """
+        Check whether another job can be started, waiting briefly for a slot when all of them are busy.
+        """
+        if len(self.in_flight) >= self.concurrency:
+            await asyncio.wait(self.in_flight, timeout=0.1, return_when=asyncio.FIRST_COMPLETED)
+
+        self.reap()
+
+        return len(self.in_flight) < self.concurrency
+
+    async def run_job(self, job: NutsJob, job_args: Union[dict, list]):
+        """Await a coroutine job on the loop, hand everything else off so the loop isn't blocked."""
+        args = job_args if isinstance(job_args, dict) else {}
+
+        if job.executor == 'process':
+            loop = asyncio.get_running_loop()
+            outcome = await loop.run_in_executor(self.process_pool, _run_in_process, job.name, job_args)
+            job.success, job.result, job.error = outcome
+        elif inspect.iscoroutinefunction(job.run):
+            await job.run(**args, **self.kwargs)
+        else:
+            await asyncio.to_thread(job.run, **args, **self.kwargs)
+
+    async def handle_job(self, data: bytes, running_field: str):
+        try:
+            await self.execute_job(data, running_field)
+        except Exception:
+            await self.finish(data, running_field)
+            raise
+
+    async def cached_result(self, job: NutsJob, key: str) -> Union[str, bytes, None]:
+        """A cached job's result, from this worker's LRU or the shared cache in Redis, see Worker.cached_result."""
+        value = self.local_cache.get(key) if self.local_cache else None
+        if value is None:
+            value = await self.cache_get_script(**self.cache_get_call(job, key))
+
+        return value
+
+    async def cache_result(self, job: NutsJob, key: str):
+        call = self.cache_result_call(job, key)
+        if call:
+            await self.cache_result_script(**call)
+
+    async def execute_job(self, data: bytes, running_field: str):
+        job, job_args, workflow_name = self.prepare_job(data)
+
+        if not job:
+            await self.finish(data, running_field)
+            return
+
+        key = self.result_cache_key(job, job_args)
+        cached = await self.cached_result(job, key) if key else None
+
+        if cached is not None:
+            self.cache_hit(job, key, cached)
+        else:
+            try:
+                await self.run_job(job, job_args)
+            except Exception as ex:
+                self.logger.error(f'Unhandled Exception In Job: {job.name}: {ex}')
+
+            if key and job.success:
+                await self.cache_result(job, key)
+
+        self.job_finished(job)
+        await self.finish(data, running_field, job, workflow_name, record=bool(job.schedule or workflow_name))
+
+    async def run_forever(self, idle_min: float = IDLE_MIN, idle_max: float = IDLE_MAX, drain_timeout: float = DRAIN_TIMEOUT):
+        """Run the worker until SIGTERM or SIGINT, then shut it down gracefully, see Worker.run_forever."""
+        self.wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop, sig)
+            except (NotImplementedError, RuntimeError):
+                # Not supported by this loop or outside the main thread, the caller handles signals
+                pass
+
+        idle = 0
+        while self.should_run:
+            if await self.run():
+                idle = 0
+                continue
+            idle = self.idle_pause(idle, idle_min, idle_max)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), idle)
+            except asyncio.TimeoutError:
+                pass
+
+        await self.shutdown(self.stop_signal, drain_timeout)
+
+    def stop(self, signum=None, frame=None):
+        super().stop(signum, frame)
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def run(self) -> bool:
+        """
+        One pass of the worker, see Worker.run.
+
+        Returns:
+            False if the worker was idle, with room for a job but none waiting
+        """
+        # While Redis is unreachable the worker only probes it, once per backoff
+        if self.breaker.is_open and not await self.probe():
+            return False
+
+        try:
+            busy = await self.run_once()
+        except CONNECTION_ERRORS as ex:
+            await asyncio.sleep(self.connection_failed(ex))
+            return False
+
+        if self.breaker.failures:
+            self.connection_restored()
+        return busy
+
+    async def run_once(self) -> bool:
+        if not self.is_setup:
+            await self.setup()
+
+        # Leadership is kept up to date by the lease task, a stale leader's scheduler writes are rejected by the fence
+        backlog = 0
+        if self.is_leader:
+            backlog = await self.move_scheduled_to_pending()
+            await self.run_workflows()
+
+        busy = True
+        try:
+            if await self.has_capacity():
+                claimed = await self.claim()
+                busy = claimed is not None
+                if claimed:
+                    self.in_flight.add(asyncio.create_task(self.handle_job(*claimed)))
+
+        except CONNECTION_ERRORS:
+            raise
+        except Exception as ex:
+            self.logger.error(f'Unhandled Exception in worker run process: {ex}')
+            busy = False
+
+        if self.is_leader:
+            await self.queue_completed_jobs()
+
+        # While scheduled jobs are still due the leader doesn't idle, see Worker.run_once
+        return busy or backlog > 0
+
+    async def probe(self) -> bool:
+        """Check whether Redis is back, parking for another backoff if it isn't."""
+        try:
+            await self.redis.ping()
+        except CONNECTION_ERRORS as ex:
+            await asyncio.sleep(self.connection_failed(ex))
+            return False
+        self.connection_restored()
+        return True
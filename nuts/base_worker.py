@@ -0,0 +1,867 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from uuid import uuid4
+import importlib
+import itertools
+import json
+import multiprocessing
+import random
+from typing import Any, Protocol, Union
+from .job import NutsJob
+from .workflow import NutsWorkflow, load_workflows
+from .cron import Cron
+from .leader import LEASE_TTL, SchedulerWrites
+from .priority import DEFAULT, PRIORITIES, job_payload, lane_key, payload_options, payload_priority
+from .limits import DEFERRED_QUEUE, concurrency_key, job_limits, limit_keys, running_job_name
+from .dedupe import DEDUPE_HOLD, dedupe_window, running_dedupe
+from .cache import LocalCache, cache_key, encode_result, index_key
+from .results import RESULT_MAX_BYTES, RESULT_TTL, encode_record, result_key, result_record
+from .codecs import COMPRESS_MIN_BYTES, PLAIN, PayloadCodec, decode_payload
+from .blobs import BlobStore, load_params
+from .shards import shard_key
+from .connection import CircuitBreaker
+from .misfire import ALL, COALESCE, MISFIRE_BATCH, POLICIES, due_runs
+from . import scripts
+import datetime
+import logging
+
+
+class JobModule(Protocol):
+    """Protocol for job modules that contain a Job class."""
+    Job: type[NutsJob]
+
+
+# Jobs imported once per child process of the process pool, keyed by job name, and the kwargs they are run with
+_process_jobs: dict[str, NutsJob] = {}
+_process_kwargs: dict[str, Any] = {}
+
+
+def _init_process_pool(job_modules: list[str], process_kwargs: dict[str, Any]):
+    """Warm a process pool child by importing the job modules it may be asked to run."""
+    for module_name in job_modules:
+        j = importlib.import_module(module_name).Job()
+        _process_jobs[j.name] = j
+    _process_kwargs.update(process_kwargs)
+
+
+def _run_in_process(job_name: str, job_args: Union[dict, list]) -> tuple[bool, Any, Any]:
+    """Run a job inside a process pool child and hand its outcome back to the parent worker."""
+    job = _process_jobs[job_name].copy()
+
+    if isinstance(job_args, dict):
+        job.run(**job_args, **_process_kwargs)
+    else:
+        job.run(**_process_kwargs)
+
+    return job.success, job.result, job.error
+
+
+def _create_process_pool(job_modules: list[str], process_workers: int, process_kwargs: dict[str, Any]) -> ProcessPoolExecutor:
+    """
+    A process pool for the jobs that opt in to it.
+
+    Children are started from a forkserver rather than forked from the worker, whose lease, heartbeat
+    and pool threads may be holding locks at the time. process_kwargs are pickled once per child.
+    """
+    return ProcessPoolExecutor(
+        max_workers=process_workers,
+        mp_context=multiprocessing.get_context('forkserver'),
+        initializer=_init_process_pool,
+        initargs=(job_modules, process_kwargs or {}),
+    )
+
+
+# Seconds between worker heartbeats, a worker that misses three in a row is considered dead
+HEARTBEAT_INTERVAL = 10
+
+# Pauses of an idle worker in run_forever, doubling from the floor up to the ceiling while no job is waiting
+IDLE_MIN = 0.05
+IDLE_MAX = 2.0
+# The leader never pauses for longer, scheduled jobs are due to the second
+LEADER_TICK = 1.0
+# Seconds run_forever waits on shutdown for running jobs to finish
+DRAIN_TIMEOUT = 30.0
+
+
+class BaseWorker():
+    '''
+        State and Redis protocol shared by Worker and AsyncWorker.
+
+        Everything here is free of I/O. It builds the script calls and scheduler writes, and interprets
+        what comes back, so the two workers only differ in how they talk to Redis and run jobs.
+    '''
+    id: str
+    scheduler: Cron
+    logger: logging.Logger
+    jobs: list[NutsJob]
+    workflows: list[NutsWorkflow]
+    kwargs: dict[str, Any]
+    scheduled_queue: str
+    pending_queue: str
+    completed_queue: str
+    last_run: datetime.datetime
+    running_queue: str
+    should_run: bool
+    concurrency: int
+    process_pool: Union[ProcessPoolExecutor, None]
+    fifo: bool
+    fifo_queue: str
+    processing_queue: str
+    prefetch: int
+    buffer: deque[tuple[bytes, Union[str, None]]]
+    priorities: list[str]
+    priority_weights: Union[dict[str, float], None]
+    codec: PayloadCodec
+    blob_store: Union[BlobStore, None]
+
+    # The lease implementation matching the worker's Redis client
+    lease_class: type
+
+    def __init__(
+        self,
+        redis,
+        jobs: list[JobModule],
+        workflow_directory: str = None,
+        concurrency: int = 1,
+        process_workers: int = None,
+        process_kwargs: dict[str, Any] = None,
+        fifo: bool = False,
+        block_timeout: float = 1,
+        prefetch: int = 1,
+        lease_ttl: float = LEASE_TTL,
+        priorities: list[str] = PRIORITIES,
+        priority_weights: dict[str, float] = None,
+        result_cache_size: int = 0,
+        result_ttl: int = RESULT_TTL,
+        result_max_bytes: int = RESULT_MAX_BYTES,
+        codec: str = 'json',
+        compression: str = None,
+        compress_min_bytes: int = COMPRESS_MIN_BYTES,
+        blob_store: BlobStore = None,
+        shards: int = 1,
+        circuit_breaker: CircuitBreaker = None,
+        misfire_batch: int = MISFIRE_BATCH,
+        **kwargs
+    ):
+        self.id = str(uuid4())
+        self.scheduled_queue = 'nuts|jobs|scheduled'
+        self.running_queue = 'nuts|jobs|running'
+        self.pending_queue = 'nuts|jobs|pending'
+        self.completed_queue = 'nuts|jobs|completed'
+        self.cancel_queue = 'nuts|jobs|cancel'
+        self.scheduled_workflow_queue = 'nuts|workflows|scheduled'
+        self.running_workflow_queue = 'nuts|workflows|running'
+        self.completed_workflow_queue = 'nuts|workflows|completed'
+        # FIFO mode keeps pending jobs in a list, claimed jobs sit in a per-worker processing list until they finish.
+        # Jobs prefetched from the pending set are tracked the same way in a claimed list.
+        self.fifo_queue = 'nuts|jobs|queue'
+        self.processing_queue = f'nuts|jobs|processing|{self.id}' if fifo else f'nuts|jobs|claimed|{self.id}'
+        self.heartbeat_key = f'nuts|workers|{self.id}'
+        self.deferred_queue = DEFERRED_QUEUE
+        # Jobs published to run later, see WorkQueue.publish_at
+        self.delayed_queue = 'nuts|jobs|delayed'
+        self.kwargs = kwargs
+        self.should_run = True
+        # The signal that stopped run_forever
+        self.stop_signal = None
+        self.is_leader = False
+        self.workflow_directory = workflow_directory
+
+        self.concurrency = max(1, concurrency)
+        self.in_flight = set()
+
+        self.fifo = fifo
+        self.block_timeout = block_timeout
+        self.prefetch = max(1, prefetch)
+        self.buffer = deque()
+        # Claims are only tracked when they can outlive a single SPOP, a dead worker's claims are requeued by the leader
+        self.tracks_claims = self.fifo or self.prefetch > 1
+
+        # Priority lanes this worker takes jobs from, most urgent first. Without weights they are served strictly in order.
+        self.priorities = [p for p in PRIORITIES if p in priorities]
+        if not self.priorities:
+            raise ValueError(f'A worker needs at least one of the priorities {", ".join(PRIORITIES)}')
+        self.priority_weights = priority_weights
+        # Shards of the pending queue, see nuts.shards. Fetches start from each shard in turn.
+        self.shards = max(1, shards)
+        self.shard_turns = itertools.count()
+        if priority_weights and sum(priority_weights.get(p, 0) for p in self.priorities) <= 0:
+            raise ValueError('priority_weights must give at least one of the worker\'s priorities a positive weight')
+
+        self.last_run = datetime.datetime.fromtimestamp(0)
+        # Most scheduled runs the leader enqueues per tick, so catching up after an outage doesn't flood the pending queue
+        self.misfire_batch = max(1, misfire_batch)
+
+        # Encoding of the payloads this worker enqueues, it reads payloads in any encoding
+        self.codec = PayloadCodec(codec, compression, compress_min_bytes)
+        # Where producers offload large params, see nuts.blobs
+        self.blob_store = blob_store
+
+        self.redis = redis
+        # Consecutive connection failures, the worker parks once Redis has been gone for a while, see nuts.connection
+        self.breaker = circuit_breaker or CircuitBreaker()
+        self.claim_script = self.redis.register_script(scripts.CLAIM_JOBS)
+        self.start_script = self.redis.register_script(scripts.START_CLAIMED_JOB)
+        self.finish_script = self.redis.register_script(scripts.FINISH_JOB)
+        self.drain_script = self.redis.register_script(scripts.DRAIN_HASH)
+        self.requeue_set_script = self.redis.register_script(scripts.REQUEUE_TO_SET)
+        self.requeue_list_script = self.redis.register_script(scripts.REQUEUE_TO_LIST)
+        self.promote_script = self.redis.register_script(scripts.PROMOTE_DEFERRED)
+        self.cache_get_script = self.redis.register_script(scripts.CACHE_GET)
+        self.cache_result_script = self.redis.register_script(scripts.CACHE_RESULT)
+        # Results of cached jobs this worker has seen, checked before the shared cache in Redis
+        self.local_cache = LocalCache(result_cache_size) if result_cache_size > 0 else None
+        # Results of jobs published with keep_result are stored for result_ttl seconds
+        self.result_ttl = result_ttl
+        self.result_max_bytes = result_max_bytes
+        self.lease = self.lease_class(self.redis, self.id, lease_ttl)
+
+        self.scheduler = Cron()
+
+        self.logger = logging.getLogger(f'worker|{self.id}')
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+
+        self.jobs = [job.Job() for job in jobs]
+        for job in self.jobs:
+            if job.misfire not in POLICIES:
+                raise ValueError(f'Job {job.name} has unknown misfire policy {job.misfire}, expected one of {", ".join(POLICIES)}')
+        # Concurrency caps and rate limits of the jobs, checked by the claim scripts whenever a job is started
+        self.limits = job_limits(self.jobs)
+        self.limit_keys = limit_keys(self.jobs)
+        # Running fields of this worker's jobs that hold a concurrency slot, refreshed so they aren't reaped as stale
+        self.slots = set()
+        # Dedupe keys of started and cancelled jobs, held again or released after the claim that took them
+        self.claimed_dedupe = []
+        self.released_dedupe = []
+        # Every worker knows the workflows, whichever of them leads now or after a failover schedules them
+        self.workflows = load_workflows(workflow_directory, self.logger) if workflow_directory else []
+
+        # Jobs that opt in to the process executor always go through the pool so the main loop is never blocked by them
+        self.process_pool = None
+        process_modules = [job.__name__ for job, j in zip(jobs, self.jobs) if j.executor == 'process']
+        if process_modules:
+            self.process_pool = _create_process_pool(process_modules, process_workers, process_kwargs)
+
+    def stop(self, signum=None, frame=None):
+        """Signal handler of run_forever. The worker finishes its current pass, then drains and shuts down."""
+        self.logger.info(f'Received shutdown command {signum}, draining.')
+        self.stop_signal = signum
+        self.should_run = False
+
+    def idle_pause(self, idle: float, idle_min: float, idle_max: float) -> float:
+        """
+        The next pause of an idle worker, double the last one within idle_min and idle_max.
+
+        The leader's pauses are cut to LEADER_TICK, so its scheduling duties stay on time.
+        """
+        idle = min(idle_max, max(idle_min, idle * 2))
+        return min(idle, LEADER_TICK) if self.is_leader else idle
+
+    def connection_failed(self, ex: Exception) -> float:
+        """
+        Record a failed round trip to Redis. Only the first failures and the outage itself are logged, not every retry.
+
+        Returns:
+            How many seconds to park for before trying Redis again
+        """
+        was_open = self.breaker.is_open
+        delay = self.breaker.failure()
+        if not self.breaker.is_open:
+            self.logger.warning(f'Redis connection error, retrying in {delay:.2f}s: {ex}')
+        elif not was_open:
+            self.logger.error(f'Redis unreachable after {self.breaker.failures} attempts, parking worker until it is back: {ex}')
+        return delay
+
+    def connection_restored(self):
+        outage = self.breaker.success()
+        if outage is not None:
+            self.logger.info(f'Redis reachable again after {outage:.1f}s, resuming work')
+
+    def leadership_changed(self, was_leader: bool):
+        if self.is_leader and not was_leader:
+            self.logger.info(f'Worker {self.id} assuming leadership, fencing token {self.lease.token}')
+        elif was_leader and not self.is_leader:
+            self.logger.warning(f'Worker {self.id} lost leadership')
+
+    def writes_rejected(self, writes: SchedulerWrites):
+        self.logger.warning(f'Worker {self.id} is no longer the leader, dropping {len(writes)} scheduler writes')
+        self.is_leader = False
+
+    def workflow_writes(self, running: list[bool], scheduled: list[Union[float, None]]) -> SchedulerWrites:
+        """
+        Schedule the loaded workflows that are neither running nor scheduled already.
+
+        A workflow that is already scheduled keeps its entry, even one that is past due, so a missed run is
+        still handled by its misfire policy after a failover.
+
+        Args:
+            running: Whether each workflow in self.workflows has state in the running hash
+            scheduled: The score of each workflow in the scheduled queue, None if it isn't there
+        """
+        writes = SchedulerWrites()
+        idle = [w for w, is_running, score in zip(self.workflows, running, scheduled) if not is_running and score is None]
+        next_executions = self.scheduler.next_executions([w.schedule for w in idle])
+        if idle:
+            writes.zadd(self.scheduled_workflow_queue, {w.name: t for w, t in zip(idle, next_executions)}, nx=True)
+        return writes
+
+    def restore_writes(self, writes: SchedulerWrites, states: list[Union[bytes, None]]):
+        """
+        Resume the workflows a previous leader persisted as active, and clear their running entries.
+
+        Args:
+            states: The running hash entry of each workflow in self.workflows, None if it has none
+        """
+        restored = []
+        for workflow, state in zip(self.workflows, states):
+            if state is not None:
+                self.logger.info(f'Resuming workflow {workflow.name}')
+                workflow.restore(json.loads(state))
+                restored.append(workflow.name)
+        if restored:
+            # The state lives on this worker now, it is persisted again if this worker steps down mid-run
+            writes.hdel(self.running_workflow_queue, *restored)
+
+    def cron_writes(self, writes: SchedulerWrites, scheduled: list[Union[float, None]]):
+        """
+        Reschedule cron jobs whose schedule has changed.
+
+        Only entries in the future are checked. One that isn't a time its schedule fires at was left by an older
+        schedule and is moved to the next run. Past due entries are left for pending_writes, which runs them by
+        each job's misfire policy.
+
+        Args:
+            scheduled: The score of each scheduled job in self.jobs in the scheduled queue, None if it isn't there
+        """
+        jobs = self.scheduled_jobs()
+        # Schedules shared by many jobs are only worked out once
+        next_executions = self.scheduler.next_executions([j.schedule for j in jobs])
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        changed = {}
+        for j, score, next_execution in zip(jobs, scheduled, next_executions):
+            self.logger.info(f'Registering Cron Job {j.name}')
+
+            if score is not None and score > now and not self.scheduler.is_execution(j.schedule, score):
+                # Schedule has changed
+                changed[j.name] = next_execution
+        if changed:
+            writes.zadd(self.scheduled_queue, changed)
+
+    def scheduled_jobs(self) -> list[NutsJob]:
+        return [j for j in self.jobs if j.schedule]
+
+    def persist_writes(self) -> SchedulerWrites:
+        """Save the state of active workflows so the next leader can pick them up."""
+        writes = SchedulerWrites()
+        for workflow in self.workflows:
+            if workflow.status == 'active':
+                self.logger.info(f'Workflow {workflow.name} is active, persisting state')
+                writes.hset(self.running_workflow_queue, workflow.name, json.dumps(workflow, default=lambda o: o.__dict__))
+        return writes
+
+    def queue_pending(self, writes: SchedulerWrites, job_name, job_params=[], priority: str = DEFAULT, **options):
+        """
+        Add a job to the pending lane for its priority as part of a batch of scheduler writes.
+
+        The batch travels as JSON, so these payloads are always plain JSON.
+        """
+        command, queue, payload = self.enqueue_call(job_name, job_params, priority, PLAIN, **options)
+        writes.add(command, queue, payload)
+
+    def enqueue_call(
+        self, job_name, job_params=[], priority: str = DEFAULT, codec: PayloadCodec = None, **options
+    ) -> tuple[str, str, Union[str, bytes]]:
+        """The command, pending lane and payload to enqueue a job with, encoded with the worker's codec by default."""
+        payload = job_payload(job_name, job_params, priority, codec or self.codec, **options)
+        return 'rpush' if self.fifo else 'sadd', lane_key(self.shard_queue(), priority), payload
+
+    def shard_queue(self, shard: int = None, fifo: bool = None) -> str:
+        """A shard of the pending set or FIFO queue, the next one in turn by default."""
+        if shard is None:
+            shard = next(self.shard_turns) % self.shards
+        queue = self.fifo_queue if (self.fifo if fifo is None else fifo) else self.pending_queue
+        return shard_key(queue, shard, self.shards)
+
+    def shard_order(self) -> list[int]:
+        """The shards to take jobs from, starting from each one in turn so every shard gets served."""
+        first = next(self.shard_turns) % self.shards
+        return [(first + i) % self.shards for i in range(self.shards)]
+
+    def requeue_call(self, processing_queue: str) -> tuple[Any, dict]:
+        """
+        The script and arguments that return everything left in a worker's processing list to the queue it was claimed from.
+
+        FIFO jobs go back to the front of their lane, oldest first. Jobs claimed from the pending set go back into it.
+        """
+        # Jobs go back to the lane of their own priority, the scripts expect the default lane first
+        priorities = sorted(PRIORITIES, key=lambda p: p != DEFAULT)
+        if processing_queue.startswith('nuts|jobs|claimed|'):
+            script, queue = self.requeue_set_script, self.shard_queue(fifo=False)
+        else:
+            script, queue = self.requeue_list_script, self.shard_queue(fifo=True)
+        return script, {'keys': [processing_queue, *[lane_key(queue, p) for p in priorities]], 'args': priorities}
+
+    def hand_back_writes(self, pipe):
+        """
+        Queue the commands that return the prefetched jobs this worker hasn't run to the queue they were claimed from,
+        leaving the claims of jobs that are running. Jobs started by the claim script lose their running entry and slot.
+        """
+        queue = self.shard_queue()
+        # FIFO jobs go back to the front of their lane, oldest first
+        for data, running_field in reversed(self.buffer):
+            pipe.lrem(self.processing_queue, 1, data)
+            if running_field is not None:
+                pipe.hdel(self.running_queue, running_field)
+                pipe.zrem(concurrency_key(running_job_name(running_field)), running_field)
+                self.slots.discard(running_field)
+            lane = lane_key(queue, payload_priority(decode_payload(data, params=False)))
+            if self.fifo:
+                pipe.lpush(lane, data)
+            else:
+                pipe.sadd(lane, data)
+        self.buffer.clear()
+
+    def lane_order(self, shard: int = 0) -> list[str]:
+        """
+        The pending lanes of a shard to take jobs from, in order.
+
+        Lanes are served strictly by priority, unless priority_weights are set. Then the first lane is drawn
+        by weight on every fetch, so a long backlog of urgent jobs can't starve the others completely.
+        """
+        priorities = self.priorities
+        if self.priority_weights:
+            first = random.choices(priorities, weights=[self.priority_weights.get(p, 0) for p in priorities])[0]
+            priorities = [first, *[p for p in priorities if p != first]]
+
+        queue = self.shard_queue(shard)
+        return [lane_key(queue, p) for p in priorities]
+
+    def wait_lane(self, shard: int = 0) -> str:
+        """
+        The lane an idle FIFO worker blocks on, only one lane can be waited on while moving its job to the processing list.
+
+        The default lane carries most jobs. Jobs in the other lanes are found by the claim before the next wait.
+        """
+        priority = DEFAULT if DEFAULT in self.priorities else self.priorities[0]
+        return lane_key(self.shard_queue(shard), priority)
+
+    def claim_keys(self, lanes: list[str] = None) -> list[str]:
+        return [self.processing_queue, self.running_queue, self.cancel_queue, self.deferred_queue, *self.limit_keys, *(lanes or self.lane_order())]
+
+    def claim_args(self) -> list:
+        """
+        Arguments for the claim script, taking up to prefetch jobs in one round trip.
+
+        The first job is checked for cancellation and marked running straight away, the rest wait in the
+        buffer until start_args. When claims are tracked they are recorded in this worker's processing
+        list so they survive the worker dying before they run.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        execution_ids = [str(uuid4()) for _ in range(self.prefetch)]
+
+        return [self.id, now, int(self.tracks_claims), self.limits, 'list' if self.fifo else 'set', *execution_ids]
+
+    def start_args(self, data: bytes) -> list:
+        """Arguments for the start script, for a job this worker has already claimed."""
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        return [self.id, now, int(self.tracks_claims), self.limits, str(uuid4()), data]
+
+    def claimed_jobs(self, started: list, claimed: list = []) -> list[tuple[bytes, Union[str, None]]]:
+        """
+        Turn the reply of the claim scripts into (payload, running field) pairs, leaving out cancelled jobs.
+
+        Args:
+            started: Flat payload, running field pairs, cancelled jobs have an empty running field and deferred ones 'deferred'
+            claimed: Payloads claimed but not yet started, their running field is None
+        """
+        jobs = []
+        for data, running_field in zip(started[::2], started[1::2]):
+            if self.started(data, running_field):
+                jobs.append((data, running_field.decode()))
+        return jobs + [(data, None) for data in claimed]
+
+    def started(self, data: bytes, running_field: bytes) -> bool:
+        if not running_field:
+            self.logger.info(f'Job {decode_payload(data, params=False)[0]} was cancelled, skipping execution')
+            self.release_blob(data)
+            # A job that is dropped won't run, so its dedupe key stops holding back new copies
+            dedupe = self.payload_dedupe(data)
+            if dedupe:
+                self.released_dedupe.append(dedupe)
+            return False
+        if running_field == b'deferred':
+            self.logger.info(f'Job {decode_payload(data, params=False)[0]} is over its concurrency or rate limit, deferring execution')
+            return False
+        if self.limits_slot(running_field):
+            self.slots.add(running_field.decode())
+        dedupe = self.payload_dedupe(data)
+        if dedupe:
+            self.claimed_dedupe.append(dedupe)
+        return True
+
+    def payload_dedupe(self, data: bytes) -> Union[str, None]:
+        """The dedupe key held by a job, None if it has none."""
+        # Most jobs have no dedupe key, their payloads aren't decoded again to find out
+        if b'"dedupe"' not in data:
+            return None
+        dedupe, dedupe_ttl = dedupe_window(decode_payload(data, params=False), False)
+        return dedupe if dedupe_ttl != '' else None
+
+    def claimed_dedupe_writes(self, pipe):
+        """Queue the commands that hold the dedupe keys of the jobs just started for another DEDUPE_HOLD and release those of cancelled jobs."""
+        self.dedupe_writes(pipe, self.claimed_dedupe, self.released_dedupe)
+        self.claimed_dedupe.clear()
+        self.released_dedupe.clear()
+
+    def recovered_dedupe_writes(self, pipe, claims: list[bytes], running: list[bytes]):
+        """
+        Queue the commands that settle the dedupe keys of a dead worker's jobs. Claims that were requeued hold theirs
+        for another DEDUPE_HOLD, running jobs that weren't requeued won't run again and release theirs.
+        """
+        held = {dedupe for dedupe in map(self.payload_dedupe, claims) if dedupe}
+        released = {dedupe for dedupe in map(running_dedupe, running) if dedupe} - held
+        self.dedupe_writes(pipe, held, released)
+
+    def dedupe_writes(self, pipe, held, released):
+        """Queue the commands that hold dedupe keys for another DEDUPE_HOLD and release others."""
+        for dedupe in held:
+            pipe.expire(dedupe, DEDUPE_HOLD)
+        if released:
+            pipe.delete(*released)
+
+    def limits_slot(self, running_field: Union[str, bytes]) -> bool:
+        """Whether a running job holds a concurrency slot."""
+        return concurrency_key(running_job_name(running_field)) in self.limit_keys
+
+    def promote_call(self, zset: str = None, limit: int = 1000) -> dict:
+        """
+        Arguments for the script that moves jobs that are due from a zset to their lane, at most limit of them at a time.
+
+        Args:
+            zset: The deferred queue by default, or the delayed queue
+        """
+        priorities = sorted(PRIORITIES, key=lambda p: p != DEFAULT)
+        lanes = self.shard_queue()
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        return {
+            'keys': [zset or self.deferred_queue, *[lane_key(lanes, p) for p in priorities]],
+            'args': [*priorities, 'list' if self.fifo else 'set', now, limit],
+        }
+
+    def pending_writes(self, ready_jobs: list[tuple[bytes, float]]) -> SchedulerWrites:
+        """
+        Move scheduled jobs that are due to the pending queue, running missed runs by each job's misfire policy.
+
+        At most misfire_batch runs are enqueued per call. Entries that don't fit, and jobs with missed runs
+        still to go, stay due for the next tick. Each entry's writes are guarded by the score it was read
+        with, see Worker.promote.
+        """
+        writes = SchedulerWrites()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        budget = self.misfire_batch
+        for member, score in ready_jobs:
+            if budget <= 0:
+                break
+
+            writes.guard(self.scheduled_queue, member.decode(), score)
+            job = next((j for j in self.jobs if j.name == member.decode()), None)
+            if job and job.schedule:
+                runs, resume = due_runs(job.schedule, job.misfire, score, now, job.misfire_grace, budget)
+            else:
+                runs, resume = [score], None
+
+            if not runs:
+                self.logger.info(f'Skipping missed run of {job.name}, next run at {resume}')
+            for run in runs:
+                # Each missed run is its own payload, or the pending set would keep only one of them
+                self.queue_pending(writes, member.decode(), fire_at=run if len(runs) > 1 or resume else None)
+            budget -= len(runs)
+
+            if resume is None:
+                writes.zrem(self.scheduled_queue, member.decode())
+            else:
+                writes.zadd(self.scheduled_queue, {member.decode(): resume})
+        return writes
+
+    def ready_workflow_writes(self, ready_workflows: list[tuple[bytes, float]]) -> tuple[SchedulerWrites, list[tuple[bytes, float]]]:
+        """
+        Take the workflows that are due off the scheduled queue, by each workflow's misfire policy.
+
+        Only one run of a workflow is active at a time, so 'all' runs it once like 'coalesce'.
+
+        Returns:
+            The writes, and the workflows to activate once they are applied
+        """
+        writes = SchedulerWrites()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        due = []
+        for member, score in ready_workflows:
+            writes.guard(self.scheduled_workflow_queue, member.decode(), score)
+            wf = next((w for w in self.workflows if w.name == member.decode()), None)
+            if wf and wf.schedule:
+                policy = COALESCE if wf.misfire == ALL else wf.misfire
+                runs, resume = due_runs(wf.schedule, policy, score, now, wf.misfire_grace)
+            else:
+                runs, resume = [score], None
+
+            if runs:
+                due.append((member, score))
+                writes.zrem(self.scheduled_workflow_queue, member.decode())
+            else:
+                self.logger.info(f'Skipping missed run of workflow {wf.name}, next run at {resume}')
+                writes.zadd(self.scheduled_workflow_queue, {member.decode(): resume})
+        return writes, due
+
+    def activate_workflows(self, ready_workflows: list[tuple[bytes, float]]):
+        for workflow in ready_workflows:
+            wf_name = workflow[0].decode()
+            wf = next((w for w in self.workflows if w.name == wf_name), None)
+            if not wf:
+                self.logger.warning(f'Workflow {wf_name} is scheduled but not loaded on this worker, skipping')
+                continue
+
+            wf.status = 'active'
+
+    def finish_call(self, data: bytes, running_field: str, job: NutsJob = None, workflow_name: str = None, record: bool = False) -> dict:
+        """
+        Arguments for the finish script, which clears a job's running entry and claim, records its completion
+        and enqueues the next job in its chain in one round trip.
+
+        Args:
+            data: The claimed job payload
+            running_field: The job's field in the running hash
+            job: The job that ran, None if it never started
+            workflow_name: Workflow the job ran for, if any
+            record: Record the completion for the leader to pick up (cron and workflow jobs)
+        """
+        self.slots.discard(running_field)
+        completed_name = ''
+        completed = ''
+        next_job = ''
+        if job and record:
+            completed_name = f'{workflow_name}|{job.name}' if workflow_name else job.name
+
+            job_data = {'success': job.success}
+            if job.error:
+                job_data['error'] = str(job.error)
+            completed = json.dumps(job_data)
+
+        try:
+            payload = decode_payload(data, params=False)
+        except (ValueError, ImportError):
+            payload = []
+
+        # Light DAG support, can chain together jobs in a workflow by defining the next step that should
+        # be taken after a job completes
+        # The next job in the chain keeps the priority of the one that queued it, but not its dedupe key
+        priority = payload_priority(payload)
+        if job and job.success and job.next:
+            next_job = job_payload(job.next, job.result, priority, self.codec)
+
+        dedupe, dedupe_ttl = dedupe_window(payload, job.success if job else False)
+
+        job_id = payload_options(payload).get('id')
+        result = ''
+        if job and job_id:
+            record = result_record(job_id, job.name, job.success, job.result, str(job.error) if job.error else None)
+            result = encode_record(record, self.result_max_bytes)
+
+        return {
+            'keys': [
+                self.running_queue,
+                self.completed_queue,
+                lane_key(self.shard_queue(), priority),
+                self.processing_queue,
+                concurrency_key(running_job_name(running_field)),
+                dedupe,
+                result_key(job_id or ''),
+            ],
+            'args': [
+                running_field,
+                completed_name,
+                completed,
+                next_job,
+                data if self.tracks_claims else '',
+                'list' if self.fifo else 'set',
+                dedupe_ttl,
+                result,
+                self.result_ttl,
+            ],
+        }
+
+    def completed_writes(self, completed_jobs: list[bytes]) -> SchedulerWrites:
+        """
+        Apply drained completions to the running workflows and reschedule finished cron jobs.
+
+        Args:
+            completed_jobs: The completed hash as flattened field/value pairs
+        """
+        writes = SchedulerWrites()
+
+        for job_name, job_results_raw in zip(completed_jobs[::2], completed_jobs[1::2]):
+            job_results = json.loads(job_results_raw)
+            status = 'completed' if job_results.get('success', None) else 'failed'
+
+            # The completed queue has already been cleared, so skip anything we don't know rather than losing the rest
+            if 'workflow' in job_name.decode():
+                [workflow_name, job_name] = job_name.decode().split('|')
+                workflow_name = workflow_name.replace('workflow-', '')
+                wf = next((w for w in self.workflows if w.name == workflow_name), None)
+                if not wf:
+                    self.logger.error(f'Completed job {job_name} for unknown workflow {workflow_name}')
+                    continue
+
+                # Pass error information if job failed
+                error_msg = job_results.get('error', None) if status == 'failed' else None
+                wf.update(job_name, status, error_msg)
+
+            else:
+                job = next((j for j in self.jobs if j.name == job_name.decode()), None)
+                if not job or not job.schedule:
+                    self.logger.error(f'Completed job {job_name.decode()} is not a registered cron job')
+                    continue
+
+                next_execution = self.scheduler.get_next_execution(job.schedule).timestamp()
+
+                # A job still catching up on missed runs is already back in the scheduled queue, that entry stands
+                writes.zadd(self.scheduled_queue, {job.name: next_execution}, nx=True)
+
+        return writes
+
+    def reschedule_workflow(self, writes: SchedulerWrites, workflow: NutsWorkflow):
+        workflow.reset()
+        next_execution = self.scheduler.get_next_execution(workflow.schedule).timestamp()
+        writes.zadd(self.scheduled_workflow_queue, {workflow.name: next_execution})
+
+    def workflow_step_writes(self) -> SchedulerWrites:
+        """
+        Execute active workflows by checking dependencies and scheduling ready jobs.
+
+        This method:
+        - Checks for job failures (stops workflow if any job failed)
+        - Identifies next ready job based on dependencies
+        - Schedules ready jobs to pending queue
+        - Reschedules completed/failed workflows for next run
+
+        Workflows are executed by the leader worker only.
+        """
+        writes = SchedulerWrites()
+
+        try:
+            for workflow in self.workflows:
+                # A failed job marks its workflow failed when its completion comes in, it is rescheduled from here
+                if workflow.status in ('active', 'failed'):
+                    self.logger.info(f'Running workflow {workflow.name}')
+
+                    # Check for failures first
+                    if workflow.has_failures():
+                        self.logger.error(f'Workflow {workflow.name} failed: {workflow.error}')
+                        workflow.status = 'failed'
+                        # Reschedule for next run
+                        self.reschedule_workflow(writes, workflow)
+                        continue
+
+                    try:
+                        next_job = workflow.run()
+                        if not next_job and workflow.completed():
+                            self.logger.info(f'Workflow {workflow.name} completed successfully')
+                            self.reschedule_workflow(writes, workflow)
+                        elif next_job:
+                            self.logger.info(f'Workflow {workflow.name} next job {next_job}')
+
+                            self.queue_pending(writes, f'workflow-{workflow.name}|{next_job}')
+                            workflow.update(next_job, 'pending')
+
+                    except Exception as ex:
+                        # Deal with user error gracefully
+                        self.logger.error(f'Unhandled Exception In Workflow: {workflow.name}: {ex}')
+                        workflow.status = 'failed'
+                        workflow.error = str(ex)
+                        self.reschedule_workflow(writes, workflow)
+
+        except Exception as ex:
+            self.logger.error(f'Unhandled Exception in run_workflows: {ex}')
+
+        return writes
+
+    def prepare_job(self, data: bytes) -> tuple[Union[NutsJob, None], Union[dict, list], Union[str, None]]:
+        """
+        Decode a claimed payload into a fresh copy of the job to run.
+
+        Returns:
+            The job, None if no registered job matches, its arguments and the workflow it runs for
+        """
+        payload = decode_payload(data)
+        [job_name, job_args] = payload[:2]
+        workflow_name = None
+        if 'workflow' in job_name:
+            [workflow_name, job_name] = job_name.split('|')
+
+        # Offloaded params are only read once the job is about to run
+        blob = payload_options(payload).get('blob')
+        if blob:
+            try:
+                job_args = load_params(self.blob_store, blob)
+            except Exception as ex:
+                self.logger.error(f'Could not load the params of {job_name} from blob {blob}: {ex}')
+                return None, [], workflow_name
+
+        jobs = [j for j in self.jobs if j.name == job_name]
+
+        if not len(jobs):
+            self.logger.info(f'No job matches name {job_name}')
+            return None, job_args, workflow_name
+
+        # Each execution works on its own copy so result state can't leak between concurrent runs
+        return jobs[0].copy(), job_args, workflow_name
+
+    def release_blob(self, data: bytes):
+        """Delete a job's offloaded params once it has finished or been cancelled."""
+        try:
+            blob = payload_options(decode_payload(data, params=False)).get('blob')
+            if blob and self.blob_store:
+                self.blob_store.delete(blob)
+        except Exception as ex:
+            self.logger.error(f'Could not delete blob of job {data[:100]}: {ex}')
+
+    def result_cache_key(self, job: NutsJob, job_args: Union[dict, list]) -> Union[str, None]:
+        """The cache key for a run of the job, None if the job doesn't cache its results."""
+        return cache_key(job.name, job_args) if job.cache_ttl else None
+
+    def cache_get_call(self, job: NutsJob, key: str) -> dict:
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        return {'keys': [key, index_key(job.name)], 'args': [now]}
+
+    def cache_result_call(self, job: NutsJob, key: str) -> Union[dict, None]:
+        """Arguments for the script that caches a job's result, None if the result can't be cached."""
+        value = encode_result(job.result)
+        if value is None:
+            self.logger.warning(f'Result of {job.name} is not JSON serializable, not caching it')
+            return None
+
+        if self.local_cache:
+            self.local_cache.put(key, value, job.cache_ttl)
+
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        return {'keys': [key, index_key(job.name)], 'args': [value, job.cache_ttl, now, job.cache_size]}
+
+    def cache_hit(self, job: NutsJob, key: str, value: Union[str, bytes]):
+        """Complete a job with its cached result, as if it had run."""
+        if self.local_cache:
+            self.local_cache.put(key, value if isinstance(value, str) else value.decode(), job.cache_ttl)
+
+        job.result = json.loads(value)
+        job.success = True
+        self.logger.info(f'Cache hit for {job.name}, skipping execution')
+
+    def job_finished(self, job: NutsJob):
+        if job.success:
+            self.logger.info(f'SUCCESS: {job.name}, {job.result}')
+        else:
+            self.logger.error(f'Error running job {job.name}: {job.error}')
+
+        self.last_run = datetime.datetime.now(datetime.timezone.utc)
@@ -0,0 +1,105 @@
+"""
+Claim checks for large job params.
+
+A WorkQueue with a blob store moves params over `offload_min_bytes` out of Redis, into the store. The
+payload only carries a reference to them, under the `blob` option. The worker reads them back when it
+runs the job, and deletes them once the job has finished or been cancelled.
+
+The store has to be reachable from every worker that may run the job. The default, FileBlobStore, keeps
+params in files, which suits workers on the same host or sharing a volume.
+
+Classes:
+    BlobStore: Protocol for blob stores
+    FileBlobStore: Blob store backed by a directory, read through mmap
+
+Functions:
+    offload_params: Move a job's params to a blob store if they are large
+    load_params: Read a job's params back from a blob store
+"""
+from typing import Any, Protocol, Union
+from uuid import uuid4
+import mmap
+import os
+import re
+import tempfile
+from .codecs import PayloadCodec, unpack_params
+
+# Params whose packed encoding is at least this large are offloaded
+OFFLOAD_MIN_BYTES = 1024 * 1024
+
+_REF = re.compile(r'[0-9a-f]{32}')
+
+
+class BlobStore(Protocol):
+    """Protocol for blob stores."""
+
+    def put(self, data: bytes) -> str:
+        """Store a blob, returning its reference."""
+        ...
+
+    def get(self, ref: str) -> Any:
+        """A blob's contents as bytes or another buffer. Buffers with a close method are closed once read."""
+        ...
+
+    def delete(self, ref: str):
+        """Delete a blob, if it still exists."""
+        ...
+
+
+class FileBlobStore():
+    '''
+        Blobs in a directory, one file each. Blobs are read through a read only mmap, so they aren't copied
+        into the worker's memory before their params are decoded.
+    '''
+    directory: str
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'nuts-blobs')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, ref: str) -> str:
+        # References come back out of Redis, only ones this store could have made are accepted
+        if not _REF.fullmatch(ref):
+            raise ValueError(f'Invalid blob reference {ref}')
+        return os.path.join(self.directory, ref)
+
+    def put(self, data: bytes) -> str:
+        ref = uuid4().hex
+        path = self.path(ref)
+        # Written under a temporary name and renamed, so a blob is never seen half written
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{path}.tmp', path)
+        return ref
+
+    def get(self, ref: str) -> Union[mmap.mmap, bytes]:
+        with open(self.path(ref), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def delete(self, ref: str):
+        try:
+            os.unlink(self.path(ref))
+        except FileNotFoundError:
+            pass
+
+
+def offload_params(store: BlobStore, codec: PayloadCodec, job_params: Any, min_bytes: int = OFFLOAD_MIN_BYTES) -> tuple[Any, Union[str, None]]:
+    """
+    Returns:
+        The params to enqueue and the reference to the offloaded ones, or the params themselves and None if they are small
+    """
+    packed = codec.pack(job_params)
+    if len(packed) < min_bytes:
+        return job_params, None
+    return [], store.put(packed)
+
+
+def load_params(store: BlobStore, ref: str) -> Any:
+    blob = store.get(ref)
+    try:
+        return unpack_params(blob)
+    finally:
+        if hasattr(blob, 'close'):
+            blob.close()
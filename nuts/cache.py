@@ -0,0 +1,71 @@
+"""
+Memoized job results.
+
+Jobs that set `cache_ttl` have their successful results cached under the job name and a hash of their
+arguments. The Redis tier is shared by every worker, each job keeps at most `cache_size` entries there
+and the least recently used ones are evicted first. Workers can keep a small LRU of their own in front
+of it with `result_cache_size`.
+
+Classes:
+    LocalCache: In-process LRU of encoded results with a TTL per entry
+
+Functions:
+    cache_key: The Redis key of a job's cached result for a set of arguments
+    index_key: The sorted set of a job's cached results, scored by last use
+"""
+from collections import OrderedDict
+from typing import Any, Union
+import hashlib
+import json
+import threading
+import time
+
+
+def cache_key(job_name: str, job_args: Any) -> str:
+    """Arguments are hashed in a canonical encoding, so key order doesn't matter."""
+    digest = hashlib.sha256(json.dumps(job_args, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+    return f'nuts|cache|{job_name}|{digest}'
+
+
+def index_key(job_name: str) -> str:
+    return f'nuts|cache|{job_name}'
+
+
+def encode_result(result: Any) -> Union[str, None]:
+    """The cached form of a result, None if it can't be encoded as JSON and so can't be cached."""
+    try:
+        return json.dumps(result)
+    except (TypeError, ValueError):
+        return None
+
+
+class LocalCache():
+    '''
+        In-process LRU of encoded results, shared by the executions of one worker.
+    '''
+    size: int
+    entries: OrderedDict[str, tuple[str, float]]
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Union[str, None]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, value: str, ttl: float):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
@@ -0,0 +1,181 @@
+"""
+Encodings for pending job payloads.
+
+Payloads are JSON by default, [name, params] or [name, params, options]. Producers and workers can pick a
+faster codec for the params instead, and compress the ones over a size threshold. Those payloads start
+with a header naming both, so every worker can read them whatever it writes itself and plain JSON payloads
+keep working alongside them:
+
+    \\x01, codec id, compression id, JSON [name, options], \\n, encoded params
+
+The name and options stay JSON so the claim scripts can read them without touching the params.
+
+Codecs: 'json', 'orjson' (needs orjson) and 'msgpack' (needs msgpack)
+Compression: 'lz4' (needs lz4) and 'zstd' (needs zstandard)
+
+Params offloaded to a blob store (see nuts.blobs) are packed on their own, as codec id, compression id, then
+the encoded params.
+
+Classes:
+    PayloadCodec: Encodes payloads with a codec and optional compression
+
+Functions:
+    decode_payload: Decode a payload in any encoding into [name, params] or [name, params, options]
+    unpack_params: Decode params packed by PayloadCodec.pack
+"""
+from functools import lru_cache
+from typing import Any, Callable, Union
+import importlib
+import json
+
+# Encoded params at least this large are compressed, when compression is on
+COMPRESS_MIN_BYTES = 1024
+
+HEADER = b'\x01'
+_UNCOMPRESSED = b'-'
+
+# name: (id, module it needs)
+CODECS = {'json': (b'j', None), 'orjson': (b'o', 'orjson'), 'msgpack': (b'm', 'msgpack')}
+COMPRESSIONS = {'lz4': (b'l', 'lz4.frame'), 'zstd': (b'z', 'zstandard')}
+
+
+def _import(module: str, name: str):
+    try:
+        return importlib.import_module(module)
+    except ImportError as ex:
+        package = module.split('.')[0]
+        raise ImportError(f'The {name} payload encoding needs the {package} package, pip install {package}') from ex
+
+
+@lru_cache(maxsize=None)
+def _codec(codec_id: bytes) -> tuple[Callable[[Any], bytes], Callable[[bytes], Any]]:
+    """The encode and decode functions of a codec."""
+    if codec_id == b'j':
+        return (lambda obj: json.dumps(obj, sort_keys=True).encode()), json.loads
+    if codec_id == b'o':
+        orjson = _import('orjson', 'orjson')
+        return (lambda obj: orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)), orjson.loads
+    if codec_id == b'm':
+        msgpack = _import('msgpack', 'msgpack')
+        return (lambda obj: msgpack.packb(obj, use_bin_type=True)), (lambda data: msgpack.unpackb(data, raw=False))
+    raise ValueError(f'Unknown payload codec {codec_id!r}')
+
+
+@lru_cache(maxsize=None)
+def _compression(compression_id: bytes) -> tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """The compress and decompress functions of a compression."""
+    if compression_id == b'l':
+        frame = _import('lz4.frame', 'lz4')
+        return frame.compress, frame.decompress
+    if compression_id == b'z':
+        zstandard = _import('zstandard', 'zstd')
+        return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+    raise ValueError(f'Unknown payload compression {compression_id!r}')
+
+
+class PayloadCodec():
+    '''
+        Encodes pending job payloads with a codec, compressing large params.
+
+        The default, JSON without compression, writes plain JSON payloads. So does JSON with compression
+        for params under the threshold.
+    '''
+    codec: str
+    compression: Union[str, None]
+    compress_min_bytes: int
+
+    def __init__(self, codec: str = 'json', compression: str = None, compress_min_bytes: int = COMPRESS_MIN_BYTES):
+        if codec not in CODECS:
+            raise ValueError(f'Unknown codec {codec}, expected one of {", ".join(CODECS)}')
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression {compression}, expected one of {", ".join(COMPRESSIONS)}')
+
+        self.codec = codec
+        self.compression = compression
+        self.compress_min_bytes = compress_min_bytes
+
+        # Fail on a missing package when the codec is set up, rather than on the first job
+        self.codec_id = CODECS[codec][0]
+        self.encode_params = _codec(self.codec_id)[0]
+        self.compression_id = COMPRESSIONS[compression][0] if compression else None
+        self.compress = _compression(self.compression_id)[0] if compression else None
+
+    def encode(self, job_name: str, job_params: Any, options: dict) -> Union[str, bytes]:
+        """Options are only recorded when there are any, keys are sorted so the same job always encodes the same way."""
+        if self.codec == 'json' and not self.compression:
+            return _plain(job_name, job_params, options)
+
+        body = self.encode_params(job_params)
+        compression = _UNCOMPRESSED
+        if self.compress and len(body) >= self.compress_min_bytes:
+            body = self.compress(body)
+            compression = self.compression_id
+        elif self.codec == 'json':
+            return _plain(job_name, job_params, options)
+
+        meta = json.dumps([job_name, options], sort_keys=True)
+        return HEADER + self.codec_id + compression + meta.encode() + b'\n' + body
+
+    def pack(self, job_params: Any) -> bytes:
+        """Encode params on their own, compressed if they are large and compression is on."""
+        body = self.encode_params(job_params)
+        if self.compress and len(body) >= self.compress_min_bytes:
+            return self.codec_id + self.compression_id + self.compress(body)
+        return self.codec_id + _UNCOMPRESSED + body
+
+
+def _plain(job_name: str, job_params: Any, options: dict) -> str:
+    if not options:
+        return json.dumps([job_name, job_params], sort_keys=True)
+    return json.dumps([job_name, job_params, options], sort_keys=True)
+
+
+# Payloads the scheduler writes, these carry no params and travel inside JSON encoded write batches
+PLAIN = PayloadCodec()
+
+
+def decode_payload(data: Union[str, bytes], params: bool = True) -> list:
+    """
+    Args:
+        data: A payload in any encoding
+        params: Decode the params too, otherwise they are None in encoded payloads
+
+    Raises:
+        ValueError: The payload is malformed or uses an unknown encoding
+        ImportError: The payload's codec or compression needs a package that isn't installed
+    """
+    if not isinstance(data, bytes) or data[:1] != HEADER:
+        return json.loads(data)
+
+    stop = data.find(b'\n', 3)
+    if stop < 0:
+        raise ValueError('Payload header has no end')
+    job_name, options = json.loads(data[3:stop])
+
+    job_params = None
+    if params:
+        body = data[stop + 1:]
+        if data[2:3] != _UNCOMPRESSED:
+            body = _compression(data[2:3])[1](body)
+        job_params = _codec(data[1:2])[1](body)
+
+    if not options:
+        return [job_name, job_params]
+    return [job_name, job_params, options]
+
+
+def unpack_params(data: Any) -> Any:
+    """
+    Decode params packed by PayloadCodec.pack from bytes or any other buffer, such as an mmap.
+
+    Only the compressed body or the decoded params are copied out of the buffer, not the buffer itself.
+    """
+    header = bytes(data[:2])
+    codec_id, compression_id = header[:1], header[1:]
+    with memoryview(data) as view, view[2:] as body:
+        if compression_id != _UNCOMPRESSED:
+            return _codec(codec_id)[1](_compression(compression_id)[1](body))
+        if codec_id == b'j':
+            # json only reads str and bytes
+            return json.loads(bytes(body))
+        return _codec(codec_id)[1](body)
@@ -0,0 +1,147 @@
+"""
+Riding out Redis outages and failovers.
+
+Clients made by `connect` retry a command a few times, with jittered exponential backoff, before a
+dropped connection surfaces as an error. Commands that time out aren't retried. With sentinels they look the master up through Redis Sentinel
+and follow it to a promoted replica on reconnect, so a failover costs a few seconds of retries.
+
+Errors that outlast the retries trip the worker's CircuitBreaker. The worker then parks, probing Redis
+with a PING after each backoff, and logs once when it loses Redis and once when it gets it back.
+
+Classes:
+    CircuitBreaker: Tracks consecutive connection failures and how long to back off for
+
+Functions:
+    connect: A Redis client that retries and follows failovers
+    connect_async: The same for redis.asyncio
+"""
+from typing import Sequence, Union
+import time
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.asyncio.sentinel import Sentinel as AsyncSentinel
+from redis.backoff import EqualJitterBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+from redis.sentinel import Sentinel
+
+# Errors that mean Redis couldn't be reached, rather than that a command failed
+CONNECTION_ERRORS = (ConnectionError, TimeoutError)
+
+# Errors clients made by connect retry a command on. A command that timed out may still have run on the server,
+# and running a claim or finish script twice would lose or repeat a job, so timeouts are left to the caller.
+RETRY_ERRORS = (ConnectionError,)
+
+# Command retries of clients made by connect, and the backoff between them
+RETRIES = 3
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 5.0
+
+# Consecutive failures after which a worker stops polling and parks
+FAILURE_THRESHOLD = 3
+
+
+class CircuitBreaker():
+    '''
+        Counts consecutive connection failures. Every failure backs off for longer, up to backoff_cap
+        seconds with equal jitter, so workers that lost Redis together don't come back in lockstep.
+
+        After failure_threshold failures the breaker opens. The worker stops running jobs and checks
+        Redis once per backoff until a check succeeds and closes it again.
+    '''
+    failures: int
+    opened_at: Union[float, None]
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, backoff_base: float = BACKOFF_BASE, backoff_cap: float = BACKOFF_CAP):
+        self.failure_threshold = max(1, failure_threshold)
+        self.backoff = EqualJitterBackoff(cap=backoff_cap, base=backoff_base)
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def failure(self) -> float:
+        """
+        Record a connection failure.
+
+        Returns:
+            How many seconds to wait before talking to Redis again
+        """
+        delay = self.backoff.compute(self.failures)
+        self.failures += 1
+        if self.failures >= self.failure_threshold and self.opened_at is None:
+            self.opened_at = time.monotonic()
+        return delay
+
+    def success(self) -> Union[float, None]:
+        """
+        Record a successful round trip.
+
+        Returns:
+            How many seconds the breaker was open for, None if it wasn't
+        """
+        outage = time.monotonic() - self.opened_at if self.opened_at is not None else None
+        self.failures = 0
+        self.opened_at = None
+        return outage
+
+
+def connect(
+    url: str = 'redis://localhost:6379/0',
+    sentinels: Sequence[tuple[str, int]] = None,
+    service_name: str = 'mymaster',
+    retries: int = RETRIES,
+    socket_timeout: float = 5,
+    health_check_interval: int = 30,
+    **kwargs
+) -> Redis:
+    """
+    A Redis client that retries commands through blips and follows failovers.
+
+    Args:
+        url: Redis to connect to, unused when sentinels are given
+        sentinels: (host, port) of Redis Sentinels to find the master of service_name through
+        retries: Times a command is retried on a connection error, with jittered exponential backoff. Timeouts aren't retried
+        socket_timeout: Seconds before a command on an unresponsive connection fails
+        health_check_interval: Seconds a connection may sit idle before it is checked on next use
+        kwargs: Passed on to the client
+    """
+    options = dict(
+        retry=Retry(EqualJitterBackoff(cap=BACKOFF_CAP, base=BACKOFF_BASE), retries),
+        retry_on_error=list(RETRY_ERRORS),
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=socket_timeout,
+        health_check_interval=health_check_interval,
+        **kwargs
+    )
+    if sentinels:
+        sentinel = Sentinel(sentinels, socket_timeout=socket_timeout)
+        return sentinel.master_for(service_name, **options)
+    return Redis.from_url(url, **options)
+
+
+def connect_async(
+    url: str = 'redis://localhost:6379/0',
+    sentinels: Sequence[tuple[str, int]] = None,
+    service_name: str = 'mymaster',
+    retries: int = RETRIES,
+    socket_timeout: float = 5,
+    health_check_interval: int = 30,
+    **kwargs
+) -> AsyncRedis:
+    """The same client as connect, for redis.asyncio."""
+    options = dict(
+        retry=AsyncRetry(EqualJitterBackoff(cap=BACKOFF_CAP, base=BACKOFF_BASE), retries),
+        retry_on_error=list(RETRY_ERRORS),
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=socket_timeout,
+        health_check_interval=health_check_interval,
+        **kwargs
+    )
+    if sentinels:
+        sentinel = AsyncSentinel(sentinels, socket_timeout=socket_timeout)
+        return sentinel.master_for(service_name, **options)
+    return AsyncRedis.from_url(url, **options)
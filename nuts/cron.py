@@ -1,216 +1,404 @@
-import datetime
-from dateutil.relativedelta import relativedelta
+"""
+Cron schedules.
+
+A schedule has 7 space separated fields, `seconds minutes hours day-of-week month day-of-month year`.
+Each field is `*`, a single value or `start/frequency`, where `*/frequency` starts from the field's
+first value. One of day-of-week and day-of-month must be `?`. Days of the week count from Monday as 0,
+`n/frequency` fires every frequency days from the first such weekday of the month.
+
+Schedules are compiled once into a CronExpression and cached, so finding when one next or last fired is
+a few bisections over values worked out up front, and its upcoming times can be iterated lazily.
+
+Classes:
+    CronExpression: A compiled schedule
+    Cron: Next and previous execution times of schedules
+
+Functions:
+    parse_expression: The compiled schedule for an expression, cached
+"""
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator, Union
 import calendar
+import datetime
+import functools
 
+# Compiled schedules kept, most recently used first
+EXPRESSION_CACHE_SIZE = 1024
 
-class Cron():
+# Years searched for the next execution before a schedule is taken to never fire, the calendar repeats every 400
+_SEARCH_YEARS = 400
 
-    def __get_start_frequency(self, input: str, base: str = None) -> list[int]:
-        try:
-            [start, frequency] = input.split('/')
-            if start == '*':
-                start = base if base is not None else '0'
-            return [int(start), int(frequency)]
 
-        except Exception:
-            raise Exception(f'Invalid expression {input}: Valid examples include: */int, int/int')
-
-    def __get_week_structure(self, year: int, month: int) -> list[int]:
-        start_of_month = calendar.monthrange(year, month)[0]
-        week_structure = []
-        while len(week_structure) < 7:
-            if start_of_month < 8:
-                week_structure.append(start_of_month)
-                start_of_month += 1
-            else:
-                start_of_month = 1
-        return week_structure
+@functools.lru_cache(maxsize=4096)
+def _month(year: int, month: int) -> tuple[int, int]:
+    """Weekday of the first day of a month, Monday is 0, and its number of days."""
+    return calendar.monthrange(year, month)
 
-    def get_next_execution(self, schedule: str, now: datetime.datetime = None) -> datetime.datetime:
-        if now is None:
-            now = datetime.datetime.now(datetime.timezone.utc)
+
+def _start_frequency(value: str, base: str) -> tuple[int, int]:
+    try:
+        [start, frequency] = value.split('/')
+        if start == '*':
+            start = base
+        start, frequency = int(start), int(frequency)
+        if frequency < 1:
+            raise ValueError(frequency)
+        return start, frequency
+
+    except Exception:
+        raise Exception(f'Invalid expression {value}: Valid examples include: */int, int/int')
+
+
+def _values(value: str, low: int, high: int) -> tuple[int, ...]:
+    """The values a seconds, minutes, hours or months field matches, in order."""
+    if value == '*':
+        return tuple(range(low, high))
+    if '/' not in value:
         try:
-            [seconds, minutes, hours, day_of_week, month, day_of_month, year] = schedule.split(' ')
+            values = (int(value),)
+        except ValueError:
+            raise Exception(f'Invalid expression {value}: Valid examples include: */int, int/int')
+    else:
+        start, frequency = _start_frequency(value, str(low))
+        values = tuple(range(start, high, frequency))
+
+    if not values or not low <= values[0] < high:
+        raise Exception(f'Invalid expression {value}: values must be between {low} and {high - 1}')
+    return values
+
+
+def _days(day_of_month: str) -> tuple[int, int]:
+    """The first day and frequency of a day-of-month field, a frequency of 0 matches the first day only."""
+    if day_of_month == '*':
+        return 1, 1
+    if '/' not in day_of_month:
+        [start] = _values(day_of_month, 1, 32)
+        return start, 0
+    start, frequency = _start_frequency(day_of_month, '1')
+    _values(str(start), 1, 32)
+    return start, frequency
+
+
+def _weekdays(day_of_week: str) -> tuple[Union[int, None], int]:
+    """The weekday and frequency in days of a day-of-week field, no weekday when it matches every day."""
+    if day_of_week == '*':
+        return None, 1
+    if '/' not in day_of_week:
+        [weekday] = _values(day_of_week, 0, 8)
+        return weekday % 7, 7
+    weekday, frequency = _start_frequency(day_of_week, '1')
+    _values(str(weekday), 0, 8)
+    return weekday % 7, frequency
+
+
+def _years(year: str) -> tuple[int, int]:
+    """The first year and frequency of a year field, a single year matches it and every year after."""
+    if year == '*':
+        return 1970, 1
+    if '/' not in year:
+        try:
+            return int(year), 1
+        except ValueError:
+            raise Exception(f'Invalid expression {year}: Valid examples include: */int, int/int')
+    return _start_frequency(year, '1970')
+
+
+def _next_step(start: int, frequency: int, value: int) -> Union[int, None]:
+    """The first of start, start + frequency, ... that is at least value. A frequency of 0 only has start."""
+    if value <= start:
+        return start
+    if not frequency:
+        return None
+    return start + -(-(value - start) // frequency) * frequency
+
+
+def _previous_step(start: int, frequency: int, value: int) -> Union[int, None]:
+    """The last of start, start + frequency, ... that is at most value."""
+    if value < start:
+        return None
+    if not frequency:
+        return start
+    return start + (value - start) // frequency * frequency
+
+
+class CronExpression():
+    '''
+        A schedule compiled once. Seconds, minutes, hours and months are kept as the sorted values they
+        match, days and years as arithmetic progressions, so next_after is a handful of bisections.
+    '''
+    seconds: tuple[int, ...]
+    minutes: tuple[int, ...]
+    hours: tuple[int, ...]
+    months: tuple[int, ...]
+
+    def __init__(self, expression: str):
+        try:
+            [seconds, minutes, hours, day_of_week, month, day_of_month, year] = expression.split(' ')
         except Exception:
             raise Exception('Expression must have 7 postions')
 
         if '?' not in [day_of_week, day_of_month]:
             raise Exception('Cannot specify both day-of-week and day-of-month')
 
-        [next_seconds, inc_minute] = self.parse_seconds(seconds, now)
-        if inc_minute:
-            now = now + datetime.timedelta(minutes=1)
-        [next_minutes, inc_hour] = self.parse_minutes(minutes, now)
-        if inc_hour:
-            now = now + datetime.timedelta(hours=1)
-        [next_hours, inc_day] = self.parse_hours(hours, now)
-        if inc_day:
-            now = now + datetime.timedelta(days=1)
+        self.expression = expression
+        self.seconds = _values(seconds, 0, 60)
+        self.minutes = _values(minutes, 0, 60)
+        self.hours = _values(hours, 0, 24)
+        self.months = _values(month, 1, 13)
+        # Days are counted from day_start, or from the first day of the month that is the weekday
         if day_of_week == '?':
-            [next_days, inc_month] = self.parse_day_of_month(day_of_month, now)
-
+            self.weekday = None
+            self.day_start, self.day_frequency = _days(day_of_month)
         else:
-            [next_days, inc_month] = self.parse_day_of_week(day_of_week, now)
+            self.weekday, self.day_frequency = _weekdays(day_of_week)
+            self.day_start = 1
+        self.year_start, self.year_frequency = _years(year)
+
+    def __repr__(self) -> str:
+        return f'CronExpression({self.expression!r})'
+
+    def next_day(self, year: int, month: int, day: int) -> Union[int, None]:
+        """The first day of the month from day on that the schedule fires on, None if there isn't one."""
+        first_weekday, days = _month(year, month)
+        start = self.day_start if self.weekday is None else 1 + (self.weekday - first_weekday) % 7
+        found = _next_step(start, self.day_frequency, day)
+        return found if found is not None and found <= days else None
+
+    def previous_day(self, year: int, month: int, day: int) -> Union[int, None]:
+        """The last day of the month up to day that the schedule fires on, None if there isn't one."""
+        first_weekday, days = _month(year, month)
+        start = self.day_start if self.weekday is None else 1 + (self.weekday - first_weekday) % 7
+        return _previous_step(start, self.day_frequency, min(day, days))
+
+    def next_year(self, year: int) -> int:
+        return _next_step(self.year_start, self.year_frequency, year)
+
+    def previous_year(self, year: int) -> Union[int, None]:
+        return _previous_step(self.year_start, self.year_frequency, year)
+
+    def next_after(self, now: datetime.datetime) -> datetime.datetime:
+        """
+        The first time after now that the schedule fires.
+
+        Naive datetimes are taken to be UTC, the result is always in UTC.
+        """
+        if now.tzinfo is not None:
+            now = now.astimezone(datetime.timezone.utc)
+
+        # Each field moves to the next value it matches. When one runs out the field above it moves on by one,
+        # and whenever a field moves the ones below it start over.
+        year, month, day, hour, minute, second = now.year, now.month, now.day, now.hour, now.minute, now.second + 1
+        limit = self.next_year(year) + _SEARCH_YEARS
+        while True:
+            found = self.next_year(year)
+            if found != year:
+                year, month, day, hour, minute, second = found, 1, 1, 0, 0, 0
+            if year > limit:
+                raise Exception(f'Expression {self.expression} never fires')
+
+            i = bisect_left(self.months, month)
+            if i == len(self.months):
+                year, month, day, hour, minute, second = year + 1, 1, 1, 0, 0, 0
+                continue
+            if self.months[i] != month:
+                month, day, hour, minute, second = self.months[i], 1, 0, 0, 0
+
+            found = self.next_day(year, month, day)
+            if found is None:
+                if month == 12:
+                    year, month = year + 1, 0
+                month, day, hour, minute, second = month + 1, 1, 0, 0, 0
+                continue
+            if found != day:
+                day, hour, minute, second = found, 0, 0, 0
+
+            i = bisect_left(self.hours, hour)
+            if i == len(self.hours):
+                day, hour, minute, second = day + 1, 0, 0, 0
+                continue
+            if self.hours[i] != hour:
+                hour, minute, second = self.hours[i], 0, 0
+
+            i = bisect_left(self.minutes, minute)
+            if i == len(self.minutes):
+                hour, minute, second = hour + 1, 0, 0
+                continue
+            if self.minutes[i] != minute:
+                minute, second = self.minutes[i], 0
+
+            i = bisect_left(self.seconds, second)
+            if i == len(self.seconds):
+                minute, second = minute + 1, 0
+                continue
+
+            return datetime.datetime(year, month, day, hour, minute, self.seconds[i], tzinfo=datetime.timezone.utc)
+
+    def previous_before(self, now: datetime.datetime) -> Union[datetime.datetime, None]:
+        """
+        The last time before now that the schedule fired, the mirror of next_after.
+
+        Returns:
+            The time in UTC, None if the schedule hasn't fired yet
+        """
+        if now.tzinfo is not None:
+            now = now.astimezone(datetime.timezone.utc)
+
+        # Fields move back to the last value they match, and the ones below a field that moved start over from their last
+        year, month, day, hour, minute = now.year, now.month, now.day, now.hour, now.minute
+        second = now.second if now.microsecond else now.second - 1
+        limit = year - _SEARCH_YEARS
+        while True:
+            found = self.previous_year(year)
+            if found is None or found < limit:
+                return None
+            if found != year:
+                year, month, day, hour, minute, second = found, 12, 31, 23, 59, 59
+
+            i = bisect_right(self.months, month) - 1
+            if i < 0:
+                year, month, day, hour, minute, second = year - 1, 12, 31, 23, 59, 59
+                continue
+            if self.months[i] != month:
+                month, day, hour, minute, second = self.months[i], 31, 23, 59, 59
+
+            found = self.previous_day(year, month, day)
+            if found is None:
+                if month == 1:
+                    year, month = year - 1, 13
+                month, day, hour, minute, second = month - 1, 31, 23, 59, 59
+                continue
+            if found != day:
+                day, hour, minute, second = found, 23, 59, 59
+
+            i = bisect_right(self.hours, hour) - 1
+            if i < 0:
+                day, hour, minute, second = day - 1, 23, 59, 59
+                continue
+            if self.hours[i] != hour:
+                hour, minute, second = self.hours[i], 59, 59
+
+            i = bisect_right(self.minutes, minute) - 1
+            if i < 0:
+                hour, minute, second = hour - 1, 59, 59
+                continue
+            if self.minutes[i] != minute:
+                minute, second = self.minutes[i], 59
+
+            i = bisect_right(self.seconds, second) - 1
+            if i < 0:
+                minute, second = minute - 1, 59
+                continue
+
+            return datetime.datetime(year, month, day, hour, minute, self.seconds[i], tzinfo=datetime.timezone.utc)
+
+    def iter_after(self, start: datetime.datetime, end: datetime.datetime = None) -> Iterator[datetime.datetime]:
+        """
+        The times after start that the schedule fires, in order, up to and including end if it is given.
+
+        Times are worked out one at a time as they are taken. Within a minute the next time is the next matching
+        second, a full search only happens when the minute runs out.
+        """
+        if end is not None and end.tzinfo is None:
+            end = end.replace(tzinfo=datetime.timezone.utc)
+
+        seconds = self.seconds
+        fire = self.next_after(start)
+        while end is None or fire <= end:
+            yield fire
+            i = bisect_right(seconds, fire.second)
+            fire = fire.replace(second=seconds[i]) if i < len(seconds) else self.next_after(fire)
+
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def parse_expression(expression: str) -> CronExpression:
+    return CronExpression(expression)
 
-        if inc_month:
-            now = now + relativedelta(months=1)
-        [next_months, inc_year] = self.parse_months(month, now)
-        if inc_year:
-            now = now + relativedelta(years=1)
 
-        [next_year, _] = self.parse_years(year, now)
-        res = datetime.datetime(next_year, next_months, next_days, next_hours, next_minutes, next_seconds, tzinfo=datetime.timezone.utc)
+class Cron():
 
-        return res
+    def get_next_execution(self, schedule: str, now: datetime.datetime = None) -> datetime.datetime:
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        return parse_expression(schedule).next_after(now)
 
-    def parse_seconds(self, seconds: str, now: datetime.datetime) -> tuple[int, bool]:
-        if seconds == '*':
-            seconds = '0/1'
+    def next_executions(self, schedules: Iterable[str], now: datetime.datetime = None) -> list[float]:
+        """
+        The next execution of many schedules as timestamps, in the order given, ready to go into one ZADD.
 
-        if '/' not in seconds:
-            start = int(seconds)
-            frequency = 60
-        else:
-            [start, frequency] = self.__get_start_frequency(seconds)
+        Every schedule is evaluated against the same now, and each distinct expression is only worked out once,
+        so thousands of jobs sharing a handful of schedules cost a handful of searches.
+        """
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        found = {}
+        timestamps = []
+        for schedule in schedules:
+            timestamp = found.get(schedule)
+            if timestamp is None:
+                timestamp = found[schedule] = parse_expression(schedule).next_after(now).timestamp()
+            timestamps.append(timestamp)
+        return timestamps
+
+    def previous_execution(self, schedule: str, now: datetime.datetime = None) -> Union[datetime.datetime, None]:
+        """The last time before now that the schedule fired, None if it hasn't yet. Compared with the time a job last ran it shows a missed run."""
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        return parse_expression(schedule).previous_before(now)
 
-        upcoming = [i for i in range(start, 60, frequency) if i > now.second]
-        try:
-            return [upcoming[0], False]
-        except Exception:
-            return [start, True]
+    def is_execution(self, schedule: str, timestamp: float) -> bool:
+        """Whether the schedule fires at timestamp, telling an entry on schedule from one left by an older schedule."""
+        at = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        return parse_expression(schedule).next_after(at - datetime.timedelta(seconds=1)) == at
 
-    def parse_minutes(self, minutes: str, now: datetime.datetime) -> tuple[int, bool]:
-        if minutes == '*':
-            minutes = '0/1'
+    def iter_executions(self, schedule: str, start: datetime.datetime = None, end: datetime.datetime = None) -> Iterator[datetime.datetime]:
+        """
+        Lazily iterate the times a schedule fires after start, now by default, up to and including end.
 
-        if '/' not in minutes:
-            start = int(minutes)
-            frequency = 60
-        else:
-            [start, frequency] = self.__get_start_frequency(minutes)
+        Without an end the iterator doesn't stop, take what is needed with itertools.islice or a break.
+        """
+        if start is None:
+            start = datetime.datetime.now(datetime.timezone.utc)
+        return parse_expression(schedule).iter_after(start, end)
 
-        upcoming = [i for i in range(start, 60, frequency) if i >= now.minute]
-        try:
-            return [upcoming[0], False]
-        except Exception:
-            return [start, True]
+    # The next value of a single field, and whether the field wrapped around so the one above it has to move on
 
-    def parse_hours(self, hours: str, now: datetime.datetime) -> tuple[int, bool]:
-        if hours == '*':
-            hours = '0/1'
+    def parse_seconds(self, seconds: str, now: datetime.datetime) -> tuple[int, bool]:
+        values = _values(seconds, 0, 60)
+        i = bisect_right(values, now.second)
+        return [values[i], False] if i < len(values) else [values[0], True]
 
-        if '/' not in hours:
-            start = int(hours)
-            frequency = 24
-        else:
-            [start, frequency] = self.__get_start_frequency(hours)
+    def parse_minutes(self, minutes: str, now: datetime.datetime) -> tuple[int, bool]:
+        values = _values(minutes, 0, 60)
+        i = bisect_left(values, now.minute)
+        return [values[i], False] if i < len(values) else [values[0], True]
 
-        upcoming = [i for i in range(start, 24, frequency) if i >= now.hour]
-        try:
-            return [upcoming[0], False]
-        except Exception:
-            return [start, True]
+    def parse_hours(self, hours: str, now: datetime.datetime) -> tuple[int, bool]:
+        values = _values(hours, 0, 24)
+        i = bisect_left(values, now.hour)
+        return [values[i], False] if i < len(values) else [values[0], True]
 
     def parse_day_of_month(self, days: str, now: datetime.datetime) -> tuple[int, bool]:
-        end_of_month = calendar.monthrange(now.year, now.month)[1]
-        if days == '*':
-            days = '1/1'
-        if '/' not in days:
-            start = int(days)
-            frequency = end_of_month
-        else:
-            [start, frequency] = self.__get_start_frequency(days, '1')
-
-        upcoming = [i for i in range(start, end_of_month + 1, frequency) if i >= now.day]
-        try:
-            return [upcoming[0], False]
-        except Exception:
-            return [start, True]
-
-    def __get_upcoming_weekdays(self, days: str, week_structure: list[int], now: datetime.datetime, frequency: int = None) -> list[int]:
-        end_of_month = calendar.monthrange(now.year, now.month)[1] + 1
-        month_days = list(range(1, end_of_month))
-        weeks = [month_days[i * 7:(i+1) * 7] for i in range((len(month_days) + 7 - 1) // 7)]
-        dow_idx = week_structure.index(int(days))
-
-        upcoming = []
-
-        if frequency:
-            start = weeks[0][dow_idx]
-            upcoming = [i for i in range(start, end_of_month, frequency) if i >= now.day]
-        else:
-            for w in weeks:
-                try:
-                    d = w[dow_idx]
-                    if d >= now.day:
-                        upcoming.append(d)
-                except Exception:
-                    pass
-        return upcoming
+        expression = CronExpression(f'* * * ? * {days} *')
+        day = expression.next_day(now.year, now.month, now.day)
+        return [day, False] if day is not None else [expression.day_start, True]
 
     def parse_day_of_week(self, days: str, now: datetime.datetime) -> tuple[int, bool]:
-        week_structure = self.__get_week_structure(now.year, now.month)
-        if days == '*':
-            days = f'{week_structure[0]}/1'
-
-        if '/' not in days:
-            start = int(days)
-
-            upcoming = self.__get_upcoming_weekdays(start, week_structure, now)
-            try:
-                return [upcoming[0], False]
-            except Exception:
-                # Need to shift forward to the next month
-                next_month = now + datetime.timedelta(days=calendar.monthrange(now.year, now.month)[1] - now.day + 1)
-                week_structure = self.__get_week_structure(next_month.year, next_month.month)
-                upcoming = self.__get_upcoming_weekdays(start, week_structure, next_month)
-
-                return [upcoming[0], True]
-
-        else:
-            [start, frequency] = self.__get_start_frequency(days, '1')
-            upcoming = self.__get_upcoming_weekdays(start, week_structure, now, frequency)
-            try:
-                return [upcoming[0], False]
-            except Exception:
-                # Need to shift forward to the next month
-                now = now + datetime.timedelta(days=calendar.monthrange(now.year, now.month)[1] - now.day + 1)
-                week_structure = self.__get_week_structure(now.year, now.month)
-                upcoming = self.__get_upcoming_weekdays(start, week_structure, now, frequency)
-
-                return [upcoming[0], True]
+        expression = CronExpression(f'* * * {days} * ? *')
+        day = expression.next_day(now.year, now.month, now.day)
+        if day is not None:
+            return [day, False]
+        # Need to shift forward to the next month
+        year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+        return [expression.next_day(year, month, 1), True]
 
     def parse_months(self, months: str, now: datetime.datetime) -> tuple[int, bool]:
-        if months == '*':
-            months = '1/1'
-
-        if '/' not in months:
-            start = int(months)
-            frequency = 12
-        else:
-            [start, frequency] = self.__get_start_frequency(months, '1')
-
-        upcoming = [i for i in range(start, 13, frequency) if i >= now.month]
-        try:
-            return [upcoming[0], False]
-        except Exception:
-            return [start, True]
+        values = _values(months, 1, 13)
+        i = bisect_left(values, now.month)
+        return [values[i], False] if i < len(values) else [values[0], True]
 
     def parse_years(self, years: str, now: datetime.datetime) -> tuple[int, bool]:
-        if years == '*':
-            years = '1970/1'
-
-        if '/' not in years:
-            start = int(years)
-            frequency = 1
-        else:
-            [start, frequency] = self.__get_start_frequency(years, '1970')
-
-        upcoming = [i for i in range(start, now.year + frequency, frequency) if i >= now.year]
-        try:
-            return [upcoming[0], False]
-        except Exception:
-            return [start, True]
+        start, frequency = _years(years)
+        return [_next_step(start, frequency, now.year), False]
 
 
 if __name__ == '__main__':
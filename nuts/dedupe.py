@@ -0,0 +1,56 @@
+"""
+Deduplication of enqueued jobs by key.
+
+A job published with a dedupe key holds it from the moment it is enqueued until it finishes, and for
+a window after that if it succeeded. Enqueues with a key that is held are dropped. Checking and taking
+the key happens in the same script as the enqueue, so two producers racing can't both get through.
+
+A held key expires after DEDUPE_HOLD seconds, counted from when the job was enqueued or last claimed, so a
+job that is lost can't hold its key back forever.
+
+Functions:
+    dedupe_key: The Redis key held for a dedupe key
+    dedupe_window: The dedupe key and the seconds to keep it after a job finishes, read from its payload
+    running_dedupe: The dedupe key of a job in the running hash
+"""
+import json
+from typing import Union
+from .codecs import decode_payload
+from .priority import payload_options
+
+DEDUPE_PREFIX = 'nuts|dedupe|'
+
+# Seconds a dedupe key is held for while its job waits or runs
+DEDUPE_HOLD = 24 * 60 * 60
+
+
+def dedupe_key(key: str) -> str:
+    return f'{DEDUPE_PREFIX}{key}'
+
+
+def dedupe_window(payload: list, success: bool) -> tuple[str, Union[int, str]]:
+    """
+    Returns:
+        The Redis key and the seconds it should be kept for, 0 to release it, or an empty string if the job has no dedupe key.
+        Failed jobs release their key so the producer can retry them.
+    """
+    options = payload_options(payload)
+    if 'dedupe' not in options:
+        return dedupe_key(''), ''
+
+    return dedupe_key(options['dedupe']), options.get('dedupe_ttl', 0) if success else 0
+
+
+def running_dedupe(entry: Union[str, bytes]) -> Union[str, None]:
+    """
+    Returns:
+        The Redis key held by the job of a running hash entry, None if it has no dedupe key or can't be read.
+    """
+    try:
+        entry = json.loads(entry)
+        options = entry['options'] if 'options' in entry else payload_options(decode_payload(entry['payload'], params=False))
+    except (ValueError, KeyError, TypeError):
+        return None
+    if 'dedupe' not in options:
+        return None
+    return dedupe_key(options['dedupe'])
@@ -1,4 +1,6 @@
 from typing import Union, Any
+from .misfire import COALESCE, MISFIRE_GRACE
+import copy
 
 
 class NutsJob():
@@ -11,6 +13,20 @@ class NutsJob():
     result: Any
     error: Exception
     next: Union[str, None]
+    # Set to 'process' to run the job on the worker's process pool instead of in the worker process
+    executor: Union[str, None] = None
+    # Most executions of the job allowed at once across all workers
+    max_concurrency: Union[int, None] = None
+    # Most executions allowed per window across all workers, e.g. '100/minute'
+    rate_limit: Union[str, None] = None
+    # Seconds to cache successful results for, by arguments, so repeat runs are skipped. Only for jobs whose result depends on nothing else.
+    cache_ttl: Union[int, None] = None
+    # Most results of the job kept in the shared cache, the least recently used are evicted first
+    cache_size: int = 1000
+    # What happens to runs of a cron job missed while no worker was leading: 'coalesce', 'all', 'skip' or 'grace', see nuts.misfire
+    misfire: str = COALESCE
+    # Seconds a run may be late and still run under the 'grace' policy
+    misfire_grace: float = MISFIRE_GRACE
 
     def __init__(self, **kwargs):
         '''
@@ -22,3 +38,13 @@ class NutsJob():
         self.result = kwargs.get('result', None)
         self.error = kwargs.get('error', None)
         self.next = kwargs.get('next', None)
+
+    def copy(self) -> 'NutsJob':
+        '''
+            Return a shallow copy of the job with a clean success, result and error, ready for a single run.
+        '''
+        job = copy.copy(self)
+        job.success = False
+        job.result = None
+        job.error = None
+        return job
@@ -0,0 +1,185 @@
+"""
+Leader election for NUTS workers.
+
+One worker at a time holds a short lease on the leader key and renews it from the background. Each new
+leader gets a fencing token that only ever goes up. The leader's scheduler writes are batched into a
+SchedulerWrites and applied by a script that checks the token first, so a worker that lost the lease
+without noticing can't schedule anything twice.
+
+Classes:
+    SchedulerWrites: A batch of scheduler writes to apply in one fenced round trip
+    LeaderLease: The lease, for Worker
+    AsyncLeaderLease: The lease on redis.asyncio, for AsyncWorker
+"""
+import json
+from typing import Union
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from . import scripts
+
+LEADER_KEY = 'leader_id'
+FENCING_TOKEN_KEY = 'nuts|leader|token'
+
+# Seconds a leader holds the lease without renewing it. It is renewed three times per lease, so a
+# follower takes over within about one lease of the leader dying.
+LEASE_TTL = 10
+
+# Members per ZADD in a batch of scheduler writes, well within how many arguments Lua can unpack
+ZADD_CHUNK = 1000
+
+
+class SchedulerWrites():
+    '''
+        Redis commands collected by the leader and applied together with LeaderLease.commit.
+
+        Every command writes to a single key, given as the first argument after the command name. Commands
+        after a guard are only applied if the guarded member still has the score it was read with.
+    '''
+    keys: list[str]
+    commands: list[list]
+
+    def __init__(self):
+        self.keys = []
+        self.commands = []
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def add(self, command: str, key: str, *args):
+        if key not in self.keys:
+            self.keys.append(key)
+        # Arguments go over as strings so cjson can't round off scores
+        self.commands.append([command, self.keys.index(key) + 1, *[a if isinstance(a, str) else repr(a) for a in args]])
+
+    def guard(self, key: str, member: str, score: float):
+        self.add('GUARD', key, member, score)
+
+    def zadd(self, key: str, mapping: dict[str, float], nx: bool = False):
+        # Members go out in chunks, each command's arguments are unpacked onto the Lua stack
+        items = list(mapping.items())
+        flags = ['NX'] if nx else []
+        for i in range(0, len(items), ZADD_CHUNK):
+            self.add('ZADD', key, *flags, *[arg for member, score in items[i:i + ZADD_CHUNK] for arg in (score, member)])
+
+    def zrem(self, key: str, *members: str):
+        self.add('ZREM', key, *members)
+
+    def zremrangebyscore(self, key: str, min: float, max: float):
+        self.add('ZREMRANGEBYSCORE', key, min, max)
+
+    def sadd(self, key: str, *members: str):
+        self.add('SADD', key, *members)
+
+    def rpush(self, key: str, *values: str):
+        self.add('RPUSH', key, *values)
+
+    def hset(self, key: str, field: str, value: str):
+        self.add('HSET', key, field, value)
+
+    def hdel(self, key: str, *fields: str):
+        self.add('HDEL', key, *fields)
+
+
+class _Lease():
+    id: str
+    ttl: float
+    token: int
+
+    def __init__(self, redis: Union[Redis, AsyncRedis], worker_id: str, ttl: float = LEASE_TTL):
+        self.id = worker_id
+        self.ttl = ttl
+        self.token = 0
+
+        self.acquire_script = redis.register_script(scripts.ACQUIRE_LEASE)
+        self.release_script = redis.register_script(scripts.RELEASE_LEASE)
+        self.fenced_script = redis.register_script(scripts.FENCED_WRITE)
+        self.promote_script = redis.register_script(scripts.PROMOTE_SCHEDULED)
+
+    @property
+    def held(self) -> bool:
+        return self.token > 0
+
+    @property
+    def renew_interval(self) -> float:
+        return self.ttl / 3
+
+    def acquire_args(self) -> dict:
+        return {'keys': [LEADER_KEY, FENCING_TOKEN_KEY], 'args': [self.id, int(self.ttl * 1000)]}
+
+    def commit_args(self, writes: SchedulerWrites, *args) -> dict:
+        return {
+            'keys': [LEADER_KEY, FENCING_TOKEN_KEY, *writes.keys],
+            'args': [self.id, self.token, int(self.ttl * 1000), json.dumps(writes.commands), *args],
+        }
+
+    def promoted(self, result: list) -> tuple[int, list[bytes]]:
+        self.token = int(result[0])
+        return (int(result[1]), result[2]) if self.held else (0, [])
+
+
+class LeaderLease(_Lease):
+    '''
+        The leader lease as seen by one worker.
+    '''
+
+    def acquire(self) -> bool:
+        """
+        Take the lease if it is free, or extend it if this worker already holds it, in one round trip.
+
+        Returns:
+            True if this worker is the leader
+        """
+        self.token = int(self.acquire_script(**self.acquire_args()))
+        return self.held
+
+    def release(self):
+        self.release_script(keys=[LEADER_KEY], args=[self.id])
+        self.token = 0
+
+    def commit(self, writes: SchedulerWrites) -> bool:
+        """
+        Apply a batch of scheduler writes if this worker is still the leader.
+
+        Returns:
+            False if the writes were rejected because another worker has taken over
+        """
+        if not writes:
+            return self.held
+
+        self.token = int(self.fenced_script(**self.commit_args(writes)))
+        return self.held
+
+    def promote(self, writes: SchedulerWrites, now: float) -> tuple[int, list[bytes]]:
+        """
+        Apply the writes that move a batch of due entries out of a scheduled zset, see SchedulerWrites.guard.
+        The zset is the first key written to.
+
+        Returns:
+            How many entries of the zset are still due, and the entries that were moved. Nothing was moved
+            if the writes were rejected, check held.
+        """
+        return self.promoted(self.promote_script(**self.commit_args(writes, now)))
+
+
+class AsyncLeaderLease(_Lease):
+    '''
+        The leader lease on redis.asyncio, see LeaderLease.
+    '''
+
+    async def acquire(self) -> bool:
+        self.token = int(await self.acquire_script(**self.acquire_args()))
+        return self.held
+
+    async def release(self):
+        await self.release_script(keys=[LEADER_KEY], args=[self.id])
+        self.token = 0
+
+    async def commit(self, writes: SchedulerWrites) -> bool:
+        if not writes:
+            return self.held
+
+        self.token = int(await self.fenced_script(**self.commit_args(writes)))
+        return self.held
+
+    async def promote(self, writes: SchedulerWrites, now: float) -> tuple[int, list[bytes]]:
+        return self.promoted(await self.promote_script(**self.commit_args(writes, now)))
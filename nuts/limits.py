@@ -0,0 +1,82 @@
+"""
+Cluster wide concurrency caps and rate limits for jobs.
+
+Limits are declared on the job class and enforced by the claim scripts, so every worker sees the same
+counters. A job that is over budget when a worker gets to it is deferred instead of run.
+
+Functions:
+    parse_rate: Turn a rate such as '100/minute' into a count and a window in milliseconds
+    job_limits: The limits of a list of jobs, encoded for the claim scripts
+    limit_keys: The keys the claim scripts count those limits in
+    concurrency_key: The sorted set of running executions counted against a job's max_concurrency
+    rate_key: The count of a job's runs in the current rate window
+"""
+import json
+import re
+from typing import Union
+from .job import NutsJob
+
+# Jobs over budget wait here, scored by when to try them again, until the leader puts them back in their lane
+DEFERRED_QUEUE = 'nuts|jobs|deferred'
+
+# Seconds a job held back by its max_concurrency waits before it is tried again
+CONCURRENCY_RETRY = 1
+
+# Seconds a concurrency slot is kept without being refreshed. Workers refresh the slots of their running jobs
+# whenever they renew the lease, a slot left by a worker that died is freed after this long.
+SLOT_TTL = 60
+
+_PERIODS = {'second': 1000, 'minute': 60 * 1000, 'hour': 60 * 60 * 1000, 'day': 24 * 60 * 60 * 1000}
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    """
+    Args:
+        rate: Jobs per window, e.g. '100/minute', '5/second' or '1000/hour'
+
+    Returns:
+        The number of runs allowed and the window length in milliseconds
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(second|minute|hour|day)s?\s*', rate or '')
+    if not match or int(match.group(1)) < 1:
+        raise ValueError(f'Invalid rate {rate}, expected <count>/<second|minute|hour|day>')
+
+    return int(match.group(1)), _PERIODS[match.group(2)]
+
+
+def _limited(jobs: list[NutsJob]) -> list[tuple[NutsJob, int, int]]:
+    limited = []
+    for job in jobs:
+        count, period = parse_rate(job.rate_limit) if job.rate_limit else (0, 0)
+        if job.max_concurrency or count:
+            limited.append((job, count, period))
+    return limited
+
+
+def job_limits(jobs: list[NutsJob]) -> str:
+    """
+    Encode the limits of the jobs that have any as [[name, max_concurrency, runs per window, window ms, slot TTL ms], ...],
+    0 meaning no limit. They are in the same order as limit_keys.
+    """
+    return json.dumps([[job.name, job.max_concurrency or 0, count, period, SLOT_TTL * 1000] for job, count, period in _limited(jobs)])
+
+
+def limit_keys(jobs: list[NutsJob]) -> list[str]:
+    """The concurrency and rate key of each job with limits, in the order of job_limits."""
+    return [key for job, _, _ in _limited(jobs) for key in (concurrency_key(job.name), rate_key(job.name))]
+
+
+def concurrency_key(job_name: str) -> str:
+    return f'nuts|limits|{job_name}|running'
+
+
+def rate_key(job_name: str) -> str:
+    return f'nuts|limits|{job_name}|rate'
+
+
+def running_job_name(running_field: Union[str, bytes]) -> str:
+    """The job name from a running field, {worker id}|{job name}|{execution id}."""
+    if isinstance(running_field, bytes):
+        running_field = running_field.decode()
+
+    return running_field.split('|', 1)[-1].rsplit('|', 1)[0]
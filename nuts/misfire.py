@@ -0,0 +1,65 @@
+"""
+What happens to scheduled runs that were missed.
+
+A cron job or workflow has one entry in its scheduled queue, scored with its next run. If the leader is
+down past that time, the entry is late when the next leader sees it, and its policy decides what runs:
+
+    coalesce: Run once, however many runs were missed. The default.
+    all:      Run every missed occurrence, a bounded batch per tick so recovery doesn't flood the queue.
+    skip:     Drop runs that are late and wait for the next one on schedule.
+    grace:    Run once if it is no later than misfire_grace seconds, otherwise skip it.
+
+Workflows run one instance at a time, so `all` coalesces for them.
+
+Functions:
+    due_runs: The runs of a due entry and when it is next due
+"""
+from itertools import islice
+from typing import Union
+import datetime
+from .cron import parse_expression
+
+COALESCE = 'coalesce'
+ALL = 'all'
+SKIP = 'skip'
+GRACE = 'grace'
+POLICIES = (COALESCE, ALL, SKIP, GRACE)
+
+# Seconds a run can be late and still be on time, the leader checks the scheduled queue about once a second
+ON_TIME = 5
+# Default seconds a run under the grace policy may be late
+MISFIRE_GRACE = 300
+# Most missed runs the leader enqueues per tick
+MISFIRE_BATCH = 100
+
+
+def due_runs(
+    schedule: str,
+    policy: str,
+    scheduled_at: float,
+    now: datetime.datetime,
+    grace: float = MISFIRE_GRACE,
+    limit: int = MISFIRE_BATCH,
+) -> tuple[list[float], Union[float, None]]:
+    """
+    Args:
+        scheduled_at: Score of the entry that is due
+        limit: Most runs to return, the rest of the missed ones are left for later
+
+    Returns:
+        The times of the runs to enqueue now, and the score to put the entry back at. No score when the entry
+        comes back once its run completes.
+    """
+    late = now.timestamp() - scheduled_at
+    if policy == ALL and late > ON_TIME:
+        runs = [scheduled_at]
+        start = datetime.datetime.fromtimestamp(scheduled_at, datetime.timezone.utc)
+        runs += [t.timestamp() for t in islice(parse_expression(schedule).iter_after(start, now), max(0, limit - 1))]
+        # Whatever didn't fit stays due, and is picked up on the next tick
+        following = parse_expression(schedule).next_after(datetime.datetime.fromtimestamp(runs[-1], datetime.timezone.utc))
+        return runs, following.timestamp() if following <= now else None
+
+    if (policy == SKIP and late > ON_TIME) or (policy == GRACE and late > grace):
+        return [], parse_expression(schedule).next_after(now).timestamp()
+
+    return [scheduled_at], None
@@ -0,0 +1,67 @@
+"""
+Priority lanes for pending jobs.
+
+Every pending queue, the set and the FIFO list, is split into one lane per priority. The default lane keeps
+the original key and payload format, so producers and workers that don't use priorities are unaffected.
+
+Functions:
+    lane_key: The key of a pending queue's lane for a priority
+    job_payload: Encode a pending job with its priority and options
+    payload_options: Read the options back out of a pending job
+    payload_priority: Read the priority back out of a pending job
+"""
+from typing import Union
+from .codecs import PLAIN, PayloadCodec
+
+HIGH = 'high'
+DEFAULT = 'default'
+LOW = 'low'
+
+# Most urgent first, this is the order workers take jobs in when dequeuing strictly
+PRIORITIES = (HIGH, DEFAULT, LOW)
+
+
+def _check_priority(priority: str):
+    if priority not in PRIORITIES:
+        raise ValueError(f'Unknown priority {priority}, expected one of {", ".join(PRIORITIES)}')
+
+
+def lane_key(queue: str, priority: str = DEFAULT) -> str:
+    _check_priority(priority)
+
+    if priority == DEFAULT:
+        return queue
+    return f'{queue}|{priority}'
+
+
+def job_payload(
+    job_name: str,
+    job_params: Union[object, list] = [],
+    priority: str = DEFAULT,
+    codec: PayloadCodec = None,
+    **options
+) -> Union[str, bytes]:
+    """
+    The priority and any other options are only recorded when set, so a plain default payload is still [name, params].
+
+    Keys are sorted, so the same parameters always encode to the same payload however they were built.
+
+    Args:
+        codec: Encoding of the payload, plain JSON by default
+    """
+    options = {k: v for k, v in options.items() if v is not None}
+    if priority != DEFAULT:
+        _check_priority(priority)
+        options['priority'] = priority
+
+    return (codec or PLAIN).encode(job_name, job_params, options)
+
+
+def payload_options(payload: list) -> dict:
+    if len(payload) > 2 and isinstance(payload[2], dict):
+        return payload[2]
+    return {}
+
+
+def payload_priority(payload: list) -> str:
+    return payload_options(payload).get('priority', DEFAULT)
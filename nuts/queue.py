@@ -1,18 +1,78 @@
-from typing import Union
-import json
+from typing import Any, Iterable, NamedTuple, Union
+from uuid import uuid4
 from redis import Redis
+from redis.client import Pipeline
+from .priority import DEFAULT, job_payload, lane_key
+from .dedupe import DEDUPE_HOLD, dedupe_key as _dedupe_key
+from .results import get_result
+from .codecs import COMPRESS_MIN_BYTES, PayloadCodec
+from .blobs import OFFLOAD_MIN_BYTES, BlobStore, offload_params
+from .shards import pick_shard, shard_key
+from .connection import connect
+from . import scripts
+import datetime
+import itertools
+import math
 import logging
+import time
 
 
-class WorkQueue():
-    redis: Redis
+class _Prepared(NamedTuple):
+    """A job encoded and ready to enqueue."""
+    id: Union[str, None]
+    lane: str
+    payload: Union[str, bytes]
+    dedupe_key: Union[str, None]
+    blob: Union[str, None]
+    run_at: Union[float, None]
+
+
+class BaseWorkQueue():
+    '''
+        State and payload encoding shared by WorkQueue and AsyncWorkQueue.
+
+        Everything here is free of Redis I/O, so the two queues only differ in how they send the commands
+        it prepares.
+    '''
     logger: logging.Logger
 
     pending_queue: str
+    fifo_queue: str
+    fifo: bool
+    codec: PayloadCodec
+    blob_store: Union[BlobStore, None]
 
-    def __init__(self, redis: Redis, **kwargs):
+    def __init__(
+        self,
+        redis,
+        fifo: bool = False,
+        codec: str = 'json',
+        compression: str = None,
+        compress_min_bytes: int = COMPRESS_MIN_BYTES,
+        blob_store: BlobStore = None,
+        offload_min_bytes: int = OFFLOAD_MIN_BYTES,
+        shards: int = 1,
+        **kwargs
+    ):
+        """
+        Args:
+            codec: Encoding of job params, 'json', 'orjson' or 'msgpack'. Workers read every encoding.
+            compression: Compress params of at least compress_min_bytes with 'lz4' or 'zstd'
+            blob_store: Keep params of at least offload_min_bytes here instead of in Redis, workers need the same store
+            shards: Number of keys the pending queue is split over, see nuts.shards
+        """
         self.redis = redis
+        self.codec = PayloadCodec(codec, compression, compress_min_bytes)
+        self.blob_store = blob_store
+        self.offload_min_bytes = offload_min_bytes
         self.pending_queue = 'nuts|jobs|pending'
+        self.fifo_queue = 'nuts|jobs|queue'
+        # Jobs published to run later wait here, scored by when to run them, until the leader moves them to their lane
+        self.delayed_queue = 'nuts|jobs|delayed'
+        self.fifo = fifo
+        self.shards = max(1, shards)
+        self.shard_turns = itertools.count()
+        self.enqueue_script = self.redis.register_script(scripts.ENQUEUE_JOB)
 
         self.logger = logging.getLogger(kwargs.get('logger', 'nuts|workqueue'))
         logging.basicConfig(
@@ -21,11 +81,199 @@ class WorkQueue():
             datefmt="%Y-%m-%d %H:%M:%S",
         )
 
-    def publish(self, job_name: str, job_parameters: Union[object, list]):
+    def prepare(
+        self,
+        job_name: str,
+        job_parameters: Union[object, list] = [],
+        priority: str = DEFAULT,
+        dedupe_key: str = None,
+        dedupe_ttl: int = 0,
+        keep_result: bool = False,
+        run_at: Union[datetime.datetime, float] = None,
+    ) -> '_Prepared':
+        """Encode a job to publish, offloading its params if they are large."""
+        job_id = str(uuid4()) if keep_result else None
+        dedupe = {'dedupe': dedupe_key, 'dedupe_ttl': dedupe_ttl} if dedupe_key is not None else {}
+        shard = pick_shard(self.shards, self.shard_turns, dedupe_key)
+        lane = lane_key(shard_key(self.fifo_queue if self.fifo else self.pending_queue, shard, self.shards), priority)
+
+        delay_id = None
+        if run_at is not None:
+            # Each delayed job is its own member of the delayed zset, however many identical ones there are
+            delay_id = uuid4().hex
+            lane = self.delayed_queue
+            run_at = self.timestamp(run_at)
+
+        params, blob = job_parameters, None
+        if self.blob_store:
+            params, blob = offload_params(self.blob_store, self.codec, job_parameters, self.offload_min_bytes)
         try:
-            payload = json.dumps([job_name, job_parameters])
-            self.logger.info(f'Added {job_name} {payload}')
-            self.redis.sadd(self.pending_queue, payload)
+            payload = job_payload(job_name, params, priority, self.codec, id=job_id, blob=blob, delay_id=delay_id, **dedupe)
+        except Exception:
+            self.discard_blob(blob)
+            raise
+
+        return _Prepared(job_id, lane, payload, dedupe_key, blob, run_at)
+
+    def timestamp(self, when: Union[datetime.datetime, float]) -> float:
+        """A time to run a job at as a timestamp, naive datetimes are taken to be UTC."""
+        if not isinstance(when, datetime.datetime):
+            return float(when)
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=datetime.timezone.utc)
+        return when.timestamp()
+
+    def enqueue_args(self, job: '_Prepared') -> list:
+        """Arguments for the enqueue script, which takes the job's dedupe key as it enqueues it."""
+        if job.run_at is not None:
+            # The key is held from now until the job has had its time to run
+            return [job.payload, 'delayed', DEDUPE_HOLD + max(0, math.ceil(job.run_at - time.time())), job.run_at]
+        return [job.payload, 'list' if self.fifo else 'set', DEDUPE_HOLD]
+
+    def outcome(self, job: '_Prepared', reply: Any) -> Union[str, bool]:
+        """What publish returns for a job given the reply to its command, a job that wasn't enqueued has its blob deleted."""
+        if isinstance(reply, Exception) or (job.dedupe_key is not None and not reply):
+            self.discard_blob(job.blob)
+            return False
+        return job.id or True
+
+    def discard_blob(self, blob: Union[str, None]):
+        """Delete the offloaded params of a job that wasn't enqueued."""
+        if blob:
+            self.blob_store.delete(blob)
+
+    def seconds(self, delay: Union[datetime.timedelta, float]) -> float:
+        return delay.total_seconds() if isinstance(delay, datetime.timedelta) else float(delay)
+
+    def job_args(self, args: Union[tuple, dict]) -> dict:
+        """publish's arguments for an item of publish_many, a (job_name, job_parameters) pair or a dict."""
+        return args if isinstance(args, dict) else dict(zip(('job_name', 'job_parameters'), args))
+
+    def chunk_outcomes(self, prepared: list[Union['_Prepared', None]], replies: Iterable[Any]) -> list[Union[str, bool]]:
+        """The outcomes of a chunk of jobs given the replies to the ones that were sent, None for jobs that couldn't be prepared."""
+        replies = iter(replies)
+        outcomes = [self.outcome(job, next(replies)) if job else False for job in prepared]
+        self.logger.info(f'Added {sum(1 for o in outcomes if o)} of {len(prepared)} jobs')
+        return outcomes
+
+
+class WorkQueue(BaseWorkQueue):
+    redis: Redis
+
+    @classmethod
+    def from_url(cls, url: str = 'redis://localhost:6379/0', sentinels: list[tuple[str, int]] = None, service_name: str = 'mymaster', **kwargs) -> 'WorkQueue':
+        """
+        A queue whose client retries through connection blips, and follows the master of service_name through sentinels
+        when they are given, see nuts.connection.connect. kwargs are WorkQueue's.
+        """
+        return cls(connect(url, sentinels, service_name), **kwargs)
+
+    def publish(
+        self,
+        job_name: str,
+        job_parameters: Union[object, list],
+        priority: str = DEFAULT,
+        dedupe_key: str = None,
+        dedupe_ttl: int = 0,
+        keep_result: bool = False,
+        run_at: Union[datetime.datetime, float] = None,
+    ) -> Union[str, bool]:
+        """
+        Add a job to the pending lane for its priority, workers take jobs from the high lane first.
 
+        Args:
+            dedupe_key: Drop the job if another one published with this key is still pending or running
+            dedupe_ttl: Seconds to keep dropping duplicates after the job has succeeded
+            keep_result: Store the job's result once it has run, see get_result
+            run_at: Hold the job back until this time, a datetime or a timestamp, see publish_at
+
+        Returns:
+            The job id if keep_result is set, otherwise True. False if the job was a duplicate or couldn't be added.
+        """
+        job = None
+        try:
+            job = self.prepare(job_name, job_parameters, priority, dedupe_key, dedupe_ttl, keep_result, run_at)
+            outcome = self.outcome(job, self.push(self.redis, job))
+            if not outcome:
+                self.logger.info(f'Skipped {job_name}, dedupe key {dedupe_key} is held')
+                return False
+
+            self.logger.info(f'Added {job_name} {job.payload if isinstance(job.payload, str) else job_parameters}')
+            return outcome
+
+        except Exception as ex:
+            self.logger.error(f'Error adding {job_name} {job.payload if job else None}: {ex}')
+            self.discard_blob(job.blob if job else None)
+            return False
+
+    def publish_at(self, when: Union[datetime.datetime, float], job_name: str, job_parameters: Union[object, list] = [], **kwargs) -> Union[str, bool]:
+        """
+        Add a job to run at a given time, with its params. kwargs are publish's.
+
+        The job waits in the delayed queue until the leader moves it to the pending lane for its priority, a
+        bounded batch at a time. Any number of delayed runs of the same job can wait side by side.
+        """
+        return self.publish(job_name, job_parameters, run_at=when, **kwargs)
+
+    def publish_in(self, delay: Union[datetime.timedelta, float], job_name: str, job_parameters: Union[object, list] = [], **kwargs) -> Union[str, bool]:
+        """Add a job to run after delay, a timedelta or seconds, see publish_at."""
+        return self.publish_at(time.time() + self.seconds(delay), job_name, job_parameters, **kwargs)
+
+    def publish_many(self, jobs: Iterable[Union[tuple, dict]], chunk_size: int = 1000) -> list[Union[str, bool]]:
+        """
+        Add many jobs, with one pipelined round trip per chunk of them.
+
+        Args:
+            jobs: (job_name, job_parameters) pairs, or dicts of publish's arguments, run_at included. They are read a chunk at a time,
+                so a generator never has to be held in memory whole.
+            chunk_size: Jobs sent per round trip
+
+        Returns:
+            The outcome of each job in order, as publish would return it
+        """
+        outcomes = []
+        jobs = iter(jobs)
+        while chunk := list(itertools.islice(jobs, chunk_size)):
+            outcomes += self.publish_chunk(chunk)
+        return outcomes
+
+    def publish_chunk(self, chunk: list[Union[tuple, dict]]) -> list[Union[str, bool]]:
+        pipe = self.redis.pipeline(transaction=False)
+        prepared = []
+        for args in chunk:
+            job = None
+            try:
+                job = self.prepare(**self.job_args(args))
+                self.push(pipe, job)
+                prepared.append(job)
+            except Exception as ex:
+                self.logger.error(f'Error adding {self.job_args(args).get("job_name")}: {ex}')
+                self.discard_blob(job.blob if job else None)
+                prepared.append(None)
+
+        try:
+            replies = pipe.execute(raise_on_error=False)
         except Exception as ex:
-            self.logger.error(f'Error adding {job_name} {payload}: {ex}')
+            self.logger.error(f'Error adding {len(chunk)} jobs: {ex}')
+            replies = itertools.repeat(ex)
+
+        return self.chunk_outcomes(prepared, replies)
+
+    def push(self, client: Union[Redis, Pipeline], job: '_Prepared') -> Any:
+        """Send the command that enqueues a prepared job, on the client or queued on a pipeline."""
+        if job.dedupe_key is not None:
+            return self.enqueue_script(keys=[job.lane, _dedupe_key(job.dedupe_key)], args=self.enqueue_args(job), client=client)
+        if job.run_at is not None:
+            return client.zadd(job.lane, {job.payload: job.run_at})
+        if self.fifo:
+            return client.rpush(job.lane, job.payload)
+        return client.sadd(job.lane, job.payload)
+
+    def get_result(self, job_id: str) -> Union[dict[str, Any], None]:
+        """
+        The outcome of a job published with keep_result.
+
+        Returns:
+            The job's id, name, success, result, error and finished_at, None if it hasn't finished or its result has expired
+        """
+        return get_result(self.redis, job_id)
@@ -0,0 +1,83 @@
+"""
+Results of individual job executions.
+
+A job published with `keep_result=True` gets an id, and the worker that runs it stores its outcome under
+that id when it finishes, in the same round trip that finishes the job. Results expire after the worker's
+`result_ttl`. Large ones are compressed, and ones still over `result_max_bytes` are replaced by an error.
+
+Functions:
+    result_key: The Redis key of a job's stored result
+    encode_record: Encode a result record for storage
+    decode_record: Decode a stored result record
+    get_result: Read a job's result
+"""
+from typing import Any, Union
+import datetime
+import json
+import zlib
+from redis import Redis
+
+# Records larger than this are stored zlib compressed
+COMPRESS_MIN_BYTES = 1024
+
+# Seconds results are kept for, and the largest encoded result stored, by default
+RESULT_TTL = 24 * 60 * 60
+RESULT_MAX_BYTES = 1024 * 1024
+
+_PLAIN = b'j'
+_COMPRESSED = b'z'
+
+
+def result_key(job_id: str) -> str:
+    return f'nuts|results|{job_id}'
+
+
+def encode_record(record: dict[str, Any], max_bytes: int = RESULT_MAX_BYTES) -> bytes:
+    """
+    Encode a result record, compressed if it is large.
+
+    A result that can't be encoded as JSON or is too large even compressed is dropped, and the record
+    gets an error saying why instead.
+    """
+    try:
+        encoded = json.dumps(record, separators=(',', ':')).encode()
+    except (TypeError, ValueError):
+        return encode_record({**record, 'result': None, 'error': 'Result is not JSON serializable'}, max_bytes)
+
+    value = _PLAIN + encoded
+    if len(encoded) >= COMPRESS_MIN_BYTES:
+        value = _COMPRESSED + zlib.compress(encoded)
+
+    if len(value) > max_bytes and record.get('result') is not None:
+        error = f'Result of {len(value)} bytes is over the {max_bytes} byte limit'
+        return encode_record({**record, 'result': None, 'error': error}, max_bytes)
+
+    return value
+
+
+def decode_record(value: bytes) -> dict[str, Any]:
+    if value[:1] == _COMPRESSED:
+        return json.loads(zlib.decompress(value[1:]))
+    return json.loads(value[1:])
+
+
+def result_record(job_id: str, job_name: str, success: bool, result: Any, error: Union[str, None]) -> dict[str, Any]:
+    return {
+        'id': job_id,
+        'name': job_name,
+        'success': success,
+        'result': result,
+        'error': error,
+        'finished_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def get_result(redis: Redis, job_id: str) -> Union[dict[str, Any], None]:
+    """
+    Returns:
+        The job's id, name, success, result, error and finished_at, None if it hasn't finished or its result has expired
+    """
+    value = redis.get(result_key(job_id))
+    if value is None:
+        return None
+    return decode_record(value)
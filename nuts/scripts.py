@@ -0,0 +1,421 @@
+"""
+Lua scripts run server side by the workers.
+
+Each script is registered with `Redis.register_script` and called through EVALSHA, so every
+multi-step queue operation costs a single round trip and can't be interleaved with other clients.
+A job costs two of them: CLAIM_JOBS to take it and FINISH_JOB once it has run. Jobs prefetched
+into a worker's buffer are started with START_CLAIMED_JOB when their turn comes instead, with
+CLAIM_JOBS spread over the whole batch.
+"""
+
+# Shared helper for reading payloads, plain JSON [name, params, options] or a codec header followed by the
+# JSON [name, options] and the encoded params (see nuts.codecs).
+_PAYLOAD = """
+local function is_encoded(item)
+    return string.byte(item, 1) == 1
+end
+
+-- The job name and options of a payload, nil if it can't be read
+local function job_meta(item)
+    local meta = item
+    if is_encoded(item) then
+        local stop = string.find(item, '\\n', 4, true)
+        if not stop then
+            return nil
+        end
+        meta = string.sub(item, 4, stop - 1)
+    end
+    local ok, decoded = pcall(cjson.decode, meta)
+    if not ok or type(decoded) ~= 'table' or type(decoded[1]) ~= 'string' then
+        return nil
+    end
+    local options = decoded[3]
+    if is_encoded(item) then
+        options = decoded[2]
+    end
+    if type(options) ~= 'table' then
+        options = {}
+    end
+    return decoded[1], options
+end
+"""
+
+# Shared helpers for the claim scripts.
+# KEYS: processing list, running hash, cancel set, deferred zset, the concurrency and rate key of each job
+# with limits (see nuts.limits), then the priority lanes to take jobs from in order
+# ARGV[1..4]: worker id, start timestamp, track claims in the processing list (1 or 0), JSON job limits
+# as [[name, max concurrency, runs per window, window ms, slot TTL ms], ...]
+_START_JOB = _PAYLOAD + """
+local limits = {}
+local first_lane = 5
+for _, limit in ipairs(cjson.decode(ARGV[4])) do
+    limits[limit[1]] = {limit[2], limit[3], limit[4], limit[5], KEYS[first_lane], KEYS[first_lane + 1]}
+    first_lane = first_lane + 2
+end
+
+local function job_name(item)
+    local name = job_meta(item)
+    if not name then
+        return ''
+    end
+    if string.find(name, 'workflow', 1, true) then
+        name = string.match(name, '|(.*)$') or name
+    end
+    return name
+end
+
+-- The running entry keeps plain JSON payloads whole, encoded ones only by name and options
+local function running_entry(item)
+    if is_encoded(item) then
+        local name, options = job_meta(item)
+        return cjson.encode({timestamp = ARGV[2], name = name or '', options = options or {}})
+    end
+    return cjson.encode({timestamp = ARGV[2], payload = item})
+end
+
+-- Takes a slot and a run from the job's budget, or returns when to try it again if either is used up.
+-- Slots that haven't been refreshed within their TTL belong to workers that died mid-run and are freed first.
+local function over_budget(name, field)
+    local limit = limits[name]
+    if not limit then
+        return false
+    end
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+    local running, runs = limit[5], limit[6]
+    if limit[1] > 0 then
+        redis.call('ZREMRANGEBYSCORE', running, '-inf', now - limit[4])
+        if redis.call('ZCARD', running) >= limit[1] then
+            return now / 1000 + 1
+        end
+    end
+    if limit[2] > 0 then
+        -- The count expires at the end of its window
+        local window_end = (math.floor(now / limit[3]) + 1) * limit[3]
+        if tonumber(redis.call('GET', runs) or '0') >= limit[2] then
+            return window_end / 1000
+        end
+        if redis.call('INCR', runs) == 1 then
+            redis.call('PEXPIREAT', runs, window_end)
+        end
+    end
+    if limit[1] > 0 then
+        redis.call('ZADD', running, now, field)
+    end
+    return false
+end
+
+-- Marks the job running and returns its running field. A job with a pending cancellation is dropped and
+-- gets an empty string, the worker releases its dedupe key. One that is over budget is deferred and gets 'deferred'.
+local function start_job(item, execution_id)
+    local name = job_name(item)
+    if redis.call('SREM', KEYS[3], name) == 1 then
+        return false, ''
+    end
+    local field = ARGV[1] .. '|' .. name .. '|' .. execution_id
+    local retry = over_budget(name, field)
+    if retry then
+        redis.call('ZADD', KEYS[4], retry, item)
+        return false, 'deferred'
+    end
+    redis.call('HSET', KEYS[2], field, running_entry(item))
+    return field
+end
+"""
+
+# ARGV[5]: 'set' or 'list', ARGV[6..]: one execution id per job to claim
+# Pops up to #ARGV - 5 jobs, each from the first lane that has one. The first one that can run is marked running
+# to be run straight away, cancelled and deferred ones before it are dropped. The rest are only claimed, they are
+# checked and marked running by START_CLAIMED_JOB when the worker gets to them.
+# Returns two lists: job payload, running field pairs for the started, cancelled and deferred jobs (see
+# start_job), and the payloads of the jobs left to start.
+CLAIM_JOBS = _START_JOB + """
+local started = {}
+local claimed = {}
+local running = false
+local lane = first_lane
+for i = 6, #ARGV do
+    local item
+    while not item and lane <= #KEYS do
+        if ARGV[5] == 'list' then
+            item = redis.call('LPOP', KEYS[lane])
+        else
+            item = redis.call('SPOP', KEYS[lane])
+        end
+        if not item then
+            lane = lane + 1
+        end
+    end
+    if not item then
+        break
+    end
+    if running then
+        claimed[#claimed + 1] = item
+    else
+        local field, outcome = start_job(item, ARGV[i])
+        started[#started + 1] = item
+        started[#started + 1] = field or outcome
+        running = field ~= false
+    end
+    if running and ARGV[3] == '1' then
+        redis.call('RPUSH', KEYS[1], item)
+    end
+end
+return {started, claimed}
+"""
+
+# ARGV[5]: execution id, ARGV[6]: job payload, already in the processing list when claims are tracked
+# Returns the running field, or the outcome of start_job if the job was dropped or deferred, in which case its claim is dropped too.
+START_CLAIMED_JOB = _START_JOB + """
+local field, outcome = start_job(ARGV[6], ARGV[5])
+if not field and ARGV[3] == '1' then
+    redis.call('LREM', KEYS[1], 1, ARGV[6])
+end
+return field or outcome
+"""
+
+# KEYS: running hash, completed hash, pending lane for the next job, processing list, the job's concurrency slots,
+# the job's dedupe key, the job's result key
+# ARGV: running field, completed name, completion record, next job payload, claimed payload, 'set' or 'list',
+# seconds to keep the dedupe key for (0 releases it), encoded result, seconds to keep the result for
+# Clears the running entry and the job's concurrency slot, records the completion, enqueues the next job in
+# the chain, drops the claim, starts the dedupe window and stores the result. Empty arguments skip their step.
+FINISH_JOB = """
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[5], ARGV[1])
+if ARGV[2] ~= '' then
+    redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+end
+if ARGV[4] ~= '' then
+    if ARGV[6] == 'list' then
+        redis.call('RPUSH', KEYS[3], ARGV[4])
+    else
+        redis.call('SADD', KEYS[3], ARGV[4])
+    end
+end
+if ARGV[5] ~= '' then
+    redis.call('LREM', KEYS[4], 1, ARGV[5])
+end
+if ARGV[7] ~= '' then
+    if tonumber(ARGV[7]) > 0 then
+        redis.call('EXPIRE', KEYS[6], ARGV[7])
+    else
+        redis.call('DEL', KEYS[6])
+    end
+end
+if ARGV[8] ~= '' then
+    redis.call('SET', KEYS[7], ARGV[8], 'EX', ARGV[9])
+end
+return 1
+"""
+
+# KEYS: pending lane or the delayed zset, dedupe key
+# ARGV: job payload, 'set', 'list' or 'delayed', seconds to hold the dedupe key for, and for delayed jobs the time to run them at
+# Enqueues a job unless its dedupe key is held, and takes the key. Returns 1 if the job was enqueued.
+ENQUEUE_JOB = """
+if not redis.call('SET', KEYS[2], ARGV[1], 'NX', 'EX', ARGV[3]) then
+    return 0
+end
+if ARGV[2] == 'list' then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+elseif ARGV[2] == 'delayed' then
+    redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+else
+    redis.call('SADD', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+# KEYS: hash
+# Reads and deletes a whole hash in one step, returning its flattened field/value pairs.
+DRAIN_HASH = """
+local items = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return items
+"""
+
+# Shared helper for the requeue scripts.
+# KEYS[2..]: the lanes of a pending queue, ARGV[1..#KEYS - 1]: their priorities in the same order, default first
+_JOB_LANE = _PAYLOAD + """
+local function job_lane(item)
+    local _, options = job_meta(item)
+    if options then
+        for i = 1, #KEYS - 1 do
+            if ARGV[i] == options['priority'] then
+                return KEYS[i + 1]
+            end
+        end
+    end
+    return KEYS[2]
+end
+"""
+
+# KEYS: claimed list, then the pending set lanes
+# Returns every job in a claimed list to the pending set lane of its priority.
+REQUEUE_TO_SET = _JOB_LANE + """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+for i = 1, #items do
+    redis.call('SADD', job_lane(items[i]), items[i])
+end
+redis.call('DEL', KEYS[1])
+return #items
+"""
+
+# KEYS: processing list, then the FIFO queue lanes
+# Returns every job in a processing list to the head of the lane of its priority, keeping their order.
+REQUEUE_TO_LIST = _JOB_LANE + """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+for i = #items, 1, -1 do
+    redis.call('LPUSH', job_lane(items[i]), items[i])
+end
+redis.call('DEL', KEYS[1])
+return #items
+"""
+
+# KEYS: deferred or delayed zset, then the pending queue lanes
+# ARGV[1..#KEYS - 1]: the lanes' priorities, then 'set' or 'list', the current time and the most jobs to move
+# Puts deferred and delayed jobs that are due in the lane of their priority. Returns the number of jobs moved.
+PROMOTE_DEFERRED = _JOB_LANE + """
+local mode = ARGV[#KEYS]
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[#KEYS + 1], 'LIMIT', 0, ARGV[#KEYS + 2])
+for i = 1, #items do
+    if mode == 'list' then
+        redis.call('RPUSH', job_lane(items[i]), items[i])
+    else
+        redis.call('SADD', job_lane(items[i]), items[i])
+    end
+end
+if #items > 0 then
+    redis.call('ZREM', KEYS[1], unpack(items))
+end
+return #items
+"""
+
+# KEYS: cached result, the job's cache index
+# ARGV: the current time
+# Returns a cached result and marks it as just used, or false on a miss.
+CACHE_GET = """
+local value = redis.call('GET', KEYS[1])
+if value then
+    redis.call('ZADD', KEYS[2], 'XX', ARGV[1], KEYS[1])
+end
+return value
+"""
+
+# KEYS: cached result, the job's cache index
+# ARGV: encoded result, TTL in seconds, the current time, most entries the job may keep
+# Caches a result, drops index entries that have expired and evicts the least recently used past the limit.
+CACHE_RESULT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', tonumber(ARGV[3]) - tonumber(ARGV[2]))
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if excess > 0 then
+    local evicted = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+    redis.call('ZREM', KEYS[2], unpack(evicted))
+    redis.call('DEL', unpack(evicted))
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+# KEYS: leader key, fencing token key
+# ARGV: worker id, lease length in milliseconds
+# Renews the lease if this worker holds it, or takes it if it is free. Every new leader gets the next
+# fencing token, as does a holder whose token key was wiped. Returns the worker's fencing token, or 0 if
+# another worker holds the lease.
+ACQUIRE_LEASE = """
+local holder = redis.call('GET', KEYS[1])
+if holder and holder ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+local token = redis.call('GET', KEYS[2])
+if holder and token then
+    return tonumber(token)
+end
+return redis.call('INCR', KEYS[2])
+"""
+
+# KEYS: leader key
+# ARGV: worker id
+# Gives the lease up, but only if this worker still holds it.
+RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Shared helpers for the fenced scripts.
+# KEYS: leader key, fencing token key, then every key written to
+# ARGV: worker id, fencing token, lease length in milliseconds, JSON list of [command, key index, args...]
+# A lease that lapsed without anyone else taking over is picked back up, a wiped token key starts a new term.
+# A GUARD command [GUARD, zset index, member, score] skips the commands after it, up to the next guard,
+# unless the member still has that score. apply returns the members whose guards passed.
+_FENCE = """
+local function fence()
+    local holder = redis.call('GET', KEYS[1])
+    local current = redis.call('GET', KEYS[2])
+    local token = ARGV[2]
+    if holder ~= ARGV[1] then
+        if holder or (current and current ~= token) then
+            return nil
+        end
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[3])
+        if not current then
+            token = redis.call('INCR', KEYS[2])
+        end
+    elseif current ~= token then
+        return nil
+    end
+    return tonumber(token)
+end
+
+local function apply(commands)
+    local guarded = {}
+    local skip = false
+    for _, command in ipairs(commands) do
+        local key = KEYS[command[2] + 2]
+        if command[1] == 'GUARD' then
+            local score = redis.call('ZSCORE', key, command[3])
+            skip = not score or tonumber(score) ~= tonumber(command[4])
+            if not skip then
+                guarded[#guarded + 1] = command[3]
+            end
+        elseif not skip then
+            local args = {command[1], key}
+            for i = 3, #command do
+                args[#args + 1] = command[i]
+            end
+            redis.call(unpack(args))
+        end
+    end
+    return guarded
+end
+"""
+
+# KEYS and ARGV as for _FENCE
+# Applies a batch of scheduler writes only if they come from the current leader.
+# Returns the fencing token the writes were made under, or 0 if they were rejected.
+FENCED_WRITE = _FENCE + """
+local token = fence()
+if not token then
+    return 0
+end
+apply(cjson.decode(ARGV[4]))
+return token
+"""
+
+# KEYS and ARGV as for _FENCE, the first key written to is a scheduled zset, then ARGV: the current time
+# Moves a batch of due entries out of a scheduled zset, fenced like FENCED_WRITE. Each entry's writes are
+# guarded by the score it was read with, so an entry rescheduled in the meantime is left for the next batch.
+# Returns the fencing token or 0, how many entries of the zset are still due, and the entries that were moved.
+PROMOTE_SCHEDULED = _FENCE + """
+local token = fence()
+if not token then
+    return {0, 0, {}}
+end
+local moved = apply(cjson.decode(ARGV[4]))
+return {token, redis.call('ZCOUNT', KEYS[3], '-inf', ARGV[5]), moved}
+"""
@@ -0,0 +1,41 @@
+"""
+Sharded pending queues.
+
+With `shards=N` the pending set and the FIFO queue are each split over N keys, `{queue}|{s}` for shard s.
+The shard number is a hash tag, so on a Redis Cluster each shard and its priority lanes land on one slot
+and different shards spread over the cluster. Producers deal jobs out to the shards in turn, workers take
+turns between them and fall back to the others when theirs is empty.
+
+With one shard, the default, the queues keep their plain keys. Producers, workers and the API must all
+use the same number of shards.
+
+Functions:
+    shard_key: The key of one shard of a queue
+    shard_keys: The keys of every shard of a queue
+    pick_shard: The shard to enqueue a job on
+"""
+from typing import Iterator, Union
+import zlib
+
+
+def shard_key(queue: str, shard: int, shards: int = 1) -> str:
+    if shards <= 1:
+        return queue
+    return f'{queue}|{{{shard}}}'
+
+
+def shard_keys(queue: str, shards: int = 1) -> list[str]:
+    return [shard_key(queue, shard, shards) for shard in range(max(1, shards))]
+
+
+def pick_shard(shards: int, turns: Iterator[int], key: Union[str, None] = None) -> int:
+    """
+    Args:
+        turns: Counter the shards are dealt out from in turn
+        key: Jobs with the same dedupe key always go to the same shard
+    """
+    if shards <= 1:
+        return 0
+    if key is not None:
+        return zlib.crc32(key.encode()) % shards
+    return next(turns) % shards
@@ -1,389 +1,574 @@
-from uuid import uuid4
-import os
-import json
-from typing import Any, Protocol
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Union
 from redis import Redis
 from .job import NutsJob
-from .workflow import NutsWorkflow
-from .cron import Cron
+from .priority import DEFAULT, PRIORITIES
+from .limits import concurrency_key, running_job_name
+from .results import RESULT_MAX_BYTES, RESULT_TTL
+from .codecs import COMPRESS_MIN_BYTES
+from .blobs import BlobStore
+from .connection import CONNECTION_ERRORS, CircuitBreaker
+from .misfire import MISFIRE_BATCH
+from .leader import LEASE_TTL, LeaderLease, SchedulerWrites
+from .base_worker import DRAIN_TIMEOUT, HEARTBEAT_INTERVAL, IDLE_MAX, IDLE_MIN, BaseWorker, JobModule, _run_in_process
 import datetime
-import logging
-import yaml
+import signal
+import threading
 
 
-class JobModule(Protocol):
-    """Protocol for job modules that contain a Job class."""
-    Job: type[NutsJob]
-
-
-class Worker():
+class Worker(BaseWorker):
     '''
         A NUTS worker
     '''
-    id: str
     redis: Redis
-    scheduler: Cron
-    logger: logging.Logger
-    jobs: list[NutsJob]
-    workflows: list[NutsWorkflow]
-    kwargs: dict[str, Any]
-    scheduled_queue: str
-    pending_queue: str
-    completed_queue: str
-    last_run: datetime.datetime
-    running_queue: str
-    should_run: bool
-
-    def __init__(self, redis: Redis, jobs: list[JobModule], workflow_directory: str = None, **kwargs):
-        self.id = str(uuid4())
-        self.scheduled_queue = 'nuts|jobs|scheduled'
-        self.running_queue = 'nuts|jobs|running'
-        self.pending_queue = 'nuts|jobs|pending'
-        self.completed_queue = 'nuts|jobs|completed'
-        self.cancel_queue = 'nuts|jobs|cancel'
-        self.scheduled_workflow_queue = 'nuts|workflows|scheduled'
-        self.running_workflow_queue = 'nuts|workflows|running'
-        self.completed_workflow_queue = 'nuts|workflows|completed'
-        self.kwargs = kwargs
-        self.should_run = True
-        self.is_leader = False
-
-        self.last_run = datetime.datetime.fromtimestamp(0)
-
-        self.redis = redis
-
-        self.scheduler = Cron()
-
-        self.logger = logging.getLogger(f'worker|{self.id}')
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s - %(levelname)s - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
+    executor: Union[ThreadPoolExecutor, None]
+    in_flight: set[Future]
+    lease: LeaderLease
+
+    lease_class = LeaderLease
+
+    def __init__(
+        self,
+        redis: Redis,
+        jobs: list[JobModule],
+        workflow_directory: str = None,
+        concurrency: int = 1,
+        process_workers: int = None,
+        process_kwargs: dict[str, Any] = None,
+        fifo: bool = False,
+        block_timeout: float = 1,
+        prefetch: int = 1,
+        lease_ttl: float = LEASE_TTL,
+        priorities: list[str] = PRIORITIES,
+        priority_weights: dict[str, float] = None,
+        result_cache_size: int = 0,
+        result_ttl: int = RESULT_TTL,
+        result_max_bytes: int = RESULT_MAX_BYTES,
+        codec: str = 'json',
+        compression: str = None,
+        compress_min_bytes: int = COMPRESS_MIN_BYTES,
+        blob_store: BlobStore = None,
+        shards: int = 1,
+        circuit_breaker: CircuitBreaker = None,
+        misfire_batch: int = MISFIRE_BATCH,
+        **kwargs
+    ):
+        super().__init__(
+            redis,
+            jobs,
+            workflow_directory=workflow_directory,
+            concurrency=concurrency,
+            process_workers=process_workers,
+            process_kwargs=process_kwargs,
+            fifo=fifo,
+            block_timeout=block_timeout,
+            prefetch=prefetch,
+            lease_ttl=lease_ttl,
+            priorities=priorities,
+            priority_weights=priority_weights,
+            result_cache_size=result_cache_size,
+            result_ttl=result_ttl,
+            result_max_bytes=result_max_bytes,
+            codec=codec,
+            compression=compression,
+            compress_min_bytes=compress_min_bytes,
+            blob_store=blob_store,
+            shards=shards,
+            circuit_breaker=circuit_breaker,
+            misfire_batch=misfire_batch,
+            **kwargs
         )
+        self.executor = None
+        self.stopped = threading.Event()
 
-        self.jobs = []
-        self.workflows = []
+        if self.tracks_claims:
+            # Heartbeats come from a background thread so a long running job can't make this worker look dead
+            self.heartbeat()
+            threading.Thread(target=self.heartbeat_loop, name=f'nuts-heartbeat-{self.id[:8]}', daemon=True).start()
 
+        # The lease is renewed from a background thread so run() never spends a round trip on leadership
         self.check_leader()
+        threading.Thread(target=self.lease_loop, name=f'nuts-lease-{self.id[:8]}', daemon=True).start()
 
-        if self.is_leader and workflow_directory:
-            self.logger.info(f'Worker {self.id} assuming leadership')
-            # Register the workflows
-            print(os.listdir(workflow_directory))
-            for workflow in os.listdir(workflow_directory):
-                if not workflow.endswith('.yaml'):
-                    continue
-                with open(os.path.join(workflow_directory, workflow), 'r') as f:
-                    wf = yaml.safe_load(f)
-                    self.logger.info(f'Registering Workflow {workflow}')
-
-                    workflow = NutsWorkflow(**wf['workflow'])
-
-                    # Validate workflow configuration
-                    is_valid, error = workflow.validate()
-                    if not is_valid:
-                        self.logger.error(f'Invalid workflow {workflow.name}: {error}')
-                        continue
-
-                    self.workflows.append(workflow)
-
-                    next_execution = self.scheduler.get_next_execution(workflow.schedule)
-                    next_execution = next_execution.timestamp()
-                    running_workflow = None
-                    try:
-                        pending = self.redis.zscan(self.scheduled_workflow_queue, match=workflow.name)
-                        if pending[1][0]:
-                            if pending[1][1] != next_execution:
-                                # Schedule has changed
-                                self.redis.zrem(self.scheduled_workflow_queue, workflow.name)
-                                self.redis.zadd(self.scheduled_workflow_queue, {workflow.name: next_execution})
-
-                    except Exception:
-                        pass
-
-                    running_workflow = self.redis.hget(self.running_workflow_queue, workflow.name)
-
-                    if not running_workflow:
-                        self.redis.zadd(self.scheduled_workflow_queue, {workflow.name: next_execution})
-                    else:
-                        print(running_workflow)
-                        # Type guard: running_workflow is bytes here (not None)
-                        assert isinstance(running_workflow, bytes)
-                        workflow = NutsWorkflow(**json.loads(running_workflow))
-
-        # Register jobs with the worker
-        for job in jobs:
-            j = job.Job()
-
-            self.jobs.append(j)
-
-            # If this worker is the leader, register the job schedules
-            if self.is_leader and j.schedule:
-                self.logger.info(f'Registering Cron Job {j.name}')
-
-                next_execution = self.scheduler.get_next_execution(j.schedule).timestamp()
-
-                try:
-                    pending = self.redis.zscan('nuts|jobs|pending', match=j.name)
-                    if pending[1][0]:
-                        if pending[1][1] != next_execution:
-                            # Schedule has changed
-                            self.redis.zrem(self.scheduled_queue, job.name)
-                            self.redis.zadd(self.scheduled_queue, {job.name: next_execution})
-
-                except Exception:
-                    pass
+        # Concurrent execution, jobs are handed off to a thread pool when more than one may run at a time.
+        # Process jobs are always handed off so the main loop isn't blocked waiting on the pool.
+        if self.concurrency > 1 or self.process_pool:
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f'nuts-{self.id[:8]}')
 
     def check_leader(self) -> bool:
-        leadership_check = self.redis.setnx('leader_id', self.id)
+        """
+        Take the leader lease if it is free, or renew it if this worker holds it, in one round trip.
+
+        Returns:
+            True if this worker is the leader
+        """
+        was_leader = self.is_leader
+        self.is_leader = self.lease.acquire()
+        self.leadership_changed(was_leader)
 
-        if not leadership_check:
-            leader_id = self.redis.get('leader_id')
-            if leader_id == self.id:
-                # Puts a 60 second life on the current leader so we aren't left in limbo if the leader worker dies ungracefully.
-                self.redis.expire('leader_id', 60)
+        if self.is_leader and not was_leader:
+            self.register_schedules()
 
-                self.is_leader = True
+        return self.is_leader
 
-        else:
-            # Puts a 60 second life on the current leader so we aren't left in limbo if the leader worker dies ungracefully.
-            self.redis.expire('leader_id', 60)
-            self.is_leader = True
+    def register_schedules(self):
+        """
+        Schedule the workflows and cron jobs this worker knows about, run whenever it takes over the lease.
+
+        Workflows another leader left running are resumed here. Workflows and cron jobs that are already
+        scheduled keep their entries, past due ones included, unless a cron job's schedule has changed.
+        """
+        # One round trip each however many workflows and cron jobs there are
+        names = [w.name for w in self.workflows]
+        states = self.redis.hmget(self.running_workflow_queue, names) if names else []
+        scheduled = self.redis.zmscore(self.scheduled_workflow_queue, names) if names else []
+        writes = self.workflow_writes([state is not None for state in states], scheduled)
+        self.restore_writes(writes, states)
+
+        names = [j.name for j in self.scheduled_jobs()]
+        scheduled = self.redis.zmscore(self.scheduled_queue, names) if names else []
+        self.cron_writes(writes, scheduled)
+        self.commit(writes)
+
+    def lease_loop(self):
+        # Followers try for the lease just as often as the leader renews it, so a dead leader is replaced within about one lease
+        while not self.stopped.wait(self.lease.renew_interval):
+            try:
+                self.check_leader()
+                self.refresh_slots()
+            except Exception as ex:
+                # An outage is reported by the main loop, not again on every renewal
+                if not self.breaker.is_open:
+                    self.logger.error(f'Unhandled Exception renewing leader lease: {ex}')
+
+    def refresh_slots(self):
+        """Mark the concurrency slots of this worker's running jobs as still in use, see nuts.limits.SLOT_TTL."""
+        slots = tuple(self.slots)
+        if slots:
+            now = round(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
+            pipe = self.redis.pipeline(transaction=False)
+            for field in slots:
+                pipe.zadd(concurrency_key(running_job_name(field)), {field: now}, xx=True)
+            pipe.execute()
+
+    def commit(self, writes: SchedulerWrites) -> bool:
+        """
+        Apply the leader's scheduler writes, fenced by its lease.
+
+        Returns:
+            False if another worker has taken over leadership, in which case nothing was written
+        """
+        if self.lease.commit(writes):
+            return True
+
+        self.writes_rejected(writes)
+        return False
+
+    def promote(self, writes: SchedulerWrites) -> tuple[int, list[bytes]]:
+        """
+        Move a batch of due entries out of a scheduled queue in one fenced script, see LeaderLease.promote.
+
+        The writes of each entry only apply if it still has the score it was read with. An entry that is
+        rescheduled in between is left alone, and one that is read but never moved stays in the queue.
+
+        Returns:
+            How many entries of the queue are still due, and the entries that were moved
+        """
+        if not writes:
+            return 0, []
 
-    def shutdown(self, signum, frame):
+        remaining, moved = self.lease.promote(writes, datetime.datetime.now(datetime.timezone.utc).timestamp())
+        if not self.lease.held:
+            self.writes_rejected(writes)
+        return remaining, moved
+
+    def shutdown(self, signum, frame, drain_timeout: float = None):
+        """
+        Stop the worker, hand back what it claimed but hasn't started and step down as leader.
+
+        Args:
+            drain_timeout: Seconds to wait for running jobs to finish, forever by default
+        """
         self.logger.info(f'Received shutdown command {signum}.')
         self.should_run = False
+        self.stopped.set()
+
+        drained = True
+        if self.in_flight and drain_timeout is not None:
+            _, unfinished = wait(self.in_flight, timeout=drain_timeout)
+            if unfinished:
+                self.logger.warning(f'{len(unfinished)} jobs still running after {drain_timeout}s, shutting down without them')
+                drained = False
+
+        if self.executor:
+            # Let in flight jobs finish so their completions are recorded before we step down
+            self.executor.shutdown(wait=drained)
+
+        if self.process_pool:
+            self.process_pool.shutdown(wait=drained)
+
+        if self.tracks_claims and drained:
+            # Whatever is still claimed was prefetched but never started, hand it back for other workers
+            self.buffer.clear()
+            self.release_claims(self.id, self.processing_queue)
+            self.redis.delete(self.heartbeat_key)
+        elif self.tracks_claims:
+            # Jobs still running keep their claims. If they don't finish the leader requeues them once the heartbeat expires.
+            pipe = self.redis.pipeline()
+            self.hand_back_writes(pipe)
+            pipe.execute()
 
         if self.is_leader:
-            for workflow in self.workflows:
-                if workflow.status == 'active':
-                    self.logger.info(f'Workflow {workflow.name} is active, persisting state')
-                    self.redis.hset(self.running_workflow_queue, workflow.name, json.dumps(workflow, default=lambda o: o.__dict__))
+            self.commit(self.persist_writes())
             self.release_leader()
 
     def release_leader(self):
         if self.is_leader:
             self.logger.info('Shutdown: Releasing leadership')
-            self.redis.expire('leader_id', -1)
+            self.lease.release()
+            self.is_leader = False
+
+    def schedule_pending_job(self, job_name, job_params=[], priority: str = DEFAULT):
+        """Enqueue a job. Any worker may do this, so unlike the leader's scheduler writes it isn't fenced."""
+        command, queue, payload = self.enqueue_call(job_name, job_params, priority)
+        getattr(self.redis, command)(queue, payload)
+
+    def heartbeat(self):
+        """Mark this worker as alive so the leader leaves its processing list alone."""
+        self.redis.set(self.heartbeat_key, self.id, ex=HEARTBEAT_INTERVAL * 3)
+
+    def heartbeat_loop(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.heartbeat()
+                if self.is_leader:
+                    self.recover_orphaned_jobs()
+            except Exception as ex:
+                if not self.breaker.is_open:
+                    self.logger.error(f'Unhandled Exception in heartbeat: {ex}')
+
+    def release_claims(self, worker_id: str, processing_queue: str) -> int:
+        """
+        Return everything left in a worker's processing list to the queue it was claimed from, and clear its running entries,
+        concurrency slots and the dedupe keys of running jobs that weren't requeued.
 
-    def schedule_pending_job(self, job_name, job_params=[]):
-        self.redis.sadd(self.pending_queue, json.dumps([job_name, job_params]))
+        Returns:
+            The number of jobs requeued
+        """
+        claims = self.redis.lrange(processing_queue, 0, -1)
+        script, call = self.requeue_call(processing_queue)
+        requeued = script(**call)
 
-    def is_job_cancelled(self, job_name: str) -> bool:
-        """Check if a cancellation has been requested for this job."""
-        return bool(self.redis.sismember(self.cancel_queue, job_name))
+        running = dict(self.redis.hscan_iter(self.running_queue, match=f'{worker_id}|*'))
+        if running:
+            self.redis.hdel(self.running_queue, *running)
+            for field in running:
+                self.redis.zrem(concurrency_key(running_job_name(field)), field)
 
-    def clear_job_cancellation(self, job_name: str):
-        """Clear the cancellation flag for a job."""
-        self.redis.srem(self.cancel_queue, job_name)
+        pipe = self.redis.pipeline(transaction=False)
+        self.recovered_dedupe_writes(pipe, claims, list(running.values()))
+        pipe.execute()
 
-    def move_scheduled_to_pending(self):
-        now = datetime.datetime.now(datetime.timezone.utc)
-        now_timestamp = round(now.timestamp())
+        return requeued
 
-        ready_jobs = self.redis.zrange(self.scheduled_queue, start=0, end=now_timestamp, withscores=True)
+    def recover_orphaned_jobs(self):
+        """
+        Requeue jobs claimed by workers that have stopped sending heartbeats.
 
-        if len(ready_jobs) > 0:
-            latest = max(j[1] for j in ready_jobs)
-            self.redis.zremrangebyscore(self.scheduled_queue, min=self.last_run.timestamp(), max=latest)
+        Run by the leader every HEARTBEAT_INTERVAL seconds.
+        """
+        for pattern in ['nuts|jobs|processing|*', 'nuts|jobs|claimed|*']:
+            for processing_queue in self.redis.scan_iter(match=pattern):
+                processing_queue = processing_queue.decode()
+                worker_id = processing_queue.split('|')[-1]
+                if self.redis.exists(f'nuts|workers|{worker_id}'):
+                    continue
 
-            for job in ready_jobs:
-                self.schedule_pending_job(job[0].decode())
+                requeued = self.release_claims(worker_id, processing_queue)
+                if requeued:
+                    self.logger.info(f'Requeued {requeued} jobs claimed by dead worker {worker_id}')
 
-    def move_scheduled_workflows_to_running(self):
-        now = datetime.datetime.now(datetime.timezone.utc)
-        now_timestamp = round(now.timestamp())
+    def fetch(self) -> list[tuple[bytes, Union[str, None]]]:
+        """
+        Claim up to prefetch pending jobs in a single round trip, see BaseWorker.claim_args.
 
-        ready_workflows = self.redis.zrange(self.scheduled_workflow_queue, start=0, end=now_timestamp, withscores=True)
+        In FIFO mode, when every lane is empty the worker blocks on the server for up to block_timeout seconds
+        on one of them, see wait_lane. BLMOVE hands the job straight to the processing list, so it can't be lost
+        before it is started. The other lanes are checked again on the next fetch. With sharded queues the shards are
+        tried in turn, one round trip each until one has jobs, and the worker blocks on the first of them.
 
-        if len(ready_workflows) > 0:
-            latest = max(j[1] for j in ready_workflows)
-            self.redis.zremrangebyscore(self.scheduled_workflow_queue, min=self.last_run.timestamp(), max=latest)
+        Returns:
+            List of (payload, running field) pairs, the running field is None for jobs that haven't been started
+        """
+        shards = self.shard_order()
+        for shard in shards:
+            lanes = self.lane_order(shard)
+            keys = self.claim_keys(lanes)
+            [started, claimed] = self.claim_script(keys=keys, args=self.claim_args())
+            if started:
+                return self.claimed_jobs(started, claimed)
+
+        if self.fifo:
+            lanes = self.lane_order(shards[0])
+            data = self.redis.blmove(self.wait_lane(shards[0]), self.processing_queue, self.block_timeout, 'LEFT', 'RIGHT')
+            if data:
+                started = [data, self.start_script(keys=self.claim_keys(lanes), args=self.start_args(data))]
+
+        return self.claimed_jobs(started, claimed)
+
+    def claim(self) -> Union[tuple[bytes, str], None]:
+        """
+        Take the next job, from the local prefetch buffer if there is one waiting.
 
-        for workflow in ready_workflows:
-            wf_name = workflow[0].decode()
-            wf = [w for w in self.workflows if w.name == wf_name][0]
+        Buffered jobs are checked for cancellation and marked running only now, so a job cancelled while it
+        waited is skipped and the running hash only lists jobs that are actually running.
+        """
+        if not self.buffer:
+            self.buffer.extend(self.fetch())
+
+        claimed = None
+        while self.buffer and not claimed:
+            data, running_field = self.buffer.popleft()
+            if running_field is None:
+                running_field = self.start_script(keys=self.claim_keys(), args=self.start_args(data))
+                if not self.started(data, running_field):
+                    continue
+                running_field = running_field.decode()
+            claimed = data, running_field
 
-            wf.status = 'active'
+        if self.claimed_dedupe or self.released_dedupe:
+            pipe = self.redis.pipeline(transaction=False)
+            self.claimed_dedupe_writes(pipe)
+            pipe.execute()
+        return claimed
 
-    def move_pending_to_running(self, job: NutsJob, job_args: list):
-        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        self.redis.hset(self.running_queue, f'{self.id}|{job.name}', json.dumps({'timestamp': now, 'args': job_args}))
+    def ready(self, queue: str) -> list[tuple[bytes, float]]:
+        """The entries of a scheduled queue that are due, oldest first and at most misfire_batch of them."""
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
 
-    def remove_running(self, job: NutsJob):
+        return self.redis.zrange(queue, '-inf', now, byscore=True, offset=0, num=self.misfire_batch, withscores=True)
 
-        self.redis.hdel(self.running_queue, f'{self.id}|{job.name}')
+    def move_scheduled_to_pending(self) -> int:
+        """
+        Move a batch of due cron jobs to the pending queue, and deferred and delayed jobs that are due to their lanes.
 
-    def move_to_completed(self, job: NutsJob, workflow_name: str = None):
-        if workflow_name:
-            name = f'{workflow_name}|{job.name}'
-        else:
-            name = job.name
+        Returns:
+            How many scheduled jobs are still due, the next batch goes on the leader's next pass
+        """
+        remaining, _ = self.promote(self.pending_writes(self.ready(self.scheduled_queue)))
+        # Jobs deferred by their limits and delayed jobs are moved atomically, so this doesn't need the fence
+        self.promote_script(**self.promote_call())
+        self.promote_script(**self.promote_call(self.delayed_queue))
+        return remaining
 
-        job_data = {'success': job.success}
-        if hasattr(job, 'error') and job.error:
-            job_data['error'] = str(job.error)
+    def move_scheduled_workflows_to_running(self):
+        ready_workflows = self.ready(self.scheduled_workflow_queue)
+
+        writes, due = self.ready_workflow_writes(ready_workflows)
+        _, moved = self.promote(writes)
+        self.activate_workflows([w for w in due if w[0] in moved])
 
-        self.redis.hset(self.completed_queue, name, json.dumps(job_data))
+    def finish(self, data: bytes, running_field: str, job: NutsJob = None, workflow_name: str = None, record: bool = False):
+        """Clear a job's running entry and claim, record its completion and enqueue the next job in its chain, see BaseWorker.finish_call."""
+        self.finish_script(**self.finish_call(data, running_field, job, workflow_name, record))
+        self.release_blob(data)
 
     def queue_completed_jobs(self):
+        # Read and clear the completed queue in one step
+        completed_jobs = self.drain_script(keys=[self.completed_queue])
+
+        if not self.commit(self.completed_writes(completed_jobs)) and completed_jobs:
+            # Hand the completions back for whoever leads now
+            self.redis.hset(self.completed_queue, mapping=dict(zip(completed_jobs[::2], completed_jobs[1::2])))
 
-        completed_jobs = self.redis.hkeys(self.completed_queue)
+    def run_workflows(self):
+        """Activate workflows that are due and schedule their next jobs, see BaseWorker.workflow_step_writes."""
+        self.move_scheduled_workflows_to_running()
+        self.commit(self.workflow_step_writes())
 
-        for job_name in completed_jobs:
-            job_results_raw = self.redis.hget(self.completed_queue, job_name)
-            if not job_results_raw:
-                continue  # Skip if no results found
-            # Type guard: job_results_raw is bytes here (not None)
-            assert isinstance(job_results_raw, bytes)
-            job_results = json.loads(job_results_raw)
-            status = 'completed' if job_results.get('success', None) else 'failed'
-            # Remove from the completed queue
-            self.redis.hdel(self.completed_queue, job_name)
+    def has_capacity(self) -> bool:
+        """
+        Check whether another job can be started, reaping finished executions along the way.
 
-            if 'workflow' in job_name.decode():
-                [workflow_name, job_name] = job_name.decode().split('|')
-                workflow_name = workflow_name.replace('workflow-', '')
-                wf = [w for w in self.workflows if w.name == workflow_name][0]
+        When every slot is busy this waits briefly for one to free up, so a saturated worker
+        doesn't spin while still getting back to the leader duties in run() regularly.
+        """
+        if not self.executor:
+            return True
 
-                # Pass error information if job failed
-                error_msg = job_results.get('error', None) if status == 'failed' else None
-                wf.update(job_name, status, error_msg)
+        if len(self.in_flight) >= self.concurrency:
+            wait(self.in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
 
-            else:
-                job = [j for j in self.jobs if j.name == job_name.decode()][0]
+        for future in [f for f in self.in_flight if f.done()]:
+            self.in_flight.discard(future)
+            if future.exception():
+                self.logger.error(f'Unhandled Exception in worker run process: {future.exception()}')
 
-                next_execution = self.scheduler.get_next_execution(job.schedule).timestamp()
+        return len(self.in_flight) < self.concurrency
 
-                self.redis.zadd(self.scheduled_queue, {job.name: next_execution})
+    def dispatch(self, data: bytes, running_field: str):
+        """Execute a claimed job inline, or on the thread pool when running concurrently."""
+        if self.executor:
+            self.in_flight.add(self.executor.submit(self.handle_job, data, running_field))
+        else:
+            self.handle_job(data, running_field)
 
-    def run_workflows(self):
+    def handle_job(self, data: bytes, running_field: str):
+        try:
+            self.execute_job(data, running_field)
+        except Exception:
+            # Don't leave a payload we can't handle marked as running or claimed
+            self.finish(data, running_field)
+            raise
+
+    def run_in_process(self, job: NutsJob, job_args: Union[dict, list]):
         """
-        Execute active workflows by checking dependencies and scheduling ready jobs.
+        Run a job on the process pool, blocking the calling pool thread until it is done.
 
-        This method:
-        - Moves scheduled workflows to running state
-        - Checks for job failures (stops workflow if any job failed)
-        - Identifies next ready job based on dependencies
-        - Schedules ready jobs to pending queue
-        - Reschedules completed/failed workflows for next run
+        The outcome is copied back onto the job so completion and chaining behave exactly as for
+        jobs run in this process. Exceptions raised by the job are re-raised here.
+        """
+        future = self.process_pool.submit(_run_in_process, job.name, job_args)
+        job.success, job.result, job.error = future.result()
 
-        Workflows are executed by the leader worker only.
+    def cached_result(self, job: NutsJob, key: str) -> Union[str, bytes, None]:
         """
-        # Move ready  to the pending queue
-        self.move_scheduled_workflows_to_running()
+        A cached job's result, from this worker's LRU or the shared cache in Redis.
 
-        try:
-            for workflow in self.workflows:
-                if workflow.status == 'active':
-                    self.logger.info(f'Running workflow {workflow.name}')
-
-                    # Check for failures first
-                    if workflow.has_failures():
-                        self.logger.error(f'Workflow {workflow.name} failed: {workflow.error}')
-                        workflow.status = 'failed'
-                        # Reschedule for next run
-                        workflow.reset()
-                        next_execution = self.scheduler.get_next_execution(workflow.schedule).timestamp()
-                        self.redis.zadd(self.scheduled_workflow_queue, {workflow.name: next_execution})
-                        continue
-
-                    try:
-                        next_job = workflow.run()
-                        if not next_job and workflow.completed():
-                            self.logger.info(f'Workflow {workflow.name} completed successfully')
-                            workflow.reset()
-                            next_execution = self.scheduler.get_next_execution(workflow.schedule).timestamp()
-                            print(self.scheduler.get_next_execution(workflow.schedule), datetime.datetime.now(datetime.timezone.utc))
-                            self.redis.zadd(self.scheduled_workflow_queue, {workflow.name: next_execution})
-                        elif next_job:
-                            self.logger.info(f'Workflow {workflow.name} next job {next_job}')
-
-                            self.schedule_pending_job(f'workflow-{workflow.name}|{next_job}')
-                            workflow.update(next_job, 'pending')
-
-                    except Exception as ex:
-                        # Deal with user error gracefully
-                        self.logger.error(f'Unhandled Exception In Workflow: {workflow.name}: {ex}')
-                        workflow.status = 'failed'
-                        workflow.error = str(ex)
-                        workflow.reset()
-                        next_execution = self.scheduler.get_next_execution(workflow.schedule).timestamp()
-                        self.redis.zadd(self.scheduled_workflow_queue, {workflow.name: next_execution})
+        Returns:
+            The encoded result, None on a miss
+        """
+        value = self.local_cache.get(key) if self.local_cache else None
+        if value is None:
+            value = self.cache_get_script(**self.cache_get_call(job, key))
 
-        except Exception as ex:
-            self.logger.error(f'Unhandled Exception in run_workflows: {ex}')
+        return value
 
-    def run(self):
-        # Check that we have a leader each time this runs so we don't leave any jobs in limbo if the leader has gone down
-        self.check_leader()
+    def cache_result(self, job: NutsJob, key: str):
+        call = self.cache_result_call(job, key)
+        if call:
+            self.cache_result_script(**call)
 
-        if self.is_leader:
-            # Move ready jobs to the pending queue
-            self.move_scheduled_to_pending()
-            self.run_workflows()
+    def execute_job(self, data: bytes, running_field: str):
+        job, job_args, workflow_name = self.prepare_job(data)
 
-        try:
-            data = self.redis.spop(self.pending_queue, 1)
-            if not len(data):
-                return
-            else:
-                # Type guard: data[0] is bytes (from redis)
-                assert isinstance(data[0], bytes)
-                [job_name, job_args] = json.loads(data[0])
-                for_workflow = False
-                workflow_name = None
-                if 'workflow' in job_name:
-                    for_workflow = True
-                    [workflow_name, job_name] = job_name.split('|')
-
-                jobs = [j for j in self.jobs if j.name == job_name]
-
-                if not len(jobs):
-                    self.logger.info(f'No job matches name {job_name}')
-                    return
+        if not job:
+            self.finish(data, running_field)
+            return
+
+        key = self.result_cache_key(job, job_args)
+        cached = self.cached_result(job, key) if key else None
+
+        if cached is not None:
+            self.cache_hit(job, key, cached)
+        else:
+            try:
+                if job.executor == 'process':
+                    self.run_in_process(job, job_args)
+                # Handle both dict arguments and backwards compatibility
+                elif isinstance(job_args, dict):
+                    job.run(**job_args, **self.kwargs)
                 else:
-                    job = jobs[0]
+                    # For backwards compatibility or empty args
+                    job.run(**self.kwargs)
+            except Exception as ex:
+                # Deal with user error gracefully
+                self.logger.error(f'Unhandled Exception In Job: {job.name}: {ex}')
+
+            if key and job.success:
+                self.cache_result(job, key)
 
-                    # Check if cancellation was requested for this job
-                    if self.is_job_cancelled(job_name):
-                        self.logger.info(f'Job {job_name} was cancelled, skipping execution')
-                        self.clear_job_cancellation(job_name)
-                        return
+        self.job_finished(job)
+        self.finish(data, running_field, job, workflow_name, record=bool(job.schedule or workflow_name))
 
-                    self.move_pending_to_running(job, job_args)
+    def run_forever(self, idle_min: float = IDLE_MIN, idle_max: float = IDLE_MAX, drain_timeout: float = DRAIN_TIMEOUT):
+        """
+        Run the worker until SIGTERM or SIGINT, then shut it down gracefully.
+
+        While no job is waiting the worker pauses between passes, doubling the pause from idle_min up to idle_max
+        seconds, and goes back to full speed as soon as it claims one. The leader pauses for a second at most so
+        scheduled jobs are still moved on time. A worker that can't reach Redis backs off the same way.
+
+        On a signal the worker stops claiming, waits up to drain_timeout seconds for its running jobs and hands
+        back the prefetched jobs it hasn't started, see shutdown.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
 
-                    try:
-                        # Handle both dict arguments and backwards compatibility
-                        if isinstance(job_args, dict):
-                            job.run(**job_args, **self.kwargs)
-                        else:
-                            # For backwards compatibility or empty args
-                            job.run(**self.kwargs)
-                    except Exception as ex:
-                        # Deal with user error gracefully
-                        self.logger.error(f'Unhandled Exception In Job: {job.name}: {ex}')
+        idle = 0
+        while self.should_run:
+            if self.run():
+                idle = 0
+                continue
+            idle = self.idle_pause(idle, idle_min, idle_max)
+            self.stopped.wait(idle)
 
-                    self.remove_running(job)
+        self.shutdown(self.stop_signal, None, drain_timeout)
 
-                    if job.success:
-                        self.logger.info(f'SUCCESS: {job.name}, {job.result}')
-                        # Light DAG support, can chain together jobs in a workflow by defining the next step that should
-                        # be taken after a job completes
-                        if job.next:
-                            self.schedule_pending_job(job.next, job.result)
+    def stop(self, signum=None, frame=None):
+        super().stop(signum, frame)
+        self.stopped.set()
 
-                    else:
-                        self.logger.error(f'Error running job {job.name}: {job.error}')
+    def run(self) -> bool:
+        """
+        One pass of the worker: the leader's scheduling duties, then claiming and starting a job if there is room.
 
-                    if job.schedule or for_workflow:
-                        self.move_to_completed(job, workflow_name)
+        Returns:
+            False if the worker was idle, with room for a job but none waiting
+        """
+        # While Redis is unreachable the worker only probes it, once per backoff
+        if self.breaker.is_open and not self.probe():
+            return False
 
-                self.last_run = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            busy = self.run_once()
+        except CONNECTION_ERRORS as ex:
+            self.park(self.connection_failed(ex))
+            return False
+
+        if self.breaker.failures:
+            self.connection_restored()
+        return busy
+
+    def run_once(self) -> bool:
+        # Leadership is kept up to date by the lease thread, a stale leader's scheduler writes are rejected by the fence
+        backlog = 0
+        if self.is_leader:
+            backlog = self.move_scheduled_to_pending()
+            self.run_workflows()
 
+        busy = True
+        try:
+            if self.has_capacity():
+                claimed = self.claim()
+                busy = claimed is not None
+                if claimed:
+                    self.dispatch(*claimed)
+
+        except CONNECTION_ERRORS:
+            raise
         except Exception as ex:
             self.logger.error(f'Unhandled Exception in worker run process: {ex}')
+            busy = False
 
         # Post Execution
         if self.is_leader:
             self.queue_completed_jobs()
+
+        # While scheduled jobs are still due the leader doesn't idle, it moves a batch on every pass between jobs
+        return busy or backlog > 0
+
+    def probe(self) -> bool:
+        """Check whether Redis is back, parking for another backoff if it isn't."""
+        try:
+            self.redis.ping()
+        except CONNECTION_ERRORS as ex:
+            self.park(self.connection_failed(ex))
+            return False
+        self.connection_restored()
+        return True
+
+    def park(self, delay: float):
+        # Woken early by shutdown
+        self.stopped.wait(delay)
@@ -7,9 +7,16 @@ to be orchestrated with dependencies, parallel execution, and error handling.
 Classes:
     WorkflowJob: Represents a job within a workflow with status and dependencies
     NutsWorkflow: Manages workflow execution, validation, and state
+
+Functions:
+    load_workflows: Loads and validates the workflow definitions in a directory
 """
 from typing import Union
 from .job import NutsJob
+from .misfire import COALESCE, MISFIRE_GRACE, POLICIES
+import logging
+import os
+import yaml
 
 
 class WorkflowJob(NutsJob):
@@ -46,6 +53,8 @@ class NutsWorkflow:
     Attributes:
         name: Unique workflow identifier
         schedule: Cron expression for workflow scheduling
+        misfire: What happens to runs missed while no worker was leading, see nuts.misfire
+        misfire_grace: Seconds a run may be late and still run under the 'grace' policy
         status: Workflow status ('active', 'completed', 'failed', or None)
         error: Error message if workflow failed, None otherwise
         jobs: List of WorkflowJob instances in this workflow
@@ -65,6 +74,8 @@ class NutsWorkflow:
     """
     name: str
     schedule: str
+    misfire: str
+    misfire_grace: float
     status: Union[str, None]
     error: Union[str, None]
     jobs: list[WorkflowJob]
@@ -75,6 +86,8 @@ class NutsWorkflow:
         """
         self.name = kwargs.get('name', None)
         self.schedule = kwargs.get('schedule', None)
+        self.misfire = kwargs.get('misfire', COALESCE)
+        self.misfire_grace = kwargs.get('misfire_grace', MISFIRE_GRACE)
         self.status = None
         self.error = None
         self.jobs = []
@@ -170,6 +183,22 @@ class NutsWorkflow:
                 return True
         return False
 
+    def restore(self, state: dict):
+        """
+        Pick up a run where another worker left it.
+
+        Args:
+            state: The workflow as its last leader persisted it, see BaseWorker.persist_writes
+        """
+        self.status = state.get('status')
+        self.error = state.get('error')
+        saved = {j['name']: j for j in state.get('jobs', [])}
+        for job in self.jobs:
+            if job.name in saved:
+                job.status = saved[job.name].get('status')
+                job.success = saved[job.name].get('success')
+                job.error = saved[job.name].get('error')
+
     def reset(self):
         """
         Reset the workflow for next execution.
@@ -187,6 +216,9 @@ class NutsWorkflow:
         Validate workflow configuration for common errors.
         Returns (is_valid, error_message)
         """
+        if self.misfire not in POLICIES:
+            return False, f"Unknown misfire policy {self.misfire}, expected one of {', '.join(POLICIES)}"
+
         # Check for circular dependencies
         visited = set()
 
@@ -229,3 +261,37 @@ class NutsWorkflow:
             return False, "Workflow has no root jobs (all jobs have requirements)"
 
         return True, ""
+
+
+def load_workflows(workflow_directory: str, logger: logging.Logger) -> list[NutsWorkflow]:
+    """
+    Load and validate every workflow YAML file in a directory.
+
+    Invalid workflows are logged and skipped.
+
+    Args:
+        workflow_directory: Directory containing workflow .yaml files
+        logger: Logger to report registration and validation errors on
+
+    Returns:
+        List of valid NutsWorkflow instances
+    """
+    workflows = []
+    for workflow_file in os.listdir(workflow_directory):
+        if not workflow_file.endswith('.yaml'):
+            continue
+        with open(os.path.join(workflow_directory, workflow_file), 'r') as f:
+            wf = yaml.safe_load(f)
+            logger.info(f'Registering Workflow {workflow_file}')
+
+            workflow = NutsWorkflow(**wf['workflow'])
+
+            # Validate workflow configuration
+            is_valid, error = workflow.validate()
+            if not is_valid:
+                logger.error(f'Invalid workflow {workflow.name}: {error}')
+                continue
+
+            workflows.append(workflow)
+
+    return workflows
@@ -0,0 +1,14 @@
+import asyncio
+from ....nuts.job import NutsJob
+
+
+class Job(NutsJob):
+    def __init__(self):
+        super().__init__()
+        self.name = 'AsyncJob'
+
+    async def run(self, **kwargs):
+        await asyncio.sleep(kwargs.get('delay', 0))
+
+        self.result = kwargs.get('base') + 1
+        self.success = True
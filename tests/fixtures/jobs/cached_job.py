@@ -0,0 +1,17 @@
+from ....nuts.job import NutsJob
+
+
+class Job(NutsJob):
+    cache_ttl = 60
+    cache_size = 2
+    runs = 0
+
+    def __init__(self):
+        super().__init__()
+        self.name = 'CachedJob'
+        self.next = 'AddOne'
+
+    def run(self, **kwargs):
+        Job.runs += 1
+        self.result = {'base': kwargs.get('a', 0) + kwargs.get('b', 0)}
+        self.success = True
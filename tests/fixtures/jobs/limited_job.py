@@ -0,0 +1,14 @@
+from ....nuts.job import NutsJob
+
+
+class Job(NutsJob):
+    max_concurrency = 1
+    rate_limit = '2/hour'
+
+    def __init__(self):
+        super().__init__()
+        self.name = 'LimitedJob'
+
+    def run(self, **kwargs):
+        self.result = kwargs.get('base')
+        self.success = True
@@ -0,0 +1,17 @@
+import os
+from ....nuts.job import NutsJob
+
+
+class Job(NutsJob):
+    executor = 'process'
+
+    def __init__(self):
+        super().__init__()
+        self.name = 'ProcessJob'
+        self.next = 'AddOne'
+
+    def run(self, **kwargs):
+        upper = kwargs.get('upper')
+
+        self.result = {'base': sum(i * i for i in range(upper)), 'pid': os.getpid(), 'kwargs': sorted(k for k in kwargs if k != 'upper')}
+        self.success = True
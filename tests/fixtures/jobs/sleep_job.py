@@ -0,0 +1,15 @@
+import time
+from ....nuts.job import NutsJob
+
+
+class Job(NutsJob):
+    def __init__(self):
+        super().__init__()
+        self.name = 'SleepJob'
+        self.next = 'AddOne'
+
+    def run(self, **kwargs):
+        time.sleep(kwargs.get('delay', 0))
+
+        self.result = {'base': kwargs.get('base')}
+        self.success = True
@@ -0,0 +1,49 @@
+import asyncio
+from ..nuts.async_queue import AsyncWorkQueue
+from ..nuts.queue import WorkQueue
+from ..nuts.worker import Worker
+from redis import Redis
+from .fixtures.jobs import add_one
+
+r = Redis()
+
+
+def test_async_queue_matches_work_queue():
+    r.flushall()
+
+    async def publish():
+        queue = AsyncWorkQueue.from_url('redis://localhost:6379', max_connections=4, fifo=True)
+        await asyncio.gather(*[queue.publish('AddOne', {'base': i}, priority='high') for i in range(20)])
+        assert await queue.publish('AddOne', {'base': 0}, dedupe_key='once')
+        assert not await queue.publish('AddOne', {'base': 0}, dedupe_key='once')
+        assert await queue.publish_many([('AddOne', {'base': i}) for i in range(5)], chunk_size=2) == [True] * 5
+        await queue.close()
+
+    asyncio.run(publish())
+
+    # The same keys and payloads as WorkQueue
+    wq = WorkQueue(r, fifo=True)
+    assert r.llen(f'{wq.fifo_queue}|high') == 20
+    assert r.llen(wq.fifo_queue) == 6
+    wq.publish('AddOne', {'base': 0})
+    assert r.lindex(wq.fifo_queue, -1) == r.lindex(wq.fifo_queue, 1)
+
+
+def test_wait_for_result():
+    r.flushall()
+    worker = Worker(redis=r, jobs=[add_one])
+
+    async def wait():
+        queue = AsyncWorkQueue.from_url('redis://localhost:6379')
+        job_id = await queue.publish('AddOne', {'base': 1}, keep_result=True)
+        assert await queue.wait_for_result(job_id, timeout=0.1) is None
+
+        waiting = asyncio.create_task(queue.wait_for_result(job_id, timeout=5))
+        await asyncio.sleep(0.1)
+        await asyncio.to_thread(lambda: worker.execute_job(*worker.claim()))
+        result = await waiting
+        await queue.close()
+        return result
+
+    assert asyncio.run(wait())['result'] == 2
+    worker.shutdown(None, None)
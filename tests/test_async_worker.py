@@ -0,0 +1,69 @@
+import asyncio
+import json
+import time
+from ..nuts.async_worker import AsyncWorker
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from .fixtures.jobs import add_one, async_job
+
+r = Redis()
+
+
+async def drain(worker: AsyncWorker):
+    while r.scard(worker.pending_queue):
+        await worker.run()
+    await worker.shutdown()
+
+
+def test_async_worker_runs_coroutines_concurrently():
+    r.flushall()
+
+    for base in range(50):
+        r.sadd('nuts|jobs|pending', json.dumps(['AsyncJob', {'base': base, 'delay': 0.2}]))
+
+    worker = AsyncWorker(redis=AsyncRedis(), jobs=[async_job], concurrency=50)
+
+    start = time.monotonic()
+    asyncio.run(drain(worker))
+
+    # 50 jobs sleeping 0.2s each only finish this quickly if they were in flight together
+    assert time.monotonic() - start < 5
+    # Leadership is handed back on shutdown
+    assert not worker.is_leader
+    assert not r.exists('leader_id')
+    assert r.hlen(worker.running_queue) == 0
+    assert len(worker.in_flight) == 0
+
+
+def test_async_worker_runs_sync_jobs():
+    r.flushall()
+
+    r.sadd('nuts|jobs|pending', json.dumps(['AddOne', {'base': 1}]))
+
+    worker = AsyncWorker(redis=AsyncRedis(), jobs=[add_one])
+    asyncio.run(drain(worker))
+
+    assert r.scard(worker.pending_queue) == 0
+    assert r.hlen(worker.running_queue) == 0
+
+
+def test_async_run_forever_drains_on_stop():
+    r.flushall()
+    for base in range(5):
+        r.sadd('nuts|jobs|pending', json.dumps(['AsyncJob', {'base': base, 'delay': 0.2}]))
+
+    worker = AsyncWorker(redis=AsyncRedis(), jobs=[async_job], concurrency=5)
+
+    async def main():
+        task = asyncio.create_task(worker.run_forever(idle_min=0.01, idle_max=0.05, drain_timeout=5))
+        while r.scard(worker.pending_queue):
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await task
+
+    asyncio.run(main())
+
+    # The jobs in flight when the worker was stopped were finished, not dropped
+    assert r.hlen(worker.running_queue) == 0
+    assert len(worker.in_flight) == 0
+    assert not worker.is_leader
@@ -0,0 +1,44 @@
+import os
+from ..nuts.blobs import FileBlobStore
+from ..nuts.codecs import decode_payload
+from ..nuts.queue import WorkQueue
+from ..nuts.worker import Worker
+from redis import Redis
+from .fixtures.jobs import add_one, sleep_job
+
+r = Redis()
+
+
+def test_large_params_are_offloaded(tmp_path):
+    r.flushall()
+    store = FileBlobStore(str(tmp_path))
+    wq = WorkQueue(r, codec='msgpack', blob_store=store, offload_min_bytes=1000)
+    worker = Worker(redis=r, jobs=[add_one, sleep_job], blob_store=store)
+
+    # Small params stay in the payload
+    wq.publish('AddOne', {'base': 1})
+    assert os.listdir(tmp_path) == []
+    worker.execute_job(*worker.claim())
+
+    # Large ones are replaced by a reference, and the blob is gone once the job has run
+    r.delete(worker.pending_queue)
+    job_id = wq.publish('SleepJob', {'base': 'x' * 5000}, keep_result=True)
+    [payload] = r.smembers(wq.pending_queue)
+    assert len(payload) < 200
+    [ref] = os.listdir(tmp_path)
+    assert decode_payload(payload)[2]['blob'] == ref
+
+    worker.execute_job(*worker.claim())
+    assert wq.get_result(job_id)['result'] == {'base': 'x' * 5000}
+    assert os.listdir(tmp_path) == []
+
+    # Cancelled jobs and duplicates don't leave blobs behind
+    r.delete(worker.pending_queue)
+    wq.publish('SleepJob', {'base': 'y' * 5000}, dedupe_key='big')
+    assert not wq.publish('SleepJob', {'base': 'z' * 5000}, dedupe_key='big')
+    assert len(os.listdir(tmp_path)) == 1
+    r.sadd(worker.cancel_queue, 'SleepJob')
+    assert worker.claim() is None
+    assert os.listdir(tmp_path) == []
+
+    worker.shutdown(None, None)
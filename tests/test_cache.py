@@ -0,0 +1,66 @@
+import json
+import time
+from ..nuts.cache import LocalCache, index_key
+from ..nuts.worker import Worker
+from redis import Redis
+from .fixtures.jobs import add_one, cached_job
+
+r = Redis()
+
+
+def run_cached(worker: Worker, params: dict):
+    # Leave out the AddOne jobs chained by earlier runs
+    r.delete(worker.pending_queue)
+    r.sadd(worker.pending_queue, json.dumps(['CachedJob', params]))
+    worker.execute_job(*worker.claim())
+
+
+def test_cached_result_skips_run():
+    r.flushall()
+    cached_job.Job.runs = 0
+    worker = Worker(redis=r, jobs=[add_one, cached_job], result_cache_size=10)
+    other = Worker(redis=r, jobs=[add_one, cached_job])
+
+    run_cached(worker, {'a': 1, 'b': 2})
+
+    # Same arguments in another order, from this worker's LRU and from Redis on a worker without one
+    run_cached(worker, {'b': 2, 'a': 1})
+    assert r.spop(worker.pending_queue) == json.dumps(['AddOne', {'base': 3}], sort_keys=True).encode()
+    run_cached(other, {'a': 1, 'b': 2})
+    assert r.spop(worker.pending_queue) == json.dumps(['AddOne', {'base': 3}], sort_keys=True).encode()
+
+    assert cached_job.Job.runs == 1
+
+    worker.shutdown(None, None)
+    other.shutdown(None, None)
+
+
+def test_cache_evicts_least_recently_used():
+    r.flushall()
+    cached_job.Job.runs = 0
+    worker = Worker(redis=r, jobs=[add_one, cached_job])
+
+    for a in range(3):
+        run_cached(worker, {'a': a})
+
+    # The job keeps two results, the oldest was evicted and runs again
+    assert r.zcard(index_key('CachedJob')) == 2
+    run_cached(worker, {'a': 0})
+    assert cached_job.Job.runs == 4
+
+    worker.shutdown(None, None)
+
+
+def test_local_cache():
+    cache = LocalCache(2)
+    cache.put('a', '1', 60)
+    cache.put('b', '2', 60)
+    cache.get('a')
+    cache.put('c', '3', 60)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+
+    cache.put('d', '4', 0.01)
+    time.sleep(0.02)
+    assert cache.get('d') is None
@@ -0,0 +1,57 @@
+import json
+import pytest
+from ..nuts.codecs import PayloadCodec, decode_payload
+from ..nuts.priority import lane_key
+from ..nuts.queue import WorkQueue
+from ..nuts.worker import Worker
+from redis import Redis
+from .fixtures.jobs import add_one, sleep_job
+
+r = Redis()
+
+
+def test_codecs_round_trip():
+    params = {'base': 1, 'tags': ['a', 'b'], 'nested': {'x': None}}
+    for codec in ('json', 'orjson', 'msgpack'):
+        payload = PayloadCodec(codec).encode('AddOne', params, {'priority': 'high'})
+        assert decode_payload(payload) == ['AddOne', params, {'priority': 'high'}]
+
+    # JSON stays plain, so payloads from before codecs and from producers without one read the same
+    assert PayloadCodec().encode('AddOne', [1], {}) == json.dumps(['AddOne', [1]])
+    assert decode_payload(json.dumps(['AddOne', [1]]).encode()) == ['AddOne', [1]]
+
+    with pytest.raises(ValueError):
+        PayloadCodec('pickle')
+
+
+def test_compression():
+    codec = PayloadCodec('json', 'lz4', compress_min_bytes=100)
+
+    # Small params aren't worth compressing
+    assert isinstance(codec.encode('SleepJob', {'base': 'x'}, {}), str)
+
+    payload = codec.encode('SleepJob', {'base': 'x' * 10000}, {'id': '1'})
+    assert len(payload) < 1000
+    assert decode_payload(payload) == ['SleepJob', {'base': 'x' * 10000}, {'id': '1'}]
+    assert decode_payload(payload, params=False) == ['SleepJob', None, {'id': '1'}]
+
+
+def test_encoded_jobs_run():
+    r.flushall()
+    wq = WorkQueue(r, codec='msgpack', compression='lz4', compress_min_bytes=100)
+    worker = Worker(redis=r, jobs=[add_one, sleep_job], codec='msgpack')
+
+    # The claim scripts read the priority and dedupe key from the header, the worker decodes the params
+    job_id = wq.publish('SleepJob', {'base': 1, 'pad': 'x' * 1000}, priority='high', dedupe_key='big', keep_result=True)
+    assert r.scard(lane_key(wq.pending_queue, 'high')) == 1
+
+    worker.execute_job(*worker.claim())
+    assert wq.get_result(job_id)['result'] == {'base': 1}
+    assert not r.exists('nuts|dedupe|big')
+
+    # The next job in the chain is encoded with the worker's codec, in the same lane
+    [next_job] = r.smembers(lane_key(wq.pending_queue, 'high'))
+    assert next_job[1:2] == b'm'
+    assert decode_payload(next_job) == ['AddOne', {'base': 1}, {'priority': 'high'}]
+
+    worker.shutdown(None, None)
@@ -0,0 +1,62 @@
+import logging
+import time
+from redis import Redis
+from redis.exceptions import ConnectionError, TimeoutError
+from ..nuts.connection import CircuitBreaker, connect
+from ..nuts.worker import Worker
+from .fixtures.jobs import add_one
+
+r = Redis()
+
+
+def lost_connection(*args, **kwargs):
+    raise ConnectionError('Connection refused')
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=3, backoff_base=1, backoff_cap=8)
+
+    # Backoff grows with every failure, with jitter, up to the cap
+    delays = [breaker.failure() for _ in range(6)]
+    assert 0.5 <= delays[0] <= 1
+    assert 4 <= delays[-1] <= 8
+    assert breaker.is_open
+
+    assert breaker.success() is not None
+    assert not breaker.is_open and breaker.failures == 0
+    assert breaker.success() is None
+
+
+def test_worker_parks_while_redis_is_down(monkeypatch, caplog):
+    r.flushall()
+    worker = Worker(redis=r, jobs=[add_one], circuit_breaker=CircuitBreaker(failure_threshold=2, backoff_base=0.01, backoff_cap=0.02))
+    caplog.set_level(logging.INFO, logger=worker.logger.name)
+
+    # Failed round trips back off instead of spinning, and the outage is logged once, not per attempt
+    monkeypatch.setattr(worker, 'claim', lost_connection)
+    monkeypatch.setattr(r, 'ping', lost_connection)
+    start = time.monotonic()
+    for _ in range(10):
+        worker.run()
+    assert time.monotonic() - start >= 0.05
+    assert worker.breaker.is_open
+    assert len(caplog.records) == 2
+
+    # Once Redis answers the probe the worker picks jobs up again
+    monkeypatch.undo()
+    r.sadd(worker.pending_queue, '["AddOne", {"base": 1}]')
+    worker.run()
+    assert not worker.breaker.is_open
+    assert 'reachable again' in caplog.records[2].message
+    assert r.scard(worker.pending_queue) == 0
+
+    worker.shutdown(None, None)
+
+
+def test_connect():
+    client = connect('redis://localhost:6379/0')
+    assert client.ping()
+    assert client.connection_pool.connection_kwargs['retry'] is not None
+    # A script that timed out may have run, so it isn't sent again
+    assert TimeoutError not in client.connection_pool.connection_kwargs['retry_on_error']
+    client.close()
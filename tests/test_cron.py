@@ -1,5 +1,6 @@
 import datetime
-from ..nuts.cron import Cron
+import pytest
+from ..nuts.cron import Cron, CronExpression, parse_expression
 
 cron = Cron()
 
@@ -311,3 +312,67 @@ def test_parse_day_of_week_no_value_attribute_error():
     res = cron.parse_day_of_week('1/2', now)
     assert isinstance(res[0], int)
     assert isinstance(res[1], bool)
+
+
+def test_compiled_expression():
+    # Compiled once per expression string
+    assert parse_expression('*/10 5 * * * ? *') is parse_expression('*/10 5 * * * ? *')
+    assert parse_expression('*/10 5 * * * ? *').seconds == (0, 10, 20, 30, 40, 50)
+
+    # Fields below one that moves on start over from their first value
+    now = datetime.datetime(2025, 1, 9, 10, 3, 25)
+    assert cron.get_next_execution('*/10 5 * * * ? *', now) == datetime.datetime(2025, 1, 9, 10, 5, 0, tzinfo=datetime.timezone.utc)
+
+    # Months without the day are skipped
+    now = datetime.datetime(2025, 1, 31, 12, 0, 0)
+    assert cron.get_next_execution('0 0 0 ? * 31 *', now) == datetime.datetime(2025, 3, 31, tzinfo=datetime.timezone.utc)
+
+    # Every Monday, across a year boundary
+    now = datetime.datetime(2025, 12, 30, 0, 0, 0)
+    assert cron.get_next_execution('0 30 9 0 * ? *', now) == datetime.datetime(2026, 1, 5, 9, 30, tzinfo=datetime.timezone.utc)
+
+    # Aware datetimes are converted to UTC
+    now = datetime.datetime(2025, 1, 9, 10, 0, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    assert cron.get_next_execution('0 0 9 * * ? *', now) == datetime.datetime(2025, 1, 9, 9, tzinfo=datetime.timezone.utc)
+
+    with pytest.raises(Exception, match='never fires'):
+        CronExpression('0 0 0 ? 2 30 *').next_after(now)
+    with pytest.raises(Exception, match='between 0 and 59'):
+        CronExpression('75 * * * * ? *')
+
+
+def test_iter_executions():
+    start = datetime.datetime(2025, 1, 9, 23, 59, 50)
+    times = cron.iter_executions('*/5 * * * * ? *', start, datetime.datetime(2025, 1, 10, 0, 0, 10))
+    assert [t.strftime('%d %H:%M:%S') for t in times] == ['09 23:59:55', '10 00:00:00', '10 00:00:05', '10 00:00:10']
+
+    # Without an end the iterator is lazy and unbounded
+    times = cron.iter_executions('0 0 0 0 * ? *', start)
+    assert [next(times).day for _ in range(3)] == [13, 20, 27]
+
+
+def test_previous_execution():
+    now = datetime.datetime(2025, 1, 10, 0, 0, 0)
+    assert cron.previous_execution('0 30 9 0 * ? *', now) == datetime.datetime(2025, 1, 6, 9, 30, tzinfo=datetime.timezone.utc)
+    assert cron.previous_execution('*/5 * * * * ? *', now) == datetime.datetime(2025, 1, 9, 23, 59, 55, tzinfo=datetime.timezone.utc)
+    assert cron.previous_execution('0 0 0 ? * 31 *', datetime.datetime(2025, 3, 15)) == datetime.datetime(2025, 1, 31, tzinfo=datetime.timezone.utc)
+
+    # Schedules that haven't started yet haven't fired
+    assert cron.previous_execution('0 0 0 * * ? 2030', now) is None
+
+
+def test_is_execution():
+    monday = datetime.datetime(2025, 1, 6, 9, 30, tzinfo=datetime.timezone.utc).timestamp()
+    assert cron.is_execution('0 30 9 0 * ? *', monday)
+    assert not cron.is_execution('0 30 9 0 * ? *', monday + 60)
+    assert not cron.is_execution('0 30 9 1 * ? *', monday)
+
+
+def test_next_executions():
+    now = datetime.datetime(2025, 1, 9, 10, 3, 25)
+    schedules = ['0 */5 * * * ? *', '0 0 0 * * ? *'] * 1000
+
+    timestamps = cron.next_executions(schedules, now)
+    assert len(timestamps) == 2000
+    assert timestamps[:2] == [cron.get_next_execution(s, now).timestamp() for s in schedules[:2]]
+    assert set(timestamps) == set(timestamps[:2])
@@ -0,0 +1,138 @@
+import time
+from ..nuts.leader import FENCING_TOKEN_KEY, LEADER_KEY, LeaderLease, SchedulerWrites
+from ..nuts.worker import Worker
+from redis import Redis
+from .fixtures.jobs import add_one
+
+r = Redis()
+
+
+def test_lease_renews_for_holder():
+    r.flushall()
+    leader = LeaderLease(r, 'worker-a', ttl=5)
+    follower = LeaderLease(r, 'worker-b', ttl=5)
+
+    assert leader.acquire()
+    token = leader.token
+
+    # The holder recognizes itself and keeps its token, everyone else is turned away
+    assert leader.acquire()
+    assert leader.token == token
+    assert not follower.acquire()
+    assert r.pttl(LEADER_KEY) > 4000
+
+
+def test_release_only_drops_own_lease():
+    r.flushall()
+    leader = LeaderLease(r, 'worker-a')
+    follower = LeaderLease(r, 'worker-b')
+
+    leader.acquire()
+    follower.release()
+    assert r.get(LEADER_KEY) == b'worker-a'
+
+    leader.release()
+    assert not r.exists(LEADER_KEY)
+    assert follower.acquire()
+    assert follower.token > 1
+
+
+def test_holder_starts_new_term_without_token():
+    r.flushall()
+    leader = LeaderLease(r, 'worker-a')
+
+    leader.acquire()
+    r.delete(FENCING_TOKEN_KEY)
+
+    # The holder can't renew a token that is gone, so it takes the next one rather than stepping down
+    assert leader.acquire()
+    assert int(r.get(FENCING_TOKEN_KEY)) == leader.token
+
+
+def test_stale_leader_writes_are_fenced():
+    r.flushall()
+    stale = LeaderLease(r, 'worker-a')
+    current = LeaderLease(r, 'worker-b')
+
+    stale.acquire()
+    # The stale leader's lease runs out and another worker takes over
+    r.delete(LEADER_KEY)
+    current.acquire()
+    assert current.token > stale.token
+
+    writes = SchedulerWrites()
+    writes.sadd('nuts|jobs|pending', '["AddOne", {}]')
+    writes.zadd('nuts|jobs|scheduled', {'ScheduledJob': 1700000000.5})
+
+    assert not stale.commit(writes)
+    assert not r.exists('nuts|jobs|pending')
+
+    assert current.commit(writes)
+    assert r.scard('nuts|jobs|pending') == 1
+    assert r.zscore('nuts|jobs|scheduled', 'ScheduledJob') == 1700000000.5
+
+
+def test_bulk_zadd_is_chunked():
+    r.flushall()
+    lease = LeaderLease(r, 'worker-a')
+    lease.acquire()
+
+    # Thousands of schedules go out as a few variadic ZADDs
+    writes = SchedulerWrites()
+    writes.zadd('nuts|jobs|scheduled', {f'Sync{i}': 1700000000 + i for i in range(2500)})
+    assert len(writes) == 3
+
+    assert lease.commit(writes)
+    assert r.zcard('nuts|jobs|scheduled') == 2500
+    assert r.zscore('nuts|jobs|scheduled', 'Sync2499') == 1700002499
+
+
+def test_promote_skips_entries_rescheduled_since_read():
+    r.flushall()
+    lease = LeaderLease(r, 'worker-a')
+    lease.acquire()
+    r.zadd('nuts|jobs|scheduled', {'Sync': 1700000000.25, 'Report': 1700000000.5, 'Later': 1700000100})
+
+    writes = SchedulerWrites()
+    for member, score in (('Sync', 1700000000.25), ('Report', 1700000000)):
+        writes.guard('nuts|jobs|scheduled', member, score)
+        writes.zrem('nuts|jobs|scheduled', member)
+        writes.sadd('nuts|jobs|pending', member)
+
+    # Report was read before it moved, so only Sync goes, and Report is still due
+    assert lease.promote(writes, 1700000050) == (1, [b'Sync'])
+    assert r.smembers('nuts|jobs|pending') == {b'Sync'}
+    assert r.zrange('nuts|jobs|scheduled', 0, -1) == [b'Report', b'Later']
+
+
+def test_follower_takes_over_dead_leader():
+    r.flushall()
+    leader = Worker(redis=r, jobs=[add_one], lease_ttl=0.3)
+    follower = Worker(redis=r, jobs=[add_one], lease_ttl=0.3)
+
+    assert leader.is_leader
+    assert not follower.is_leader
+
+    # Stop renewing, as if the leader had died
+    leader.stopped.set()
+
+    deadline = time.monotonic() + 2
+    while not follower.is_leader and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert follower.is_leader
+    follower.shutdown(None, None)
+
+
+def test_follower_enqueues_jobs():
+    r.flushall()
+    leader = Worker(redis=r, jobs=[add_one])
+    follower = Worker(redis=r, jobs=[add_one])
+
+    # Plain enqueues aren't scheduler writes, they don't need the lease
+    follower.schedule_pending_job('AddOne', {'base': 1})
+    assert r.scard(follower.pending_queue) == 1
+    assert follower.lease.token == 0
+
+    leader.shutdown(None, None)
+    follower.shutdown(None, None)
@@ -0,0 +1,87 @@
+import json
+import time
+import pytest
+from ..nuts.limits import SLOT_TTL, concurrency_key, parse_rate
+from ..nuts.worker import Worker
+from redis import Redis
+from .fixtures.jobs import add_one, limited_job
+
+r = Redis()
+
+
+def test_parse_rate():
+    assert parse_rate('100/minute') == (100, 60000)
+    assert parse_rate('5 / seconds') == (5, 1000)
+
+    with pytest.raises(ValueError):
+        parse_rate('fast')
+
+
+def test_concurrency_cap_defers_job():
+    r.flushall()
+    first = Worker(redis=r, jobs=[add_one, limited_job])
+    second = Worker(redis=r, jobs=[add_one, limited_job])
+
+    for base in range(2):
+        first.schedule_pending_job('LimitedJob', {'base': base})
+
+    data, running_field = first.claim()
+    assert r.zcard(concurrency_key('LimitedJob')) == 1
+
+    # The cluster wide slot is taken, so the other worker defers its copy instead of running it
+    assert second.claim() is None
+    assert r.zcard(second.deferred_queue) == 1
+    assert r.hlen(second.running_queue) == 1
+
+    first.finish(data, running_field)
+    assert r.zcard(concurrency_key('LimitedJob')) == 0
+
+    # Once it is due the leader puts the deferred job back in the pending queue
+    r.zadd(first.deferred_queue, {r.zrange(first.deferred_queue, 0, 0)[0]: 1})
+    first.move_scheduled_to_pending()
+    assert r.zcard(first.deferred_queue) == 0
+    assert r.scard(first.pending_queue) == 1
+
+    first.shutdown(None, None)
+    second.shutdown(None, None)
+
+
+def test_rate_limit_defers_until_next_window():
+    r.flushall()
+    limited_worker = Worker(redis=r, jobs=[limited_job])
+
+    for base in range(2):
+        limited_worker.schedule_pending_job('LimitedJob', {'base': base})
+        limited_worker.execute_job(*limited_worker.claim())
+
+    # Two runs an hour, the third waits for the start of the next hour
+    limited_worker.schedule_pending_job('LimitedJob', {'base': 2})
+    assert limited_worker.claim() is None
+    [(data, retry_at)] = r.zrange(limited_worker.deferred_queue, 0, -1, withscores=True)
+    assert json.loads(data)[0] == 'LimitedJob'
+    assert retry_at % 3600 == 0
+
+    limited_worker.shutdown(None, None)
+
+
+def test_stale_concurrency_slot_is_freed():
+    r.flushall()
+    limited_worker = Worker(redis=r, jobs=[limited_job])
+
+    # A worker that died mid-run leaves its slot behind, it stops counting once it is older than SLOT_TTL
+    r.zadd(concurrency_key('LimitedJob'), {'LimitedJob|dead': (time.time() - SLOT_TTL - 1) * 1000})
+    limited_worker.schedule_pending_job('LimitedJob', {'base': 1})
+
+    data, running_field = limited_worker.claim()
+    assert r.zrange(concurrency_key('LimitedJob'), 0, -1) == [running_field.encode()]
+
+    # Running slots are refreshed along with the lease so long jobs keep theirs
+    r.zadd(concurrency_key('LimitedJob'), {running_field: 0})
+    limited_worker.refresh_slots()
+    assert r.zscore(concurrency_key('LimitedJob'), running_field) > (time.time() - SLOT_TTL) * 1000
+
+    limited_worker.finish(data, running_field)
+    limited_worker.refresh_slots()
+    assert r.zcard(concurrency_key('LimitedJob')) == 0
+
+    limited_worker.shutdown(None, None)
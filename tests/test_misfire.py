@@ -0,0 +1,38 @@
+import datetime
+from ..nuts.misfire import due_runs
+
+# Every minute, on the minute
+SCHEDULE = '0 * * * * ? *'
+NOW = datetime.datetime(2025, 1, 6, 12, 0, 30, tzinfo=datetime.timezone.utc)
+AN_HOUR_AGO = datetime.datetime(2025, 1, 6, 11, 0, tzinfo=datetime.timezone.utc).timestamp()
+
+
+def test_coalesce_runs_once():
+    assert due_runs(SCHEDULE, 'coalesce', AN_HOUR_AGO, NOW) == ([AN_HOUR_AGO], None)
+
+
+def test_all_runs_every_missed_run():
+    runs, resume = due_runs(SCHEDULE, 'all', AN_HOUR_AGO, NOW)
+
+    assert len(runs) == 61
+    assert runs[1] - runs[0] == 60
+    assert resume is None
+
+
+def test_all_leaves_runs_over_the_limit_for_later():
+    runs, resume = due_runs(SCHEDULE, 'all', AN_HOUR_AGO, NOW, limit=10)
+
+    assert len(runs) == 10
+    assert resume == AN_HOUR_AGO + 600
+
+
+def test_skip_only_runs_on_time():
+    on_time = NOW.timestamp() - 1
+
+    assert due_runs(SCHEDULE, 'skip', on_time, NOW) == ([on_time], None)
+    assert due_runs(SCHEDULE, 'skip', AN_HOUR_AGO, NOW) == ([], NOW.timestamp() + 30)
+
+
+def test_grace():
+    assert due_runs(SCHEDULE, 'grace', AN_HOUR_AGO, NOW, grace=7200) == ([AN_HOUR_AGO], None)
+    assert due_runs(SCHEDULE, 'grace', AN_HOUR_AGO, NOW, grace=60) == ([], NOW.timestamp() + 30)
@@ -1,5 +1,12 @@
+import datetime
+import json
+import pytest
 from redis import Redis
 from ..nuts.queue import WorkQueue
+from ..nuts.dedupe import DEDUPE_HOLD
+from ..nuts.api import queries
+from ..nuts.worker import Worker
+from .fixtures.jobs import add_one
 
 r = Redis()
 
@@ -12,3 +19,146 @@ def test_queue():
     wq.publish('TestQueuJob', {})
 
     assert 1 == r.scard(wq.pending_queue)
+
+
+def test_fifo_queue():
+    r.flushall()
+
+    wq = WorkQueue(r, fifo=True)
+
+    wq.publish('TestQueueJob', {'a': 1})
+    wq.publish('TestQueueJob', {'a': 1})
+    wq.publish('OtherJob', {})
+
+    # Identical payloads are kept and order is preserved
+    assert 3 == r.llen(wq.fifo_queue)
+    assert b'OtherJob' in r.lindex(wq.fifo_queue, -1)
+
+
+def test_priority_queue():
+    r.flushall()
+
+    wq = WorkQueue(r)
+
+    wq.publish('TestQueueJob', {}, priority='high')
+    wq.publish('TestQueueJob', {'a': 1})
+
+    assert 1 == r.scard(f'{wq.pending_queue}|high')
+    assert 1 == r.scard(wq.pending_queue)
+
+
+def test_pending_jobs_by_priority():
+    r.flushall()
+
+    queries.enqueue_job(r, 'Backfill', [1], priority='low')
+    queries.enqueue_job(r, 'Backfill', [2], fifo=True, priority='low')
+    queries.enqueue_job(r, 'UserJob', [], priority='high')
+
+    depths = {d.priority: d.pending for d in queries.get_queue_depth(r)}
+    assert depths == {'high': 1, 'default': 0, 'low': 2}
+    assert [(j.name, j.priority) for j in queries.get_pending_jobs(r)] == [('UserJob', 'high'), ('Backfill', 'low'), ('Backfill', 'low')]
+
+    assert queries.cancel_pending_job(r, 'Backfill', [2])
+    assert r.llen('nuts|jobs|queue|low') == 0
+    assert json.loads(r.spop('nuts|jobs|pending|low')) == ['Backfill', [1], {'priority': 'low'}]
+
+
+def test_dedupe_key():
+    r.flushall()
+
+    wq = WorkQueue(r)
+    worker = Worker(redis=r, jobs=[add_one])
+
+    assert wq.publish('AddOne', {'base': 1}, dedupe_key='hook-1', dedupe_ttl=60)
+    assert not wq.publish('AddOne', {'base': 1}, dedupe_key='hook-1', dedupe_ttl=60)
+    assert 1 == r.scard(wq.pending_queue)
+    # A held key still expires in case its job is lost
+    assert 0 < r.ttl('nuts|dedupe|hook-1') <= DEDUPE_HOLD
+
+    # Still held for the window after the job has run
+    worker.execute_job(*worker.claim())
+    assert 0 < r.ttl('nuts|dedupe|hook-1') <= 60
+    assert not wq.publish('AddOne', {'base': 1}, dedupe_key='hook-1')
+
+    # Without a window the key is released as soon as the job is done, and a cancelled job releases it too
+    assert wq.publish('AddOne', {'base': 2}, dedupe_key='hook-2')
+    worker.execute_job(*worker.claim())
+    assert queries.enqueue_job(r, 'AddOne', [3], dedupe_key='hook-2')
+    r.sadd(worker.cancel_queue, 'AddOne')
+    assert worker.claim() is None
+    assert not r.exists('nuts|dedupe|hook-2')
+
+    worker.shutdown(None, None)
+
+
+def test_payload_is_canonical():
+    r.flushall()
+
+    wq = WorkQueue(r)
+    wq.publish('TestQueueJob', {'a': 1, 'b': 2})
+    wq.publish('TestQueueJob', {'b': 2, 'a': 1})
+
+    assert 1 == r.scard(wq.pending_queue)
+
+
+def test_publish_many():
+    r.flushall()
+
+    wq = WorkQueue(r, fifo=True)
+
+    # Generators are read a chunk at a time, each job gets its own outcome
+    jobs = (('TestQueueJob', {'a': i}) for i in range(25))
+    assert wq.publish_many(jobs, chunk_size=10) == [True] * 25
+    assert [json.loads(p)[1]['a'] for p in r.lrange(wq.fifo_queue, 0, -1)] == list(range(25))
+
+    outcomes = wq.publish_many([
+        {'job_name': 'TestQueueJob', 'job_parameters': {}, 'dedupe_key': 'once'},
+        {'job_name': 'TestQueueJob', 'job_parameters': {}, 'dedupe_key': 'once'},
+        {'job_name': 'TestQueueJob', 'job_parameters': {}, 'priority': 'urgent'},
+        {'job_name': 'TestQueueJob', 'job_parameters': {}, 'keep_result': True},
+    ])
+    assert outcomes[:3] == [True, False, False]
+    assert isinstance(outcomes[3], str)
+    assert 27 == r.llen(wq.fifo_queue)
+
+    results = queries.enqueue_jobs(r, [queries.JobEnqueueRequest(name='AddOne', params=[1], priority='high')])
+    assert results == [True]
+    assert 1 == r.scard(f'{wq.pending_queue}|high')
+
+
+def test_delayed_jobs():
+    r.flushall()
+
+    wq = WorkQueue(r)
+    worker = Worker(redis=r, jobs=[add_one])
+    worker.check_leader()
+
+    # Delayed runs of the same job keep their own arguments and don't replace each other
+    wq.publish_in(3600, 'AddOne', {'base': 1})
+    wq.publish_in(-1, 'AddOne', {'base': 1})
+    wq.publish_in(datetime.timedelta(seconds=-1), 'AddOne', {'base': 1})
+    wq.publish_at(datetime.datetime.now(datetime.timezone.utc), 'AddOne', {'base': 2}, priority='high')
+    assert 4 == r.zcard(wq.delayed_queue)
+    assert 0 == r.scard(wq.pending_queue)
+
+    # The leader moves them to their lane once they are due
+    worker.move_scheduled_to_pending()
+    assert 1 == r.zcard(wq.delayed_queue)
+    assert 2 == r.scard(wq.pending_queue)
+    assert 1 == r.scard(f'{wq.pending_queue}|high')
+    assert json.loads(worker.claim()[0])[1] == {'base': 2}
+
+    later = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+    assert queries.schedule_job(r, 'AddOne', later, [5])
+    delayed = queries.get_delayed_jobs(r)
+    assert [job.params for job in delayed] == [[], [5]]
+    assert delayed[1].run_at.timestamp() == pytest.approx(later.timestamp())
+
+    # Rescheduling a cron job moves its entry instead of adding a run
+    r.zadd(worker.scheduled_queue, {'ScheduledJob': later.timestamp()})
+    assert queries.reschedule_scheduled_job(r, 'ScheduledJob', later.replace(tzinfo=None) + datetime.timedelta(hours=1))
+    assert r.zscore(worker.scheduled_queue, 'ScheduledJob') == pytest.approx(later.timestamp() + 3600)
+    assert r.zcard(wq.delayed_queue) == 2
+    assert not queries.reschedule_scheduled_job(r, 'Unknown', later)
+
+    worker.shutdown(None, None)
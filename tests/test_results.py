@@ -0,0 +1,52 @@
+import os
+from ..nuts.api import queries
+from ..nuts.queue import WorkQueue
+from ..nuts.results import result_key
+from ..nuts.worker import Worker
+from redis import Redis
+from .fixtures.jobs import add_one, sleep_job
+
+r = Redis()
+
+
+def test_result_is_kept():
+    r.flushall()
+    wq = WorkQueue(r)
+    worker = Worker(redis=r, jobs=[add_one], result_ttl=60)
+
+    job_id = wq.publish('AddOne', {'base': 1}, keep_result=True)
+    assert wq.get_result(job_id) is None
+
+    worker.execute_job(*worker.claim())
+
+    result = wq.get_result(job_id)
+    assert result['name'] == 'AddOne'
+    assert result['success'] is True
+    assert result['result'] == 2
+    assert 0 < r.ttl(result_key(job_id)) <= 60
+    assert queries.get_job_result(r, job_id).result == 2
+
+    worker.shutdown(None, None)
+
+
+def test_large_results():
+    r.flushall()
+    wq = WorkQueue(r)
+    worker = Worker(redis=r, jobs=[sleep_job], result_max_bytes=4096)
+
+    # Large results are compressed
+    job_id = wq.publish('SleepJob', {'base': 'x' * 10000}, keep_result=True)
+    worker.execute_job(*worker.claim())
+    assert r.get(result_key(job_id))[:1] == b'z'
+    assert wq.get_result(job_id)['result'] == {'base': 'x' * 10000}
+
+    # Results that are still too large are dropped, the record says why
+    r.delete(worker.pending_queue)
+    job_id = wq.publish('SleepJob', {'base': os.urandom(10000).hex()}, keep_result=True)
+    worker.execute_job(*worker.claim())
+    result = wq.get_result(job_id)
+    assert result['success'] is True
+    assert result['result'] is None
+    assert 'byte limit' in result['error']
+
+    worker.shutdown(None, None)
@@ -0,0 +1,38 @@
+from redis import Redis
+from ..nuts.api import queries
+from ..nuts.queue import WorkQueue
+from ..nuts.shards import pick_shard, shard_keys
+from ..nuts.worker import Worker
+from .fixtures.jobs import add_one
+
+r = Redis()
+
+
+def test_sharded_queue():
+    r.flushall()
+    wq = WorkQueue(r, shards=4)
+    worker = Worker(redis=r, jobs=[add_one], shards=4)
+
+    for i in range(8):
+        wq.publish('AddOne', {'base': i})
+
+    # Jobs are dealt out evenly, the API sees them all
+    keys = shard_keys(wq.pending_queue, 4)
+    assert [r.scard(k) for k in keys] == [2, 2, 2, 2]
+    assert sum(d.pending for d in queries.get_queue_depth(r, shards=4)) == 8
+
+    # Jobs with the same dedupe key land on the same shard
+    wq.publish('AddOne', {'base': 8}, dedupe_key='a', dedupe_ttl=1)
+    assert r.scard(keys[pick_shard(4, None, 'a')]) == 3
+    queries.enqueue_job(r, 'AddOne', [], shards=4)
+    assert queries.cancel_pending_job(r, 'AddOne', shards=4)
+
+    # A worker drains every shard, not just the one it starts from
+    claimed = 0
+    while (job := worker.claim()) is not None:
+        worker.execute_job(*job)
+        claimed += 1
+    assert claimed == 9
+    assert all(r.scard(k) == 0 for k in keys)
+
+    worker.shutdown(None, None)
@@ -1,8 +1,12 @@
 import datetime
 from ..nuts.worker import Worker
+from ..nuts.results import decode_record, result_key
 from redis import Redis
-from .fixtures.jobs import add_one, scheduled_job
+from .fixtures.jobs import add_one, scheduled_job, process_job, sleep_job
 import json
+import os
+import threading
+import time
 
 jobs = [add_one, scheduled_job]
 r = Redis()
@@ -26,6 +30,8 @@ def test_worker():
 
 
 def test_scheduled_job():
+    # Workers in other test modules may have led since this one was created, which fences its old token
+    worker.check_leader()
     r.hset(worker.completed_queue, 'ScheduledJob', '{"status": "completed"}')
 
     worker.queue_completed_jobs()
@@ -45,3 +51,365 @@ def test_move_job_to_pending():
     assert len(pending_jobs) == 1
 
 
+def test_move_job_to_pending_leaves_jobs_not_due():
+    r.flushall()
+    now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+    r.zadd(worker.scheduled_queue, {'AddOne': now - 10, 'ScheduledJob': now + 60})
+
+    worker.move_scheduled_to_pending()
+
+    assert len(r.smembers(worker.pending_queue)) == 1
+    assert r.zrange(worker.scheduled_queue, 0, -1) == [b'ScheduledJob']
+
+
+def test_due_jobs_are_moved_in_batches():
+    r.flushall()
+    now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+    r.zadd(worker.scheduled_queue, {'AddOne': now - 30, 'ScheduledJob': now - 20, 'Retired': now - 10})
+
+    worker.misfire_batch = 2
+    try:
+        assert worker.move_scheduled_to_pending() == 1
+        assert r.zrange(worker.scheduled_queue, 0, -1) == [b'Retired']
+        assert worker.move_scheduled_to_pending() == 0
+    finally:
+        worker.misfire_batch = 100
+
+    assert len(r.smembers(worker.pending_queue)) == 3
+    assert r.zcard(worker.scheduled_queue) == 0
+
+
+def test_missed_runs_are_caught_up_in_batches():
+    r.flushall()
+    job = next(j for j in worker.jobs if j.name == 'ScheduledJob')
+    # ScheduledJob runs every minute, six runs are due from five minutes ago
+    now = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+    r.zadd(worker.scheduled_queue, {'ScheduledJob': (now - datetime.timedelta(minutes=5)).timestamp()})
+
+    job.misfire, worker.misfire_batch = 'all', 4
+    try:
+        worker.move_scheduled_to_pending()
+        assert len(r.smembers(worker.pending_queue)) == 4
+        assert r.zscore(worker.scheduled_queue, 'ScheduledJob') == (now - datetime.timedelta(minutes=1)).timestamp()
+
+        worker.move_scheduled_to_pending()
+        assert len(r.smembers(worker.pending_queue)) == 6
+        assert r.zscore(worker.scheduled_queue, 'ScheduledJob') is None
+    finally:
+        job.misfire, worker.misfire_batch = 'coalesce', 100
+
+
+def test_missed_run_is_skipped():
+    r.flushall()
+    job = next(j for j in worker.jobs if j.name == 'ScheduledJob')
+    now = datetime.datetime.now(datetime.timezone.utc)
+    r.zadd(worker.scheduled_queue, {'ScheduledJob': (now - datetime.timedelta(minutes=5)).timestamp()})
+
+    job.misfire = 'skip'
+    try:
+        worker.move_scheduled_to_pending()
+    finally:
+        job.misfire = 'coalesce'
+
+    assert len(r.smembers(worker.pending_queue)) == 0
+    assert r.zscore(worker.scheduled_queue, 'ScheduledJob') > now.timestamp()
+
+
+def test_new_leader_keeps_missed_runs():
+    r.flushall()
+    # Left by a leader that died five minutes ago, the next leader starts after it
+    now = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+    missed = (now - datetime.timedelta(minutes=5)).timestamp()
+    r.zadd(worker.scheduled_queue, {'ScheduledJob': missed})
+
+    # The missed run stays due, for the job's misfire policy to deal with
+    leader = Worker(redis=r, jobs=jobs)
+    assert r.zscore(worker.scheduled_queue, 'ScheduledJob') == missed
+    leader.shutdown(None, None)
+
+    # A run in the future that the schedule doesn't fire at was left by an older schedule, it is moved onto this one
+    r.flushall()
+    r.zadd(worker.scheduled_queue, {'ScheduledJob': (now + datetime.timedelta(minutes=5, seconds=30)).timestamp()})
+    leader = Worker(redis=r, jobs=jobs)
+    assert r.zscore(worker.scheduled_queue, 'ScheduledJob') % 60 == 0
+    leader.shutdown(None, None)
+
+
+def test_concurrent_worker():
+    r.flushall()
+    # FIFO so the chained AddOne jobs queue up behind the SleepJobs rather than being claimed in between
+    concurrent_worker = Worker(redis=r, jobs=[add_one, sleep_job], concurrency=4, fifo=True, block_timeout=0.1)
+
+    for base in range(8):
+        r.rpush(concurrent_worker.fifo_queue, json.dumps(['SleepJob', {'base': base, 'delay': 0.3}]))
+
+    start = time.monotonic()
+    while any(b'SleepJob' in p for p in r.lrange(concurrent_worker.fifo_queue, 0, -1)):
+        concurrent_worker.run()
+
+    concurrent_worker.shutdown(None, None)
+
+    # Eight 0.3s jobs only finish this quickly if four of them ran at a time
+    assert time.monotonic() - start < 1.5
+
+    # Every run chained its own result, so nothing leaked between the concurrent executions
+    chained = [json.loads(p) for p in r.lrange(concurrent_worker.fifo_queue, 0, -1)]
+    assert sorted(args['base'] for _, args in chained) == list(range(8))
+
+    # Each execution gets its own job instance, the registered job is left untouched
+    assert concurrent_worker.jobs[1].result is None
+    assert concurrent_worker.jobs[1].success is False
+    assert r.hlen(concurrent_worker.running_queue) == 0
+
+
+def test_process_job():
+    r.flushall()
+    # Unpicklable worker kwargs stay in the parent, only process_kwargs reach the child
+    process_worker = Worker(redis=r, jobs=[add_one, process_job], process_kwargs={'scale': 2}, connection=threading.Lock())
+
+    r.sadd(process_worker.pending_queue, json.dumps(['ProcessJob', {'upper': 10}]))
+
+    process_worker.run()
+    process_worker.shutdown(None, None)
+
+    # The result comes back from the child process and is chained on to the next job
+    [[job_name, job_args]] = [json.loads(p) for p in r.smembers(process_worker.pending_queue)]
+    assert job_name == 'AddOne'
+    assert job_args['base'] == 285
+    assert job_args['pid'] != os.getpid()
+    assert job_args['kwargs'] == ['scale']
+
+
+def test_fifo_worker():
+    r.flushall()
+    fifo_worker = Worker(redis=r, jobs=jobs, fifo=True, block_timeout=0.1)
+
+    for base in range(3):
+        r.rpush(fifo_worker.fifo_queue, json.dumps(['AddOne', {'base': base}]))
+
+    for _ in range(3):
+        fifo_worker.run()
+
+    assert r.llen(fifo_worker.fifo_queue) == 0
+    assert r.llen(fifo_worker.processing_queue) == 0
+
+    fifo_worker.shutdown(None, None)
+    assert not r.exists(fifo_worker.heartbeat_key)
+
+
+def test_fifo_blocking_claim_lands_in_processing_list():
+    r.flushall()
+    fifo_worker = Worker(redis=r, jobs=jobs, fifo=True, block_timeout=0.1)
+    # Lanes that are empty when claimed are waited on, a job that turns up is moved straight to the processing list
+    claim_script = fifo_worker.claim_script
+    fifo_worker.claim_script = lambda keys, args: [[], []]
+
+    r.rpush(fifo_worker.fifo_queue, json.dumps(['AddOne', {'base': 1}]), json.dumps(['ScheduledJob', {'base': 2}]))
+    r.sadd(fifo_worker.cancel_queue, 'ScheduledJob')
+
+    [(data, running_field)] = fifo_worker.fetch()
+    assert json.loads(data)[0] == 'AddOne'
+    assert r.lrange(fifo_worker.processing_queue, 0, -1) == [data]
+    assert r.hexists(fifo_worker.running_queue, running_field)
+
+    # A cancelled job doesn't keep its claim
+    assert fifo_worker.fetch() == []
+    assert r.lrange(fifo_worker.processing_queue, 0, -1) == [data]
+
+    # Other lanes aren't waited on, their jobs are claimed once the wait is over
+    fifo_worker.schedule_pending_job('AddOne', {'base': 3}, priority='high')
+    assert fifo_worker.fetch() == []
+    fifo_worker.claim_script = claim_script
+    assert len(fifo_worker.fetch()) == 1
+
+    fifo_worker.finish(data, running_field)
+    fifo_worker.shutdown(None, None)
+
+
+def test_fifo_recover_orphaned_jobs():
+    r.flushall()
+    fifo_worker = Worker(redis=r, jobs=jobs, fifo=True)
+
+    r.rpush(fifo_worker.fifo_queue, json.dumps(['AddOne', {'base': 3}]))
+    r.rpush('nuts|jobs|processing|dead-worker', json.dumps(['AddOne', {'base': 1}]), json.dumps(['AddOne', {'base': 2}]))
+
+    fifo_worker.recover_orphaned_jobs()
+
+    queued = [json.loads(j)[1]['base'] for j in r.lrange(fifo_worker.fifo_queue, 0, -1)]
+    assert queued == [1, 2, 3]
+    fifo_worker.shutdown(None, None)
+
+
+def test_recovery_settles_dedupe_keys():
+    r.flushall()
+    requeued = json.dumps(['AddOne', {'base': 1}, {'dedupe': 'requeued'}])
+    lost = json.dumps(['AddOne', {'base': 2}, {'dedupe': 'lost'}])
+    r.set('nuts|dedupe|requeued', requeued, ex=5)
+    r.set('nuts|dedupe|lost', lost, ex=5)
+    r.rpush('nuts|jobs|claimed|dead-worker', requeued)
+    r.hset(worker.running_queue, 'dead-worker|AddOne|1', json.dumps({'timestamp': '', 'payload': lost}))
+
+    worker.recover_orphaned_jobs()
+
+    # The requeued job holds its key until it runs, the one that only ran on the dead worker releases it
+    assert r.ttl('nuts|dedupe|requeued') > 5
+    assert not r.exists('nuts|dedupe|lost')
+    assert r.sismember(worker.pending_queue, requeued)
+
+
+def test_prefetch_worker():
+    r.flushall()
+    prefetch_worker = Worker(redis=r, jobs=jobs, prefetch=3)
+
+    for base in range(5):
+        r.sadd(prefetch_worker.pending_queue, json.dumps(['AddOne', {'base': base}]))
+
+    prefetch_worker.run()
+
+    # Three claimed in one go, one of them has run and the other two wait in the local buffer
+    assert r.scard(prefetch_worker.pending_queue) == 2
+    assert len(prefetch_worker.buffer) == 2
+    assert r.llen(prefetch_worker.processing_queue) == 2
+
+    # Buffered jobs are handed back on shutdown
+    prefetch_worker.shutdown(None, None)
+    assert r.scard(prefetch_worker.pending_queue) == 4
+    assert r.llen(prefetch_worker.processing_queue) == 0
+
+
+def test_prefetched_job_starts_when_dispatched():
+    r.flushall()
+    prefetch_worker = Worker(redis=r, jobs=jobs, prefetch=2)
+
+    for base in range(2):
+        r.sadd(prefetch_worker.pending_queue, json.dumps(['AddOne', {'base': base}]))
+
+    data, running_field = prefetch_worker.claim()
+
+    # Only the job handed out is marked running, the buffered one is just claimed
+    assert r.hkeys(prefetch_worker.running_queue) == [running_field.encode()]
+    assert len(prefetch_worker.buffer) == 1
+
+    # Cancelled while it waited in the buffer, so it is dropped instead of run
+    r.sadd(prefetch_worker.cancel_queue, 'AddOne')
+    prefetch_worker.finish(data, running_field)
+    assert prefetch_worker.claim() is None
+    assert r.hlen(prefetch_worker.running_queue) == 0
+    assert r.llen(prefetch_worker.processing_queue) == 0
+
+    prefetch_worker.shutdown(None, None)
+
+
+def test_cancelled_job_is_skipped():
+    r.flushall()
+    r.sadd(worker.pending_queue, json.dumps(['AddOne', {'base': 1}]))
+    r.sadd(worker.cancel_queue, 'AddOne')
+
+    worker.run()
+
+    assert r.scard(worker.pending_queue) == 0
+    assert not r.sismember(worker.cancel_queue, 'AddOne')
+    assert r.hlen(worker.running_queue) == 0
+
+
+def test_scheduled_job_completion_is_recorded():
+    r.flushall()
+    r.sadd(worker.pending_queue, json.dumps(['ScheduledJob', {'base': 1}]))
+
+    worker.execute_job(*worker.claim())
+
+    assert r.hlen(worker.running_queue) == 0
+    assert json.loads(r.hget(worker.completed_queue, 'ScheduledJob')) == {'success': True}
+
+
+def test_high_priority_jobs_run_first():
+    r.flushall()
+    lane_worker = Worker(redis=r, jobs=jobs + [sleep_job], prefetch=2)
+
+    for base in range(3):
+        lane_worker.schedule_pending_job('AddOne', {'base': base}, priority='low')
+    lane_worker.schedule_pending_job('SleepJob', {'base': 7}, priority='high')
+
+    data, running_field = lane_worker.claim()
+    assert json.loads(data)[0] == 'SleepJob'
+
+    # The job it chains to keeps its priority
+    lane_worker.execute_job(data, running_field)
+    assert r.smembers(f'{lane_worker.pending_queue}|high') == {json.dumps(['AddOne', {'base': 7}, {'priority': 'high'}]).encode()}
+
+    # Jobs still buffered go back to their own lane
+    lane_worker.shutdown(None, None)
+    assert r.scard(f'{lane_worker.pending_queue}|low') == 3
+    assert r.scard(lane_worker.pending_queue) == 0
+
+
+def test_weighted_priorities():
+    r.flushall()
+    lane_worker = Worker(redis=r, jobs=jobs, priority_weights={'high': 0, 'low': 1})
+
+    assert lane_worker.lane_order() == [f'{lane_worker.pending_queue}|low', f'{lane_worker.pending_queue}|high', lane_worker.pending_queue]
+
+
+def test_run_forever_backs_off_and_drains():
+    r.flushall()
+    worker = Worker(redis=r, jobs=[add_one, sleep_job], concurrency=2)
+    runs = []
+    run = worker.run
+    worker.run = lambda: runs.append(1) or run()
+
+    # Idle passes back off to idle_max instead of spinning
+    thread = threading.Thread(target=worker.run_forever, kwargs={'idle_min': 0.01, 'idle_max': 0.1, 'drain_timeout': 5})
+    thread.start()
+    time.sleep(0.5)
+    assert len(runs) < 15
+
+    # A job that is still running when the worker is stopped finishes before it shuts down
+    r.sadd(worker.pending_queue, json.dumps(['SleepJob', {'base': 1, 'delay': 0.3}, {'id': 'drained'}]))
+    while not r.hlen(worker.running_queue):
+        time.sleep(0.01)
+    worker.stop()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert not worker.is_leader
+    assert all(f.done() for f in worker.in_flight)
+    assert decode_record(r.get(result_key('drained')))['result'] == {'base': 1}
+
+
+
+def test_shutdown_keeps_claims_of_running_jobs():
+    r.flushall()
+    worker = Worker(redis=r, jobs=[add_one, sleep_job], concurrency=2, prefetch=3, fifo=True, block_timeout=0.01)
+    for base in range(3):
+        r.rpush(worker.fifo_queue, json.dumps(['SleepJob', {'base': base, 'delay': 0.3}]))
+
+    worker.run()
+    assert len(worker.buffer) == 2
+
+    # The job still running after the drain timeout keeps its claim, only the prefetched ones are handed back
+    worker.shutdown(None, None, drain_timeout=0.01)
+    assert [json.loads(j)[1]['base'] for j in r.lrange(worker.fifo_queue, 0, -1)] == [1, 2]
+    assert [json.loads(j)[1]['base'] for j in r.lrange(worker.processing_queue, 0, -1)] == [0]
+    assert r.hlen(worker.running_queue) == 1
+    assert r.exists(worker.heartbeat_key)
+
+    deadline = time.monotonic() + 2
+    while r.llen(worker.processing_queue) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert r.hlen(worker.running_queue) == 0
+
+
+def test_fifo_run_forever_backs_off():
+    r.flushall()
+    worker = Worker(redis=r, jobs=jobs, fifo=True, block_timeout=0.01)
+    runs = []
+    run = worker.run
+    worker.run = lambda: runs.append(1) or run()
+
+    thread = threading.Thread(target=worker.run_forever, kwargs={'idle_min': 0.01, 'idle_max': 0.1})
+    thread.start()
+    time.sleep(0.5)
+    worker.stop()
+    thread.join(timeout=5)
+
+    assert len(runs) < 15
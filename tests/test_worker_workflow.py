@@ -125,6 +125,67 @@ def test_workflow_failure_stops_execution():
         shutil.rmtree(tmpdir)
 
 
+def test_new_leader_schedules_workflows():
+    """Test a worker that takes over leadership schedules workflows it loaded as a follower."""
+    tmpdir, _ = create_test_workflow_file()
+
+    try:
+        r.flushall()
+        jobs = [add_one, scheduled_job]
+        leader = Worker(redis=r, jobs=jobs, workflow_directory=tmpdir)
+        follower = Worker(redis=r, jobs=jobs, workflow_directory=tmpdir)
+
+        assert any(wf.name == 'test-integration-workflow' for wf in follower.workflows)
+
+        leader.shutdown(None, None)
+        r.delete(follower.scheduled_workflow_queue)
+
+        assert follower.check_leader()
+        assert r.zscore(follower.scheduled_workflow_queue, 'test-integration-workflow') is not None
+
+        # A run that is already due is kept for the misfire policy rather than pushed back by the new leader
+        follower.release_leader()
+        r.zadd(follower.scheduled_workflow_queue, {'test-integration-workflow': 1})
+        assert follower.check_leader()
+        assert r.zscore(follower.scheduled_workflow_queue, 'test-integration-workflow') == 1
+
+        # Becoming due activates the workflow instead of losing it
+        r.zadd(follower.scheduled_workflow_queue, {'test-integration-workflow': 1})
+        follower.move_scheduled_workflows_to_running()
+        assert follower.workflows[0].status == 'active'
+        follower.shutdown(None, None)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_new_leader_resumes_active_workflows():
+    """Test a workflow that was active when its leader stepped down carries on under the next one."""
+    tmpdir, _ = create_test_workflow_file()
+
+    try:
+        r.flushall()
+        jobs = [add_one, scheduled_job]
+        leader = Worker(redis=r, jobs=jobs, workflow_directory=tmpdir)
+        follower = Worker(redis=r, jobs=jobs, workflow_directory=tmpdir)
+
+        wf = leader.workflows[0]
+        wf.status = 'active'
+        wf.update('AddOne', 'completed')
+        leader.shutdown(None, None)
+
+        assert follower.check_leader()
+        assert follower.workflows[0].status == 'active'
+        assert r.hlen(follower.running_workflow_queue) == 0
+
+        # The next step is the one after where the old leader stopped
+        follower.run_workflows()
+        pending_jobs = r.smembers(follower.pending_queue)
+        assert [json.loads(p)[0] for p in pending_jobs] == ['workflow-test-integration-workflow|ScheduledJob']
+        follower.shutdown(None, None)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 def test_worker_without_workflow_directory():
     """Test worker works without workflow_directory (backwards compatibility)."""
     r.flushall()
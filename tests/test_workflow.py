@@ -191,6 +191,22 @@ def test_workflow_validation_missing_dependency():
     assert 'nonexistent' in error
 
 
+def test_workflow_validation_misfire_policy():
+    """Test workflow validation catches unknown misfire policies."""
+    wf = NutsWorkflow(
+        name='test-workflow',
+        schedule='0 0 * * * ? *',
+        misfire='sometimes',
+        jobs=[
+            {'name': 'job1', 'requires': None}
+        ]
+    )
+
+    is_valid, error = wf.validate()
+    assert not is_valid
+    assert 'misfire' in error
+
+
 def test_workflow_validation_no_root_jobs():
     """Test workflow validation catches workflows with no root jobs."""
     wf = NutsWorkflow(
@@ -10,6 +10,7 @@ import { RescheduleForm } from "@/components/reschedule-form";
 import {
   getAllJobs,
   scheduleJob,
+  rescheduleScheduledJob,
   cancelPendingJob,
   cancelScheduledJob,
   requestCancelRunningJob,
@@ -35,6 +36,7 @@ export default function JobDetailsPage({
 
   const jobInstances = jobs?.filter((j) => j.name === decodedName) || [];
   const currentJob = jobInstances[0];
+  const isCron = jobInstances.some((j) => j.status === "scheduled");
 
   async function handleCancel(job: UnifiedJob) {
     try {
@@ -51,8 +53,13 @@ export default function JobDetailsPage({
     }
   }
 
+  // A cron job's next run is moved, any other job gets a one-off run at that time
   async function handleReschedule(datetime: string) {
-    await scheduleJob(decodedName, datetime);
+    if (isCron) {
+      await rescheduleScheduledJob(decodedName, datetime);
+    } else {
+      await scheduleJob(decodedName, datetime);
+    }
     mutate();
   }
 
@@ -144,10 +151,10 @@ export default function JobDetailsPage({
 
         <Card>
           <CardHeader>
-            <CardTitle>Schedule Job</CardTitle>
+            <CardTitle>{isCron ? "Reschedule Next Run" : "Schedule Job"}</CardTitle>
           </CardHeader>
           <CardContent>
-            <RescheduleForm onSubmit={handleReschedule} label="Schedule" />
+            <RescheduleForm onSubmit={handleReschedule} label={isCron ? "Reschedule" : "Schedule"} />
           </CardContent>
         </Card>
       </div>
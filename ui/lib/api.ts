@@ -153,6 +153,13 @@ export async function scheduleJob(name: string, run_at: string): Promise<Success
   });
 }
 
+export async function rescheduleScheduledJob(name: string, run_at: string): Promise<SuccessResponse> {
+  return fetchApi(`/api/jobs/scheduled/${encodeURIComponent(name)}/reschedule`, {
+    method: "POST",
+    body: JSON.stringify({ run_at }),
+  });
+}
+
 export async function cancelPendingJob(name: string): Promise<SuccessResponse> {
   return fetchApi(`/api/jobs/pending/${encodeURIComponent(name)}`, {
     method: "DELETE",